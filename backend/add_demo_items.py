@@ -170,42 +170,21 @@ demo_items = [
 ]
 
 def add_demo_items():
-    """Add demo items to the database."""
+    """Add demo items to the database (items whose barcode already exists are skipped)."""
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
 
-    added_count = 0
-    skipped_count = 0
-
-    for item in demo_items:
-        # Check if item with this barcode already exists
-        existing = c.execute("SELECT id FROM items WHERE barcode = ?", (item["barcode"],)).fetchone()
-
-        if existing:
-            print(f"⚠️  Skipper {item['name']} - finnes allerede (barcode: {item['barcode']})")
-            skipped_count += 1
-            continue
-
-        try:
-            c.execute(
-                """
-                INSERT INTO items (name, description, barcode, category, location, quantity, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                """,
-                (
-                    item["name"],
-                    item["description"],
-                    item["barcode"],
-                    item["category"],
-                    item["location"],
-                    item["quantity"]
-                )
-            )
-            print(f"✓ Lagt til: {item['name']} ({item['quantity']} stk) - {item['category']}")
-            added_count += 1
-        except Exception as e:
-            print(f"✗ Feil ved å legge til {item['name']}: {e}")
-            skipped_count += 1
+    before = conn.total_changes
+    c.executemany(
+        """
+        INSERT INTO items (name, description, barcode, category, location, quantity, created_at, updated_at)
+        VALUES (:name, :description, :barcode, :category, :location, :quantity, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT(barcode) DO NOTHING
+        """,
+        demo_items
+    )
+    added_count = conn.total_changes - before
+    skipped_count = len(demo_items) - added_count
 
     conn.commit()
     conn.close()
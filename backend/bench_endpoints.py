@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot API endpoints against generated datasets and catch regressions.
+
+For every --scale a dataset is generated once (generate_data.py, cached in
+--data-dir), copied to a scratch database and served in-process through the
+Flask test client. Each endpoint gets --requests timed requests; the report has
+p50/p95/p99 latency and SQL statements per request.
+
+Results are written as JSON (--output) and compared with a baseline: a p95
+more than --tolerance slower (and at least --min-delta-ms), or more queries
+per request, is a regression and makes the script exit with status 1.
+
+Usage:
+    python bench_endpoints.py                           # 10k, compare with bench_baseline.json
+    python bench_endpoints.py --scales 10k,100k --requests 500
+    python bench_endpoints.py --save-baseline           # accept the current numbers
+
+Timings depend on the machine: save the baseline on the machine that runs
+the comparison. Queries per request do not.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import generate_data
+
+BASELINE = Path(__file__).resolve().parent / "bench_baseline.json"
+# Fixed reference date, so cached datasets and results stay comparable over time.
+DATASET_TODAY = date(2025, 3, 14)
+
+
+def dataset_path(data_dir, scale, seed):
+    """Generate the dataset for scale/seed once and return its (cached) path."""
+    path = Path(data_dir) / f"lager-{scale}-seed{seed}.db"
+    if path.exists():
+        return path
+    import server
+
+    print(f"→ Genererer datasett {scale} (seed {seed}) → {path}")
+    partial = path.with_suffix(".partial")
+    partial.unlink(missing_ok=True)
+    conn = server.connect_db(str(partial))
+    try:
+        server.run_migrations(conn)
+        generate_data.generate(conn, seed=seed, today=DATASET_TODAY, **generate_data.SCALES[scale])
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    partial.rename(path)
+    return path
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_case(client, requests, last_queries, on_response=None):
+    """Send (method, path, json) requests; return latency/query summary."""
+    timings, queries, errors = [], [], 0
+    gc.collect()
+    gc.disable()  # like timeit: collector pauses are noise for regression tracking
+    try:
+        for method, path, body in requests:
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            timings.append(time.perf_counter() - start)
+            queries.append(last_queries[0])
+            if response.status_code >= 400:
+                errors += 1
+            elif on_response:
+                on_response(response)
+            response.close()
+    finally:
+        gc.enable()
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "queries": round(statistics.fmean(queries), 2),
+    }
+
+
+def print_result(name, result):
+    print(f"  {name:26s} p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms"
+          f"  {result['queries']:5.1f} spørringer" + (f"  {result['errors']} feil" if result["errors"] else ""))
+
+
+def bench_scale(server, seed, n, last_queries):
+    """Run every endpoint case against the scratch copy of a dataset."""
+    conn = server.connect_db()
+    rng = random.Random(seed)
+    items = [r["barcode"] for r in conn.execute("SELECT barcode FROM items")]
+    users = [tuple(r) for r in conn.execute("SELECT barcode, name FROM users WHERE barcode IS NOT NULL")]
+    user_barcodes = dict(conn.execute("SELECT id, barcode FROM users").fetchall())
+    available = [r["barcode"] for r in conn.execute("SELECT barcode FROM items WHERE available > 0")]
+    conn.close()
+
+    public = server.app.test_client()
+    admin = server.app.test_client()
+    admin.post("/auth/login", json={"username": "admin", "password": os.environ.get("DEFAULT_ADMIN_PASSWORD", "1234")})
+    due = (date.today() + timedelta(days=14)).isoformat()
+
+    cases = [
+        ("POST /scan", public, [
+            ("POST", "/scan", {"barcode": rng.choice(items) if i % 2 else rng.choice(users)[0]}) for i in range(n)
+        ]),
+        ("GET /items", public, [("GET", "/items", None)] * n),
+        ("POST /users/search", public, [
+            ("POST", "/users/search", {"name": name[:rng.randint(2, 4)]}) for _, name in rng.choices(users, k=n)
+        ]),
+        ("GET /admin/loans", admin, [("GET", "/admin/loans", None)] * n),
+        ("GET /admin/flags", admin, [("GET", "/admin/flags", None)] * n),
+    ]
+    results = {}
+    for name, client, requests in cases:
+        for method, path, body in requests[:3]:  # warm-up (caches, user name index)
+            client.open(path, method=method, json=body).close()
+        results[name] = run_case(client, requests, last_queries)
+        print_result(name, results[name])
+
+    # Loans: check out distinct available items, then return the same loans.
+    loans = []
+    results["POST /loans"] = run_case(public, [
+        ("POST", "/loans", {"user_barcode": rng.choice(users)[0], "item_barcode": barcode, "due_date": due})
+        for barcode in rng.sample(available, min(n, len(available)))
+    ], last_queries, on_response=lambda response: loans.append(response.get_json()))
+    print_result("POST /loans", results["POST /loans"])
+    results["POST /loans/<id>/return"] = run_case(public, [
+        ("POST", f"/loans/{loan['id']}/return", {"user_barcode": user_barcodes[loan["user_id"]]}) for loan in loans
+    ], last_queries)
+    print_result("POST /loans/<id>/return", results["POST /loans/<id>/return"])
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Regressions of results against baseline: [(scale, endpoint, message)]."""
+    regressions = []
+    for scale, endpoints in results["scales"].items():
+        for name, current in endpoints.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(name)
+            if base is None:
+                continue
+            slower = current["p95_ms"] - base["p95_ms"]
+            if current["p95_ms"] > base["p95_ms"] * (1 + tolerance) and slower >= min_delta_ms:
+                regressions.append((scale, name, f"p95 {base['p95_ms']:.2f} → {current['p95_ms']:.2f} ms"))
+            if current["queries"] > base["queries"] + 0.5:
+                regressions.append((scale, name, f"spørringer {base['queries']} → {current['queries']}"))
+            if current["errors"] > base["errors"]:
+                regressions.append((scale, name, f"feil {base['errors']} → {current['errors']}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hot Lager API endpoints and compare with a baseline.")
+    parser.add_argument("--scales", default="10k", help="comma-separated: " + ", ".join(generate_data.SCALES))
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "lager-bench"),
+                        help="where generated datasets are cached")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore p95 slowdowns smaller than this")
+    args = parser.parse_args()
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in generate_data.SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    work = tempfile.TemporaryDirectory()
+    work_db = Path(work.name) / "bench.db"
+    os.environ["LAGER_DB"] = str(work_db)
+    import server  # reads LAGER_DB at import
+
+    last_queries = [0]
+
+    @server.app.after_request
+    def count_queries(response):
+        conn = server.g.get("db")
+        last_queries[0] = conn.queries if conn is not None else 0
+        return response
+
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "json_encoder": server.JSON_ENCODER,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "scales": {},
+    }
+    for scale in scales:
+        source = dataset_path(args.data_dir, scale, args.seed)
+        server.db_pool.close_all()
+        server.barcode_cache.clear()
+        server.user_index.invalidate()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{work_db}{suffix}").unlink(missing_ok=True)
+        shutil.copyfile(source, work_db)
+        server.init_db()
+        print(f"\n{scale}:")
+        results["scales"][scale] = bench_scale(server, args.seed, args.requests, last_queries)
+    server.db_pool.close_all()
+    work.cleanup()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResultater → {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Ny baseline → {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Ingen baseline ({args.baseline}); kjør med --save-baseline for å lage en.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+
+    print(f"\n{'='*60}")
+    if regressions:
+        for scale, name, message in regressions:
+            print(f"✗ REGRESJON {scale} {name}: {message}")
+        print(f"{len(regressions)} regresjon(er) mot {args.baseline}")
+    else:
+        print(f"Ingen regresjoner mot {args.baseline}")
+    print(f"{'='*60}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
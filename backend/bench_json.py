@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark the JSON response path: encoders, row shapes and compression.
+
+Builds a throwaway database with --items items and times GET /items through
+the Flask test client, so every number includes the query, serialization and
+(when negotiated) compression of a real request.
+
+Usage:
+    python bench_json.py                          # 10 000 items, 5 runs each
+    python bench_json.py --items 50000 --repeat 10
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON encoding and compression of GET /items.")
+    parser.add_argument("--items", type=int, default=10000, help="number of items to generate")
+    parser.add_argument("--repeat", type=int, default=5, help="timed requests per case")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["LAGER_DB"] = str(Path(tmp.name) / "bench.db")
+    import server  # reads LAGER_DB at import
+    from flask.json.provider import DefaultJSONProvider
+
+    class LegacyJSONProvider(DefaultJSONProvider):
+        """Flask's own encoder (sorted keys, ASCII escapes), as before the fast provider."""
+        default = staticmethod(
+            lambda o: dict(o) if isinstance(o, sqlite3.Row) else DefaultJSONProvider.default(o)
+        )
+
+    server.init_db()
+    conn = server.connect_db()
+    conn.executemany(
+        "INSERT INTO items (name, barcode, category, location, description, quantity) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"Gjenstand {i:06d} – blåbær", f"BENCH-{i:06d}", f"Kategori {i % 12}", f"Skap {i % 40}",
+          "Høyhastighets kabel for dataprojektorer og skjermer", 1 + i % 5) for i in range(args.items))
+    )
+    conn.commit()
+    conn.close()
+
+    fast_provider = server.app.json
+    client = server.app.test_client()
+    cases = [
+        ("Flask standard", LegacyJSONProvider(server.app), "stdlib", "", None),
+        ("stdlib kompakt", fast_provider, "stdlib", "", None),
+        ("orjson", fast_provider, "orjson", "", None),
+        ("orjson + ?shape=rows", fast_provider, "orjson", "?shape=rows", None),
+        ("orjson + gzip", fast_provider, "orjson", "", "gzip"),
+        ("orjson + ?shape=rows + gzip", fast_provider, "orjson", "?shape=rows", "gzip"),
+        ("orjson + ?shape=rows + br", fast_provider, "orjson", "?shape=rows", "br"),
+    ]
+
+    print(f"GET /items med {args.items} gjenstander, median av {args.repeat} kjøringer\n")
+    print(f"{'Variant':32s} {'ms':>9s} {'bytes':>11s} {'faktor':>8s}")
+    baseline = None
+    for label, provider, encoder, query, encoding in cases:
+        if encoder == "orjson" and server.orjson is None:
+            print(f"{label:32s} {'(orjson ikke installert)':>30s}")
+            continue
+        if encoding == "br" and server.brotli is None:
+            print(f"{label:32s} {'(brotli ikke installert)':>30s}")
+            continue
+        server.app.json = provider
+        server.JSON_ENCODER = encoder
+        headers = {"Accept-Encoding": encoding} if encoding else {}
+        client.get("/items" + query, headers=headers)  # warm-up
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            response = client.get("/items" + query, headers=headers)
+            timings.append(time.perf_counter() - start)
+        ms = statistics.median(timings) * 1000
+        baseline = baseline or ms
+        print(f"{label:32s} {ms:9.1f} {len(response.data):11d} {baseline / ms:7.1f}x")
+
+    server.app.json = fast_provider
+    server.db_pool.close_all()
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic, school-district sized dataset for scale testing.
+
+Users across class years, items across categories and locations, and years of
+loan history with realistic on-time / late / overdue returns and flags. The
+output is fully determined by --seed and --today, so benchmark runs compare
+like with like.
+
+Usage:
+    python generate_data.py --db /tmp/lager-100k.db --scale 100k
+    python generate_data.py --db /tmp/lager-1m.db --scale 1m --seed 7 --today 2025-03-14
+    python generate_data.py --db /tmp/x.db --users 500 --items 800 --loans 5000
+
+The database is created (and migrated) if needed; existing rows are kept and
+the generated ones are appended after them. Never point it at a production DB.
+
+generate(conn, ...) is also used directly by bench_endpoints.py and the tests.
+"""
+
+import argparse
+import bisect
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+# Rows per table for the named scales (loans dominate, like in production).
+SCALES = {
+    "10k": {"users": 800, "items": 1_500, "loans": 10_000},
+    "100k": {"users": 5_000, "items": 12_000, "loans": 100_000},
+    "1m": {"users": 30_000, "items": 80_000, "loans": 1_000_000},
+}
+
+FIRST_NAMES = (
+    "Emma", "Nora", "Sofie", "Ella", "Olivia", "Ingrid", "Sara", "Maja", "Leah", "Frida",
+    "Jakob", "Emil", "Noah", "Oliver", "Filip", "William", "Lucas", "Henrik", "Aksel", "Magnus",
+    "Øystein", "Åse", "Tiril", "Mathias", "Sindre", "Thea", "Jonas", "Mia", "Ida", "Kasper",
+)
+LAST_NAMES = (
+    "Hansen", "Johansen", "Olsen", "Larsen", "Andersen", "Pedersen", "Nilsen", "Kristiansen",
+    "Jensen", "Karlsen", "Johnsen", "Pettersen", "Eriksen", "Berg", "Haugen", "Hagen",
+    "Johannessen", "Andreassen", "Jacobsen", "Dahl", "Jørgensen", "Halvorsen", "Aasen", "Sæther",
+)
+CLASS_YEARS = tuple(f"{grade}{letter}" for grade in ("8", "9", "10", "VG1", "VG2", "VG3") for letter in "ABCDE")
+CATEGORIES = {
+    "Kabler": ("HDMI-kabel", "USB-C-kabel", "Ethernet-kabel", "DisplayPort-kabel", "Skjøteledning"),
+    "Datautstyr": ("Laptop", "Chromebook", "Nettbrett", "Mus", "Tastatur", "Dokkingstasjon"),
+    "Lyd og bilde": ("Hodetelefoner", "Høyttaler", "Projektor", "Kamera", "Mikrofon", "Stativ"),
+    "Lading": ("Lader USB-C", "Lader Lightning", "Powerbank", "Laderegg"),
+    "Verktøy": ("Loddebolt", "Multimeter", "Skrutrekkersett", "Limpistol"),
+    "Sport": ("Fotball", "Basketball", "Badmintonsett", "Stoppeklokke"),
+}
+LOCATIONS = tuple(f"Skap {row}{n}" for row in "ABCDEF" for n in range(1, 7)) + (
+    "Bibliotek", "IT-kontoret", "Gymsal", "Lærerværelset",
+)
+REPORT_MESSAGES = (
+    "Mangler ladekabel", "Sprukket skjerm", "Fungerte ikke", "Levert med skitt", "Løs kontakt",
+)
+
+# Returns relative to the due date: on time, late, very late (fractions of loans).
+LATE_RATE = 0.12
+VERY_LATE_RATE = 0.03
+# Share of late/overdue loans that got an overdue flag, and of returns with a report.
+OVERDUE_FLAG_RATE = 0.7
+REPORT_RATE = 0.01
+DEFECT_FLAG_RATE = 0.02
+
+
+def _stamp(dt):
+    return dt.isoformat(" ", "seconds")  # same text as CURRENT_TIMESTAMP, much faster than strftime
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _school_days(start, end):
+    """Weekdays in [start, end), without July (summer holiday)."""
+    days = []
+    day = start
+    while day < end:
+        if day.weekday() < 5 and day.month != 7:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _skewed_cum_weights(rng, n, alpha):
+    """Cumulative Pareto weights: a few popular rows, a long tail."""
+    total = 0.0
+    cum = []
+    for _ in range(n):
+        total += rng.paretovariate(alpha)
+        cum.append(total)
+    return cum
+
+
+def generate(conn, users, items, loans, seed=1, today=None, years=3, chunk_size=10_000, progress=None):
+    """
+    Bulk-insert a synthetic dataset into conn (a migrated Lager DB).
+
+    Rows get explicit ids after the current maximum, so the DB may already hold
+    data. Loans are inserted in loan_date order; the triggers keep stock, stats,
+    search and data versions in sync as for real writes. Returns row counts.
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+    say = progress or (lambda message: None)
+
+    def base_id(table):
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    conn.execute("PRAGMA synchronous = OFF")  # bulk load: durability only matters at the end
+    try:
+        counts = _generate(conn, rng, users, items, loans, today, now, years, chunk_size, say, base_id)
+        conn.commit()
+    finally:
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+    say("ANALYZE")
+    conn.execute("ANALYZE")
+    conn.commit()
+    return counts
+
+
+def _generate(conn, rng, n_users, n_items, n_loans, today, now, years, chunk_size, say, base_id):
+    user_base, item_base, loan_base = base_id("users"), base_id("items"), base_id("loans")
+    start_day = today - timedelta(days=365 * years)
+    created = _stamp(datetime.combine(start_day, datetime.min.time()))
+
+    say(f"{n_users} brukere")
+    user_rows = []
+    for n in range(1, n_users + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        user_rows.append((
+            user_base + n, f"{first} {last}", "user", f"GU{user_base + n:07d}", rng.choice(CLASS_YEARS),
+            f"{first}.{last}{n}@skole.example".lower() if rng.random() < 0.6 else None, created,
+        ))
+    for chunk in _chunks(user_rows, chunk_size):
+        conn.executemany(
+            "INSERT INTO users (id, name, role, barcode, class_year, email, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+
+    say(f"{n_items} gjenstander")
+    categories = list(CATEGORIES)
+    quantity = {}
+    item_rows = []
+    for n in range(1, n_items + 1):
+        category = rng.choice(categories)
+        stem = rng.choice(CATEGORIES[category])
+        roll = rng.random()
+        qty = 1 if roll < 0.8 else rng.randint(2, 5) if roll < 0.95 else rng.randint(10, 30)
+        quantity[item_base + n] = qty
+        item_rows.append((
+            item_base + n, f"{stem} {n:05d}", f"{stem} fra {category.lower()}-samlingen", f"GI{item_base + n:07d}",
+            category, rng.choice(LOCATIONS), qty, created,
+        ))
+    for chunk in _chunks(item_rows, chunk_size):
+        conn.executemany(
+            "INSERT INTO items (id, name, description, barcode, category, location, quantity, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+    conn.commit()
+
+    say(f"{n_loans} lån")
+    item_ids = list(quantity)
+    item_weights = _skewed_cum_weights(rng, len(item_ids), 1.5)
+    user_ids = [row[0] for row in user_rows]
+    user_weights = _skewed_cum_weights(rng, len(user_ids), 2.5)
+    days = _school_days(start_day, today + timedelta(days=1))
+    loan_days = sorted(rng.choices(range(len(days)), k=n_loans))
+
+    on_loan = dict.fromkeys(item_ids, 0)
+    stats = {"active": 0, "overdue": 0, "flags": 0}
+    flag_rows = []
+
+    def loan_rows():
+        for n, day_index in enumerate(loan_days, start=1):
+            loan_id = loan_base + n
+            loan_dt = datetime.combine(days[day_index], datetime.min.time()) + timedelta(
+                minutes=rng.randint(8 * 60, 15 * 60 + 30))
+            if loan_dt > now:
+                loan_dt = now - timedelta(minutes=rng.randint(1, 240))
+            item_id = item_ids[bisect.bisect_left(item_weights, rng.random() * item_weights[-1])]
+            user_id = user_ids[bisect.bisect_left(user_weights, rng.random() * user_weights[-1])]
+            roll = rng.random()
+            loan_days_allowed = 14 if roll < 0.7 else 7 if roll < 0.85 else 28
+            due = loan_dt.date() + timedelta(days=loan_days_allowed)
+
+            roll = rng.random()
+            if roll < VERY_LATE_RATE:
+                held = loan_days_allowed + rng.expovariate(1 / 45)
+            elif roll < VERY_LATE_RATE + LATE_RATE:
+                held = loan_days_allowed + rng.expovariate(1 / 7)
+            else:
+                held = rng.uniform(0.1, loan_days_allowed)
+            returned = loan_dt + timedelta(days=held)
+            if returned > now and on_loan[item_id] >= quantity[item_id]:
+                returned = loan_dt + (now - loan_dt) * rng.random()  # no copy left: returned early
+            return_date = None if returned > now else _stamp(returned)
+
+            late = (return_date is None and due < today) or (return_date is not None and returned.date() > due)
+            if return_date is None:
+                on_loan[item_id] += 1
+                stats["active"] += 1
+                stats["overdue"] += due < today
+            if late and rng.random() < OVERDUE_FLAG_RATE:
+                resolved = return_date is not None
+                flag_rows.append((
+                    item_id, user_id, str(loan_id), "overdue", f"Loan {loan_id} is overdue.",
+                    int(resolved), "ferdig" if resolved else None,
+                    _stamp(datetime.combine(due + timedelta(days=1), datetime.min.time()) + timedelta(hours=6)),
+                    return_date,
+                ))
+            if return_date is not None and rng.random() < REPORT_RATE:
+                resolved = returned < now - timedelta(days=14)
+                flag_rows.append((
+                    item_id, user_id, str(loan_id), "return_message", rng.choice(REPORT_MESSAGES),
+                    int(resolved), "ferdig" if resolved else "under_vurdering", return_date,
+                    _stamp(returned + timedelta(days=2)) if resolved else None,
+                ))
+            yield (loan_id, item_id, user_id, _stamp(loan_dt), due.isoformat(), return_date, _stamp(loan_dt))
+
+    done = 0
+    for chunk in _chunks(loan_rows(), chunk_size):
+        conn.executemany(
+            "INSERT INTO loans (id, item_id, user_id, loan_date, due_date, return_date, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+        done += len(chunk)
+        if done % (chunk_size * 10) == 0:
+            say(f"  {done}/{n_loans} lån")
+
+    for item_id in rng.sample(item_ids, int(len(item_ids) * DEFECT_FLAG_RATE)):
+        status = rng.choices(("under_vurdering", "ferdig", "avvist"), weights=(30, 60, 10))[0]
+        flagged = now - timedelta(days=rng.uniform(0, 365 * years))
+        flag_rows.append((
+            item_id, None, None, rng.choice(("defect", "missing_barcode")), rng.choice(REPORT_MESSAGES),
+            int(status != "under_vurdering"), status, _stamp(flagged),
+            _stamp(flagged + timedelta(days=3)) if status != "under_vurdering" else None,
+        ))
+    say(f"{len(flag_rows)} flagg")
+    flag_rows.sort(key=lambda row: row[7])
+    for chunk in _chunks(flag_rows, chunk_size):
+        conn.executemany(
+            "INSERT INTO flags (item_id, user_id, loan_id, flag_type, message, resolved, status, created_at, resolved_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk,
+        )
+    stats["flags"] = len(flag_rows)
+
+    return {
+        "users": n_users,
+        "items": n_items,
+        "loans": n_loans,
+        "active_loans": stats["active"],
+        "overdue_loans": stats["overdue"],
+        "flags": stats["flags"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Lager dataset for scale testing.")
+    parser.add_argument("--db", required=True, help="database file to create or extend")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    parser.add_argument("--users", type=int, help="override the scale's user count")
+    parser.add_argument("--items", type=int, help="override the scale's item count")
+    parser.add_argument("--loans", type=int, help="override the scale's loan count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(),
+                        help="reference date for active/overdue loans (YYYY-MM-DD, default: today)")
+    parser.add_argument("--years", type=int, default=3, help="years of loan history")
+    args = parser.parse_args()
+
+    os.environ["LAGER_DB"] = args.db
+    from server import connect_db, init_db  # reads LAGER_DB at import
+
+    sizes = {key: getattr(args, key) or value for key, value in SCALES[args.scale].items()}
+    init_db()
+    conn = connect_db()
+    started = time.perf_counter()
+    try:
+        counts = generate(conn, seed=args.seed, today=args.today, years=args.years,
+                          progress=lambda message: print(f"→ {message}"), **sizes)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'='*60}")
+    print(f"Ferdig! {counts['users']} brukere, {counts['items']} gjenstander, {counts['loans']} lån "
+          f"({counts['active_loans']} aktive, {counts['overdue_loans']} forfalt), {counts['flags']} flagg "
+          f"({elapsed:.1f}s) → {args.db}")
+    print(f"{'='*60}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
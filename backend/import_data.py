@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Bulk import items or users from CSV or NDJSON (upsert on barcode).
+
+Usage:
+    python import_data.py items items.csv
+    python import_data.py users students.ndjson
+    python import_data.py users - --format csv < students.csv
+
+CSV files need a header row; columns are the same as for
+POST /admin/import/<items|users>. Rows with errors are reported and skipped.
+"""
+
+import argparse
+import sys
+import time
+
+from server import DB_NAME, IMPORT_COLUMNS, connect_db, import_records, init_db, iter_import_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import items or users into the Lager database.")
+    parser.add_argument("table", choices=sorted(IMPORT_COLUMNS))
+    parser.add_argument("path", help="CSV/NDJSON file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"),
+                        help="default: ndjson for .ndjson/.jsonl files, otherwise csv")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    init_db()
+    conn = connect_db()
+    started = time.perf_counter()
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    try:
+        report = import_records(conn, args.table, iter_import_records(stream, fmt), args.chunk_size)
+    finally:
+        stream.close()
+        conn.close()
+    elapsed = time.perf_counter() - started
+
+    for error in report["errors"]:
+        print(f"✗ Linje {error['line']}: {error['error']}")
+    print(f"\n{'='*60}")
+    print(f"Ferdig! {report['upserted']} {args.table} importert/oppdatert, "
+          f"{report['failed']} feilet ({elapsed:.1f}s) → {DB_NAME}")
+    print(f"{'='*60}")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Load test a running Lager server the way the bell does: many scan stations at once.
+
+Each simulated station is a thread with its own keep-alive HTTP connection.
+It repeatedly picks an operation from --mix (scan / loan / return), sends it,
+then waits an exponentially distributed think time (mean --think seconds).
+All stations start at the same moment. Loans still open at the end are
+returned, so the database is left as it was found (apart from loan history).
+
+Reports throughput, latency percentiles per operation, and the rates of
+"database is locked", pool exhaustion, other 5xx, 4xx and connection errors,
+so DB_POOL_SIZE, server workers and the SQLite/WAL settings can be tuned with data.
+
+Needs only the standard library; works offline against a local server.
+
+Usage:
+    python load_test.py                                   # 20 stations, 30 s, http://127.0.0.1:5000
+    python load_test.py --stations 100 --duration 60 --think 0.5
+    python load_test.py --mix scan=50,loan=25,return=25 --json resultat.json
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+OPERATIONS = ("scan", "loan", "return")
+
+
+class Station(threading.Thread):
+    """One scan station: its own connection, borrower and open loans."""
+
+    def __init__(self, test, number):
+        super().__init__(name=f"station-{number}", daemon=True)
+        self.test = test
+        self.rng = random.Random(test.seed * 100_003 + number)
+        self.user_barcode = self.rng.choice(test.user_barcodes)
+        self.open_loans = []
+        self.conn = None
+
+    def request(self, op, method, path, body=None):
+        """Send one request; record its latency and outcome. Returns (status, parsed body)."""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data else {}
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = self.test.connect()
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            self.test.record(op, time.perf_counter() - start, None, b"")
+            return None, None
+        self.test.record(op, time.perf_counter() - start, response.status, payload)
+        try:
+            return response.status, json.loads(payload) if payload else None
+        except ValueError:
+            return response.status, None
+
+    def scan(self):
+        barcode = self.rng.choice(self.test.item_barcodes) if self.rng.random() < 0.7 else self.user_barcode
+        self.request("scan", "POST", "/scan", {"barcode": barcode})
+
+    def loan(self):
+        barcode = self.test.take_item()
+        if barcode is None:
+            return self.scan()
+        status, body = self.request("loan", "POST", "/loans", {
+            "user_barcode": self.user_barcode, "item_barcode": barcode, "due_date": self.test.due_date,
+        })
+        if status == 201:
+            self.open_loans.append((body["id"], barcode))
+        else:
+            self.test.put_item(barcode)
+
+    def return_(self):
+        if not self.open_loans:
+            return self.loan()
+        loan_id, barcode = self.open_loans.pop(self.rng.randrange(len(self.open_loans)))
+        status, _ = self.request("return", "POST", f"/loans/{loan_id}/return", {"user_barcode": self.user_barcode})
+        if status == 200:
+            self.test.put_item(barcode)
+        else:
+            self.open_loans.append((loan_id, barcode))
+
+    def run(self):
+        actions = {"scan": self.scan, "loan": self.loan, "return": self.return_}
+        ops, weights = zip(*self.test.mix.items())
+        self.test.start.wait()
+        while time.monotonic() < self.test.deadline:
+            actions[self.rng.choices(ops, weights)[0]]()
+            if self.test.think > 0:
+                time.sleep(self.rng.expovariate(1 / self.test.think))
+
+    def cleanup(self):
+        for loan_id, barcode in self.open_loans:
+            self.request("cleanup", "POST", f"/loans/{loan_id}/return", {"user_barcode": self.user_barcode})
+        if self.conn is not None:
+            self.conn.close()
+
+
+class LoadTest:
+    """Shared state of a run: target, item pool and the collected samples."""
+
+    def __init__(self, url, stations, duration, think, mix, seed=1, timeout=30):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.stations, self.duration, self.think, self.mix = stations, duration, think, mix
+        self.seed, self.timeout = seed, timeout
+        self.due_date = time.strftime("%Y-%m-%d", time.localtime(time.time() + 14 * 86400))
+        self._lock = threading.Lock()
+        self.samples = {}  # op -> [latency seconds]
+        self.outcomes = {}  # (op, outcome) -> count
+        self.start = threading.Event()
+        self.deadline = 0.0
+
+    def connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def fetch_json(self, path):
+        conn = self.connect()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"GET {path} → {response.status}")
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def prepare(self):
+        """Fetch barcodes of users and of items with a free copy (public endpoints)."""
+        users = self.fetch_json("/users?shape=rows")
+        items = self.fetch_json("/items?shape=rows")
+        barcode = users["columns"].index("barcode")
+        self.user_barcodes = [row[barcode] for row in users["rows"] if row[barcode]]
+        columns = {name: i for i, name in enumerate(items["columns"])}
+        self.item_barcodes = [row[columns["barcode"]] for row in items["rows"] if row[columns["barcode"]]]
+        free = [row[columns["barcode"]] for row in items["rows"]
+                if row[columns["barcode"]] and (row[columns["available"]] or 0) > 0]
+        random.Random(self.seed).shuffle(free)
+        self._free_items = free
+        if not self.user_barcodes or not self.item_barcodes:
+            raise RuntimeError("the server has no users or items with barcodes")
+
+    def take_item(self):
+        with self._lock:
+            return self._free_items.pop() if self._free_items else None
+
+    def put_item(self, barcode):
+        with self._lock:
+            self._free_items.append(barcode)
+
+    def record(self, op, seconds, status, payload):
+        if status is None:
+            outcome = "connection_error"
+        elif status >= 500:
+            text = payload.decode("utf-8", "replace").lower()
+            if "database is locked" in text or "database table is locked" in text:
+                outcome = "locked"
+            elif "pool exhausted" in text:
+                outcome = "pool_exhausted"
+            else:
+                outcome = "5xx"
+        elif status >= 400:
+            outcome = "4xx"
+        else:
+            outcome = "ok"
+        with self._lock:
+            if op != "cleanup":
+                self.samples.setdefault(op, []).append(seconds)
+            self.outcomes[(op, outcome)] = self.outcomes.get((op, outcome), 0) + 1
+
+    def run(self):
+        self.prepare()
+        stations = [Station(self, n) for n in range(self.stations)]
+        for station in stations:
+            station.start()
+        started = time.monotonic()
+        self.deadline = started + self.duration
+        self.start.set()  # the bell
+        for station in stations:
+            station.join()
+        elapsed = time.monotonic() - started
+        for station in stations:
+            station.cleanup()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        operations = {}
+        total = 0
+        for op, latencies in sorted(self.samples.items()):
+            latencies.sort()
+            count = len(latencies)
+            total += count
+            outcomes = {outcome: n for (o, outcome), n in self.outcomes.items() if o == op}
+            operations[op] = {
+                "requests": count,
+                "per_second": round(count / elapsed, 2),
+                "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+                "max_ms": round(latencies[-1] * 1000, 2),
+                "outcomes": outcomes,
+            }
+        errors = {}
+        for (op, outcome), n in self.outcomes.items():
+            if op != "cleanup" and outcome != "ok":
+                errors[outcome] = errors.get(outcome, 0) + n
+        return {
+            "stations": self.stations,
+            "duration_s": round(elapsed, 2),
+            "think_s": self.think,
+            "mix": self.mix,
+            "requests": total,
+            "per_second": round(total / elapsed, 2) if elapsed else 0.0,
+            "error_rates": {outcome: round(n / total, 4) for outcome, n in sorted(errors.items())} if total else {},
+            "operations": operations,
+        }
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(text):
+    """"scan=60,loan=20,return=20" → {"scan": 60.0, "loan": 20.0, "return": 20.0}"""
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r} (use {', '.join(OPERATIONS)})")
+        try:
+            mix[op] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight for {op} must be a number") from None
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many concurrent scan stations against a running Lager server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--stations", type=int, default=20, help="concurrent stations (threads)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between operations, seconds (0: none)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("scan=60,loan=20,return=20"))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout, seconds")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.stations, args.duration, args.think, args.mix, args.seed, args.timeout)
+    print(f"→ {args.stations} stasjoner mot {args.url} i {args.duration:g}s "
+          f"(tenketid {args.think:g}s, miks {', '.join(f'{k}={v:g}' for k, v in args.mix.items())})")
+    try:
+        report = test.run()
+    except (OSError, RuntimeError) as e:
+        print(f"✗ Kunne ikke starte: {e}")
+        return 2
+
+    print(f"\n{'Operasjon':10s} {'antall':>8s} {'per s':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'maks':>8s}  (ms)")
+    for op, r in report["operations"].items():
+        print(f"{op:10s} {r['requests']:8d} {r['per_second']:8.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['max_ms']:8.1f}")
+    print(f"\n{'='*60}")
+    print(f"{report['requests']} forespørsler, {report['per_second']:.1f}/s")
+    for outcome, rate in report["error_rates"].items():
+        print(f"✗ {outcome}: {rate:.2%}")
+    if not report["error_rates"]:
+        print("Ingen feil")
+    print(f"{'='*60}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Rapport → {args.json}")
+    failed = sum(rate for outcome, rate in report["error_rates"].items() if outcome != "4xx")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
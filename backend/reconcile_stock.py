@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Check that every item's on_loan count matches its active loans, and repair drift.
+
+Usage:
+    python reconcile_stock.py            # repair
+    python reconcile_stock.py --dry-run  # only report
+"""
+
+import argparse
+import sys
+
+from server import DB_NAME, connect_db, init_db, reconcile_stock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and repair item stock drift in the Lager database.")
+    parser.add_argument("--dry-run", action="store_true", help="only report, change nothing")
+    args = parser.parse_args()
+
+    init_db()
+    conn = connect_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        drift = reconcile_stock(conn, repair=not args.dry_run)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for d in drift:
+        print(f"✗ {d['name']} (id {d['item_id']}): on_loan={d['on_loan']}, aktive lån={d['active_loans']}")
+    print(f"\n{'='*60}")
+    if not drift:
+        print(f"Ingen avvik funnet → {DB_NAME}")
+    elif args.dry_run:
+        print(f"{len(drift)} avvik funnet (ikke rettet, --dry-run) → {DB_NAME}")
+    else:
+        print(f"{len(drift)} avvik rettet → {DB_NAME}")
+    print(f"{'='*60}")
+    return 1 if drift and args.dry_run else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Serve the Lager API with gevent, so open GET /events streams do not hold threads.
+
+Under a threaded WSGI server every Server-Sent Events stream keeps a worker
+thread parked in event_hub.wait() for as long as the admin page is open.
+Here the standard library is monkey-patched before the server module is
+imported: each request (and each waiting stream) is a greenlet, and an idle
+stream costs a socket and a few kilobytes. EVENTS_MAX_STREAMS therefore
+defaults to 1000 under this entry point instead of 50.
+
+SQLite calls still run on the event loop; they are short, but a long
+background job (GDPR cleanup, bulk import) delays other requests while it
+holds the loop between its chunks.
+
+Needs gevent (pip install gevent). Starts the same background work as
+`python server.py`: notification sender, interrupted jobs, user name index.
+
+Usage:
+    python serve_gevent.py                          # http://127.0.0.1:5000
+    python serve_gevent.py --host 0.0.0.0 --port 8000
+"""
+
+import sys
+
+try:
+    from gevent import monkey
+except ImportError:
+    sys.exit("✗ gevent er ikke installert: pip install gevent")
+
+# Before anything else is imported, so server.py gets the patched threading and sockets.
+monkey.patch_all()
+
+import argparse
+import os
+
+from gevent.pywsgi import WSGIServer
+
+os.environ.setdefault("EVENTS_MAX_STREAMS", "1000")
+import server  # reads EVENTS_MAX_STREAMS at import
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Lager API with gevent (cheap idle /events streams).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="0 picks a free port")
+    args = parser.parse_args()
+
+    server.setup_logging()
+    server.init_db()
+    server.notification_sender.start()
+    server.resume_jobs()
+    conn = server.connect_db()
+    server.user_index.load(conn)
+    conn.close()
+
+    httpd = WSGIServer((args.host, args.port), server.app)
+    httpd.start()
+    print(f"🚀 Starting Lager System API (gevent) on http://{args.host}:{httpd.server_port}", flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.stop()
+        server.notification_sender.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,11 +9,16 @@ Roles:
 
 Public operations (no login):
   - POST /scan: scan barcode → get item or user details
+  - POST /scan/batch: scan many barcodes in one request
   - POST /loans: create loan (user barcode + item barcode or ID)
+  - POST /loans/batch: check out several items to one user at once
   - POST /loans/<id>/return: return item (user barcode + item barcode or ID)
+  - POST /loans/return_batch: return several loans at once (loan IDs or item barcodes)
   - POST /loans/<id>/extend: extend loan (user barcode)
   - GET /items: list items (public view)
   - GET /users: list users (names + barcodes, no contact info)
+  - GET /search/items?q=: ranked prefix search over item text
+  - GET /search/users?q=: ranked prefix search over user names/classes
 
 Admin operations (login required):
   - GET /admin/users: list users (with contact info)
@@ -24,24 +29,55 @@ Admin operations (login required):
   - POST /admin/items: add item
   - PUT /admin/items/<id>: edit item
   - DELETE /admin/items/<id>: delete item
+  - POST /admin/reconcile_stock: detect/repair drift between stock and active loans
   - GET /admin/flags: list flags
   - PUT /admin/flags/<id>/resolve: resolve flag
-  - POST /admin/gdpr_cleanup: run cleanup
+  - POST /admin/import/<items|users>: bulk upsert from CSV/NDJSON
+  - GET /admin/export/<loans|items|users|flags>: streaming CSV/NDJSON export
+  - POST /admin/gdpr_cleanup: start cleanup (background job)
+  - GET /admin/jobs/<id>: background job status/progress
+  - GET /admin/stats: dashboard statistics (POST /admin/stats/recompute rebuilds them)
+  - GET /admin/pool_stats: DB connection pool statistics
+  - GET /admin/cache_stats: barcode cache / user name index statistics
+  - GET /admin/outbox: notification outbox status
+  - GET /events: Server-Sent Events stream of changes (resumable)
+  - POST /admin/outbox/<id>/retry: re-queue a dead-lettered notification
+  - GET /metrics: Prometheus metrics (latency, status codes, DB time, pool)
   - POST /auth/login: admin login
   - POST /auth/logout: admin logout
   - GET /auth/me: check admin session
+
+List endpoints accept ?shape=rows for a compact {"columns": [...], "rows": [[...]]}
+body. Large responses are gzip/brotli compressed when the client accepts it.
 """
 
+import csv
+import gzip
+import io
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
 import sqlite3
 from pathlib import Path
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import lru_cache, wraps
+import bisect
+import heapq
 import secrets
 import smtplib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 from email.message import EmailMessage
+from urllib.parse import quote
 
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, g, has_app_context, jsonify, make_response, request, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -54,7 +90,7 @@ cors_origins = os.environ.get(
     "CORS_ORIGINS",
     "http://localhost:5173,http://localhost:5174"
 ).split(",")
-CORS(app, origins=cors_origins, supports_credentials=True)
+CORS(app, origins=cors_origins, supports_credentials=True, expose_headers=["X-Next-After"])
 
 # Cookie / session settings:
 # - We need SameSite=None so что бы браузер отправлял куки с запросами
@@ -63,25 +99,666 @@ CORS(app, origins=cors_origins, supports_credentials=True)
 app.config["SESSION_COOKIE_SAMESITE"] = os.environ.get("SESSION_COOKIE_SAMESITE", "None")
 app.config["SESSION_COOKIE_SECURE"] = os.environ.get("SESSION_COOKIE_SECURE", "True").lower() in ("1", "true", "yes")
 
-# DB path at repo root
+# DB path at repo root (LAGER_DB overrides it, e.g. for tests)
 REPO_ROOT = Path(__file__).resolve().parents[2]
-DB_NAME = str(REPO_ROOT / "lager.db")
+DB_NAME = os.environ.get("LAGER_DB", str(REPO_ROOT / "lager.db"))
 
+# Connection tuning, applied once per pooled connection.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "16"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA cache_size = -{int(os.environ.get('SQLITE_CACHE_KB', '16384'))}",
+    f"PRAGMA mmap_size = {int(os.environ.get('SQLITE_MMAP_MB', '128')) * 1024 * 1024}",
+    f"PRAGMA busy_timeout = {int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))}",
+    "PRAGMA temp_store = MEMORY",
+)
 
-def get_db():
-    """Get a DB connection with row factory."""
-    conn = sqlite3.connect(DB_NAME)
+
+# Opt-in SQL profiler (see SQLProfile): per-statement timings, N+1 and slow-query log.
+SQL_PROFILE = os.environ.get("SQL_PROFILE", "false").lower() in ("1", "true", "yes")
+SQL_SLOW_MS = float(os.environ.get("SQL_SLOW_MS", "100"))
+# A statement shape run this many times in one request is reported as N+1.
+SQL_REPEAT_THRESHOLD = int(os.environ.get("SQL_REPEAT_THRESHOLD", "5"))
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that counts the statements it runs and their execution
+    time (excluding row fetching). Request metrics read and reset the counters.
+    While a SQLProfile is attached (profile), statements go through a
+    ProfiledCursor that records each one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.profile = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (TimedCursor if self.profile is None else ProfiledCursor))
+
+    def execute(self, *args):
+        if self.profile is not None:
+            return self.cursor().execute(*args)
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+    def executemany(self, *args):
+        if self.profile is not None:
+            return self.cursor().executemany(*args)
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor counterpart of TimedConnection (for conn.cursor().execute())."""
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            self.connection.queries += 1
+            self.connection.query_seconds += time.perf_counter() - start
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            self.connection.queries += 1
+            self.connection.query_seconds += time.perf_counter() - start
+
+
+class ProfiledCursor(TimedCursor):
+    """TimedCursor that records each statement, with fetch time and rows, in the connection's SQLProfile."""
+
+    _entry = None
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            self._entry = self.connection.profile.record(sql, time.perf_counter() - start, max(self.rowcount, 0))
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            self._entry = self.connection.profile.record(sql, time.perf_counter() - start, max(self.rowcount, 0))
+
+    def _fetched(self, start, rows):
+        if self._entry is not None:
+            self._entry[1] += time.perf_counter() - start
+            self._entry[2] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Statement shape: whitespace collapsed, literals and IN/VALUES lists replaced by ?."""
+    sql = _SQL_LITERALS.sub("?", " ".join(sql.split()))
+    return _SQL_VALUE_LISTS.sub("(?, ...)", sql)
+
+
+class SQLProfile:
+    """
+    Statements run on one request's connection: [shape, seconds, rows] each,
+    where seconds includes fetching. Attached by get_db() when SQL_PROFILE is on.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def record(self, sql, seconds, rows):
+        entry = [normalize_sql(sql), seconds, rows]
+        self.statements.append(entry)
+        return entry
+
+    @property
+    def total_seconds(self):
+        return sum(entry[1] for entry in self.statements)
+
+    def repeated(self, threshold=None):
+        """[(shape, count)] for shapes run at least threshold times (likely N+1), most first."""
+        threshold = threshold or SQL_REPEAT_THRESHOLD
+        counts = {}
+        for shape, _, _ in self.statements:
+            counts[shape] = counts.get(shape, 0) + 1
+        return sorted(((s, n) for s, n in counts.items() if n >= threshold), key=lambda sn: -sn[1])
+
+    def slow(self, threshold_ms=None):
+        limit = (SQL_SLOW_MS if threshold_ms is None else threshold_ms) / 1000
+        return [entry for entry in self.statements if entry[1] >= limit]
+
+    def server_timing(self):
+        desc = f"{len(self.statements)} queries"
+        repeated = self.repeated()
+        if repeated:
+            desc += f", {len(repeated)} repeated"
+        return f'db;dur={self.total_seconds * 1000:.2f};desc="{desc}"'
+
+
+def connect_db(path=None):
+    """Open a new, fully configured DB connection with row factory."""
+    conn = sqlite3.connect(path or DB_NAME, check_same_thread=False, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-def init_db():
-    """Initialize database schema. Idempotent."""
-    conn = get_db()
-    c = conn.cursor()
+class ConnectionPool:
+    """
+    Bounded pool of pre-configured SQLite connections.
+
+    Connections are opened lazily up to max_size and handed out LIFO, so the
+    most recently used connection (with the warmest page cache) is reused first.
+    A request holds at most one connection; when all are busy, acquire() waits.
+    """
+
+    def __init__(self, db_path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self):
+        with self._cond:
+            if not self._idle and self._open >= self.max_size:
+                self.waits += 1
+                ready = self._cond.wait_for(
+                    lambda: self._idle or self._open < self.max_size, self.timeout
+                )
+                if not ready:
+                    self.timeouts += 1
+                    raise sqlite3.OperationalError("connection pool exhausted")
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self._open += 1
+            self.misses += 1
+
+        try:
+            return connect_db(self.db_path)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything left open."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it instead of handing it out again.
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        """Close all idle connections, e.g. before swapping out the DB file."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+
+
+db_pool = ConnectionPool(DB_NAME)
+
+
+def get_db():
+    """
+    Get the DB connection for the current app context.
+
+    Inside a request this borrows one pooled connection, cached on flask.g and
+    released automatically on teardown. Outside an app context it returns a new
+    connection that the caller must close.
+    """
+    if not has_app_context():
+        return connect_db()
+    if "db" not in g:
+        g.db = db_pool.acquire()
+        g.db.queries, g.db.query_seconds = 0, 0.0  # per-request counters for metrics
+        if SQL_PROFILE:
+            g.db.profile = SQLProfile()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.profile = None
+        db_pool.release(conn)
+
+
+# ============================================================================
+# RESPONSE ENCODING (JSON + compression)
+# ============================================================================
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# JSON_ENCODER=stdlib forces the stdlib encoder even when orjson is installed.
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "orjson" if orjson else "stdlib")
+if JSON_ENCODER == "orjson" and orjson is None:
+    JSON_ENCODER = "stdlib"
+# Bodies smaller than this are sent uncompressed (not worth the CPU or the header).
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "5"))  # gzip 1-9, brotli 0-11
+COMPRESS_MIMETYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+
+def _json_default(obj):
+    """
+    Encode what the JSON libraries do not know: sqlite3.Row becomes an object,
+    everything else (dates, Decimal, UUID, dataclasses) is encoded as by Flask.
+    """
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    return DefaultJSONProvider.default(obj)
+
+
+# Dates go through _json_default with orjson too, so both encoders write them the same way.
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+
+def encode_json(obj):
+    """Serialize obj to compact UTF-8 JSON bytes with the configured encoder."""
+    if JSON_ENCODER == "orjson":
+        return orjson.dumps(obj, default=_json_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() through encode_json(): orjson when installed, compact stdlib JSON
+    otherwise. Keys keep their column order instead of being sorted.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault("default", _json_default)
+            return json.dumps(obj, **kwargs)
+        return encode_json(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(encode_json(obj), mimetype=self.mimetype)
+
+
+app.json = FastJSONProvider(app)
 
+
+def query_rows(conn, sql, params=()):
+    """
+    Run a list query for a JSON response.
+
+    With ?shape=rows the rows are sent as arrays, {"columns": [...], "rows":
+    [[...], ...]}: the cursor returns plain tuples that go to the encoder as-is
+    (no per-row dict, about half the bytes). Otherwise returns the sqlite3.Row
+    list, which the JSON provider writes as objects.
+    """
+    cur = conn.cursor()
+    if request.args.get("shape") == "rows":
+        cur.row_factory = None
+        rows = cur.execute(sql, params).fetchall()
+        return {"columns": [d[0] for d in cur.description], "rows": rows}
+    return cur.execute(sql, params).fetchall()
+
+
+def negotiate_encoding():
+    """Best Content-Encoding the client accepts: br (if available), then gzip, else None."""
+    accept = request.accept_encodings
+    if brotli is not None and accept.quality("br") > 0:
+        return "br"
+    if accept.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large buffered text/JSON responses for clients that accept it."""
+    if (
+        response.mimetype not in COMPRESS_MIMETYPES
+        or response.direct_passthrough
+        or response.is_streamed
+        or not 200 <= response.status_code < 300
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None or response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+
+    body = response.get_data()
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=COMPRESS_LEVEL))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = encoding
+    # A compressed body is a different representation: give it its own strong ETag.
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+# ============================================================================
+# METRICS & LOGGING
+# ============================================================================
+
+# Upper bounds (seconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Optional bearer token for GET /metrics (unset: open, like most scrape targets).
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Fraction of requests written to the structured request log.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+logger = logging.getLogger("lager")
+
+
+class JSONLogFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, event and the record's fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(stream=None):
+    """
+    Send the "lager" logger to stream (default stderr) as JSON lines. Records
+    are queued and written by a background thread, so request threads never
+    block on log I/O. Returns the started QueueListener.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JSONLogFormatter())
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def log_event(event, level=logging.INFO, sampled=False, **fields):
+    """Structured log record; sampled=True keeps only LOG_SAMPLE_RATE of them."""
+    if sampled and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class Metrics:
+    """
+    In-process request metrics, rendered in the Prometheus text format.
+
+    Series are keyed by (method, route template), so cardinality is bounded by
+    the URL map; unmatched paths share the route label "unmatched".
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._latency = {}    # (method, route) -> [bucket counts..., +Inf count, sum]
+        self._responses = {}  # (method, route, status) -> count
+        self._db = {}         # (method, route) -> [queries, seconds]
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe(self, method, route, status, seconds, queries=0, db_seconds=0.0):
+        key = (method, route)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            latency[index] += 1
+            latency[-1] += seconds
+            self._responses[(method, route, status)] = self._responses.get((method, route, status), 0) + 1
+            db = self._db.setdefault(key, [0, 0.0])
+            db[0] += queries
+            db[1] += db_seconds
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._responses.clear()
+            self._db.clear()
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) of all series."""
+        with self._lock:
+            in_flight = self.in_flight
+            latency = {k: list(v) for k, v in self._latency.items()}
+            responses = dict(self._responses)
+            db = {k: list(v) for k, v in self._db.items()}
+        pool = db_pool.stats()
+
+        lines = [
+            "# HELP lager_http_requests_in_flight Requests currently being handled.",
+            "# TYPE lager_http_requests_in_flight gauge",
+            f"lager_http_requests_in_flight {in_flight}",
+            "# HELP lager_http_request_duration_seconds Request latency by route.",
+            "# TYPE lager_http_request_duration_seconds histogram",
+        ]
+        for (method, route), counts in sorted(latency.items()):
+            labels = _metric_labels(method=method, route=route)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'lager_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"lager_http_request_duration_seconds_sum{{{labels}}} {counts[-1]:.6f}")
+            lines.append(f"lager_http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+        lines += [
+            "# HELP lager_http_responses_total Responses by route and status code.",
+            "# TYPE lager_http_responses_total counter",
+        ]
+        for (method, route, status), count in sorted(responses.items()):
+            lines.append(f"lager_http_responses_total{{{_metric_labels(method=method, route=route, status=status)}}} {count}")
+
+        lines += [
+            "# HELP lager_db_queries_total SQL statements executed by route.",
+            "# TYPE lager_db_queries_total counter",
+        ]
+        lines += [f"lager_db_queries_total{{{_metric_labels(method=m, route=r)}}} {q}" for (m, r), (q, _) in sorted(db.items())]
+        lines += [
+            "# HELP lager_db_query_seconds_total Time spent executing SQL statements by route.",
+            "# TYPE lager_db_query_seconds_total counter",
+        ]
+        lines += [f"lager_db_query_seconds_total{{{_metric_labels(method=m, route=r)}}} {s:.6f}" for (m, r), (_, s) in sorted(db.items())]
+
+        lines += [
+            "# HELP lager_db_pool_connections Pooled DB connections by state.",
+            "# TYPE lager_db_pool_connections gauge",
+            f'lager_db_pool_connections{{state="in_use"}} {pool["in_use"]}',
+            f'lager_db_pool_connections{{state="idle"}} {pool["idle"]}',
+            "# HELP lager_db_pool_waits_total Acquires that had to wait for a free connection.",
+            "# TYPE lager_db_pool_waits_total counter",
+            f"lager_db_pool_waits_total {pool['waits']}",
+            "# HELP lager_db_pool_timeouts_total Acquires that gave up waiting.",
+            "# TYPE lager_db_pool_timeouts_total counter",
+            f"lager_db_pool_timeouts_total {pool['timeouts']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _metric_labels(**labels):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+
+
+metrics = Metrics()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    conn = g.get("db")
+    queries, db_seconds = (conn.queries, conn.query_seconds) if conn is not None else (0, 0.0)
+    metrics.observe(request.method, route, response.status_code, seconds, queries, db_seconds)
+    # Sample before touching the session: reading it adds "Vary: Cookie" to the response.
+    if random.random() < LOG_SAMPLE_RATE:
+        log_event("request", method=request.method, route=route, status=response.status_code,
+                  ms=round(seconds * 1000, 2), queries=queries, db_ms=round(db_seconds * 1000, 2),
+                  admin_id=session.get("admin_id"))
+    return response
+
+
+@app.after_request
+def report_sql_profile(response):
+    """With SQL_PROFILE on: Server-Timing totals, plus N+1 and slow-query log records."""
+    conn = g.get("db")
+    profile = conn.profile if conn is not None else None
+    if profile is None:
+        return response
+    response.headers.add("Server-Timing", profile.server_timing())
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    for shape, count in profile.repeated():
+        log_event("sql_repeated", level=logging.WARNING, method=request.method, route=route,
+                  statement=shape, count=count)
+    for shape, seconds, rows in profile.slow():
+        log_event("slow_query", level=logging.WARNING, method=request.method, route=route,
+                  statement=shape, ms=round(seconds * 1000, 2), rows=rows)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if g.pop("request_start", None) is not None:
+        metrics.finish()
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (Bearer METRICS_TOKEN when configured)."""
+    if METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ============================================================================
+# SCHEMA MIGRATIONS
+# ============================================================================
+#
+# Each migration is applied once, in order, inside its own transaction, and
+# PRAGMA user_version records the last one applied. Never edit a migration
+# that has shipped; append a new one instead.
+
+def _add_missing_columns(conn, table, columns):
+    """ALTER TABLE ADD COLUMN for each (name, type) not yet present on table."""
+    existing = {row["name"] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+    for col, col_type in columns:
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def _migration_1_base_schema(conn):
+    """Base tables (also upgrades databases created before migrations existed)."""
     # Users: admin + regular users. Both have barcode (not universally required password).
-    c.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -99,7 +776,7 @@ def init_db():
     ''')
 
     # Items: all items have barcode.
-    c.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -116,7 +793,7 @@ def init_db():
     ''')
 
     # Loans: track who borrowed what and when.
-    c.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS loans (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         item_id INTEGER NOT NULL,
@@ -133,16 +810,12 @@ def init_db():
         FOREIGN KEY(user_id) REFERENCES users(id)
     )
     ''')
-
-    # Add new columns if they don't exist
-    for col in ['delivery_status', 'delivery_notes', 'report']:
-        try:
-            c.execute(f"ALTER TABLE loans ADD COLUMN {col} TEXT")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+    _add_missing_columns(conn, "loans", [
+        ("delivery_status", "TEXT"), ("delivery_notes", "TEXT"), ("report", "TEXT"),
+    ])
 
     # Flags: system issues (missing barcode, defects, overdue, etc).
-    c.execute('''
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS flags (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         item_id INTEGER,
@@ -158,16 +831,352 @@ def init_db():
         FOREIGN KEY(created_by) REFERENCES users(id)
     )
     ''')
+    # Admin resolution notes and status (added later on older databases).
+    _add_missing_columns(conn, "flags", [
+        ("resolution_notes", "TEXT"), ("status", "TEXT"), ("loan_id", "TEXT"),
+    ])
+
+
+# Sort key for the admin flag inbox: open flags first, then done, then the rest.
+FLAGS_INBOX_RANK = """
+    CASE
+      WHEN status = 'under_vurdering' OR resolved = 0 THEN 0
+      WHEN status = 'ferdig' OR resolved = 1 THEN 1
+      ELSE 2
+    END"""
+
+
+def _migration_2_hot_query_indexes(conn):
+    """Secondary indexes for the scan, loan, overdue and inbox queries."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_active_item ON loans(item_id) WHERE return_date IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_active_due ON loans(due_date) WHERE return_date IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_user_date ON loans(user_id, loan_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_item_date ON loans(item_id, loan_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_name ON items(name, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_category ON items(category, name, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_class ON users(class_year, name)")
+    # Virtual generated column so the inbox ORDER BY can be served by an index.
+    _add_missing_columns(conn, "flags", [
+        ("inbox_rank", f"INTEGER GENERATED ALWAYS AS ({FLAGS_INBOX_RANK}) VIRTUAL"),
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_flags_inbox ON flags(inbox_rank, created_at DESC)")
+
+
+def _migration_3_notification_outbox(conn):
+    """Outbox for email notifications, drained by the background sender."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        recipients TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        sent_at TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(next_attempt_at) WHERE status = 'pending'")
 
-    # Optional columns for admin resolution notes and status (added later, so use ALTER TABLE).
-    for col in ['resolution_notes', 'status', 'loan_id']:
-        try:
-            c.execute(f"ALTER TABLE flags ADD COLUMN {col} TEXT")
-        except sqlite3.OperationalError:
-            # Column probably already exists – safe to ignore.
-            pass
 
-    conn.commit()
+def _migration_4_flag_loan_index(conn):
+    """Index flags by loan (for idempotent overdue flagging); backfill old overdue flags."""
+    conn.execute(
+        "UPDATE flags SET loan_id = substr(message, 6, instr(message, ' is overdue.') - 6) "
+        "WHERE flag_type = 'overdue' AND loan_id IS NULL AND message LIKE 'Loan % is overdue.'"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_flags_loan ON flags(loan_id, flag_type)")
+
+
+def _migration_5_jobs(conn):
+    """Background jobs with a persisted cursor, so they can resume after a crash."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        params TEXT,
+        cursor INTEGER NOT NULL DEFAULT 0,
+        progress TEXT,
+        error TEXT,
+        created_by INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_unfinished ON jobs(kind) WHERE status IN ('queued', 'running')")
+
+
+# Full-text indexed columns per table. The *_fts tables are external-content
+# FTS5 indexes (they store no copy of the text) kept in sync by triggers.
+FTS_COLUMNS = {
+    "users": ("name", "class_year"),
+    "items": ("name", "description", "category", "location"),
+}
+
+
+def _migration_6_full_text_search(conn):
+    """FTS5 indexes over user and item text, kept in sync by triggers."""
+    for table, columns in FTS_COLUMNS.items():
+        cols = ", ".join(columns)
+        new_values = ", ".join(f"new.{c}" for c in columns)
+        old_values = ", ".join(f"old.{c}" for c in columns)
+        # remove_diacritics 2: "Ase" finds "Åse"; prefix='2 3' keeps short prefix queries cheap.
+        conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+            {cols}, content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new_values});
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+        END
+        """)
+        # Only re-index when an indexed column changes (not on every status/quantity update).
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {table}_fts({table}_fts, rowid, {cols}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {table}_fts(rowid, {cols}) VALUES (new.id, {new_values});
+        END
+        """)
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+# Tables whose writes bump their counter in data_versions (see conditional_get).
+VERSIONED_TABLES = ("users", "items", "loans", "flags")
+
+
+def _migration_7_data_versions(conn):
+    """Per-table change counters, bumped by triggers, behind the list endpoint ETags."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    # Random per database, so a re-created database never repeats old ETags.
+    conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('epoch', ?)", (secrets.randbits(48),))
+    for table in VERSIONED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO data_versions (name) VALUES (?)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+            END
+            """)
+
+
+def _migration_8_events(conn):
+    """Change event log behind GET /events (ids are the client resume cursor)."""
+    # AUTOINCREMENT: ids are never reused after old events are pruned.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _migration_9_item_stock(conn):
+    """Stock split: quantity is the total, on_loan is kept by triggers on loans, available derived."""
+    _add_missing_columns(conn, "items", [
+        ("on_loan", "INTEGER NOT NULL DEFAULT 0"),
+        ("available", "INTEGER GENERATED ALWAYS AS (COALESCE(quantity, 0) - on_loan) VIRTUAL"),
+    ])
+    # Until now quantity was decremented per active loan; turn it back into the total.
+    conn.execute('''
+    UPDATE items SET on_loan = active.n, quantity = COALESCE(quantity, 0) + active.n
+    FROM (SELECT item_id, COUNT(*) AS n FROM loans WHERE return_date IS NULL GROUP BY item_id) AS active
+    WHERE items.id = active.item_id
+    ''')
+    # Refuse a loan that would take availability below zero (no check-then-insert race).
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS loans_stock_check BEFORE INSERT ON loans
+    WHEN new.return_date IS NULL AND (SELECT available FROM items WHERE id = new.item_id) < 1
+    BEGIN
+        SELECT RAISE(ABORT, 'item not available');
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS loans_stock_insert AFTER INSERT ON loans
+    WHEN new.return_date IS NULL
+    BEGIN
+        UPDATE items SET on_loan = on_loan + 1 WHERE id = new.item_id;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS loans_stock_update AFTER UPDATE OF item_id, return_date ON loans
+    WHEN old.return_date IS NULL OR new.return_date IS NULL
+    BEGIN
+        UPDATE items SET on_loan = on_loan - 1 WHERE id = old.item_id AND old.return_date IS NULL;
+        UPDATE items SET on_loan = on_loan + 1 WHERE id = new.item_id AND new.return_date IS NULL;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS loans_stock_delete AFTER DELETE ON loans
+    WHEN old.return_date IS NULL
+    BEGIN
+        UPDATE items SET on_loan = on_loan - 1 WHERE id = old.item_id;
+    END
+    ''')
+
+
+def _stats_bump(kind, key, delta, when="1"):
+    """Trigger statement: add delta to the stats row (kind, key) when `when` holds."""
+    return (
+        f"INSERT INTO stats (kind, key, value) SELECT '{kind}', {key}, {delta} WHERE {when} "
+        f"ON CONFLICT(kind, key) DO UPDATE SET value = value + excluded.value;"
+    )
+
+
+def _stats_active_loan(row, sign):
+    """Trigger statements counting loan `row` (new/old) in or out of the active-loan stats."""
+    active = f"{row}.return_date IS NULL"
+    user_class = f"COALESCE((SELECT class_year FROM users WHERE id = {row}.user_id), '')"
+    return "\n".join([
+        _stats_bump("count", "'active_loans'", sign, active),
+        _stats_bump("due", f"COALESCE({row}.due_date, '')", sign, active),
+        _stats_bump("class", user_class, sign, active),
+    ])
+
+
+def _migration_10_dashboard_stats(conn):
+    """Summary table behind GET /admin/stats, kept current by triggers."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats (
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (kind, key)
+    ) WITHOUT ROWID
+    ''')
+    triggers = {
+        # Active loans, in total, per due date (for overdue) and per borrower class
+        "loans_stats_insert": ("AFTER INSERT ON loans", _stats_active_loan("new", 1)),
+        "loans_stats_update": ("AFTER UPDATE OF return_date, due_date, user_id ON loans",
+                               _stats_active_loan("old", -1) + "\n" + _stats_active_loan("new", 1)),
+        "loans_stats_delete": ("AFTER DELETE ON loans", _stats_active_loan("old", -1)),
+        # Items out per category follow items.on_loan (itself kept by the loans_stock_* triggers)
+        "items_stats_insert": ("AFTER INSERT ON items", "\n".join([
+            _stats_bump("count", "'items'", 1),
+            _stats_bump("category", "COALESCE(new.category, '')", "new.on_loan", "new.on_loan != 0"),
+        ])),
+        "items_stats_update": ("AFTER UPDATE OF on_loan, category ON items", "\n".join([
+            _stats_bump("category", "COALESCE(old.category, '')", "-old.on_loan", "old.on_loan != 0"),
+            _stats_bump("category", "COALESCE(new.category, '')", "new.on_loan", "new.on_loan != 0"),
+        ])),
+        "items_stats_delete": ("AFTER DELETE ON items", "\n".join([
+            _stats_bump("count", "'items'", -1),
+            _stats_bump("category", "COALESCE(old.category, '')", "-old.on_loan", "old.on_loan != 0"),
+        ])),
+        # A user changing class takes their active loans along
+        "users_stats_insert": ("AFTER INSERT ON users", _stats_bump("count", "'users'", 1)),
+        "users_stats_update": ("AFTER UPDATE OF class_year ON users", "\n".join([
+            _stats_bump("class", "COALESCE(old.class_year, '')",
+                        "-(SELECT COUNT(*) FROM loans WHERE user_id = old.id AND return_date IS NULL)"),
+            _stats_bump("class", "COALESCE(new.class_year, '')",
+                        "(SELECT COUNT(*) FROM loans WHERE user_id = new.id AND return_date IS NULL)"),
+        ])),
+        "users_stats_delete": ("AFTER DELETE ON users", _stats_bump("count", "'users'", -1)),
+        # Open flags: the ones ranked first in the inbox
+        "flags_stats_insert": ("AFTER INSERT ON flags",
+                               _stats_bump("count", "'open_flags'", 1, "new.inbox_rank = 0")),
+        "flags_stats_update": ("AFTER UPDATE OF status, resolved ON flags",
+                               _stats_bump("count", "'open_flags'", "(new.inbox_rank = 0) - (old.inbox_rank = 0)")),
+        "flags_stats_delete": ("AFTER DELETE ON flags",
+                               _stats_bump("count", "'open_flags'", -1, "old.inbox_rank = 0")),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN\n{body}\nEND")
+    recompute_stats(conn)
+
+
+def _migration_11_item_quantity_floor(conn):
+    """Refuse setting an item's total quantity below the copies currently on loan."""
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS items_quantity_check BEFORE UPDATE OF quantity ON items
+    WHEN COALESCE(new.quantity, 0) < new.on_loan
+    BEGIN
+        SELECT RAISE(ABORT, 'quantity below on_loan');
+    END
+    ''')
+
+
+def _migration_12_job_leases(conn):
+    """Job leases: the runner that claimed a job, and until when its claim holds."""
+    _add_missing_columns(conn, "jobs", [
+        ("lease_owner", "TEXT"),
+        ("lease_expires_at", "TEXT"),
+    ])
+
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_hot_query_indexes,
+    _migration_3_notification_outbox,
+    _migration_4_flag_loan_index,
+    _migration_5_jobs,
+    _migration_6_full_text_search,
+    _migration_7_data_versions,
+    _migration_8_events,
+    _migration_9_item_stock,
+    _migration_10_dashboard_stats,
+    _migration_11_item_quantity_floor,
+    _migration_12_job_leases,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def run_migrations(conn):
+    """
+    Apply pending migrations, one transaction each, then refresh planner stats.
+    Returns the number of migrations applied (0 when the schema is current).
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return 0
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage transactions explicitly (DDL included)
+    applied = 0
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock: another worker may have won the race.
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied += 1
+            print(f"✓ Migration {version} applied: {migration.__doc__}")
+        if applied:
+            conn.execute("ANALYZE")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def init_db():
+    """Bring the schema up to date and ensure the admin user exists. Idempotent."""
+    conn = connect_db()
+    run_migrations(conn)
 
     # Ensure admin user exists
     admin_exists = conn.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone()
@@ -192,53 +1201,979 @@ def admin_required(fn):
     """Decorator: check if user is logged in as admin."""
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        print(f"DEBUG: admin_required - request.cookies: {request.cookies}")
-        print(f"DEBUG: admin_required - session.get('is_admin'): {session.get('is_admin')}")
         if not session.get("is_admin"):
+            log_event("admin_denied", level=logging.WARNING, sampled=True, method=request.method, path=request.path)
             return jsonify({"error": "Admin authentication required"}), 401
         return fn(*args, **kwargs)
     return wrapper
 
 
-def send_notification(subject: str, body: str, to_addrs: list | None = None):
-    """Send email notification. Respects NOTIFICATIONS_ENABLED env var."""
-    if os.environ.get("NOTIFICATIONS_ENABLED", "false").lower() not in ("1", "true", "yes"):
-        return False
+# ============================================================================
+# NOTIFICATIONS (transactional outbox + background sender)
+# ============================================================================
+
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "50"))
+NOTIFY_POLL_SECONDS = float(os.environ.get("NOTIFY_POLL_SECONDS", "10"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "6"))
+NOTIFY_RETRY_BASE_SECONDS = int(os.environ.get("NOTIFY_RETRY_BASE_SECONDS", "30"))
+# How long a claimed message stays invisible to other senders while being sent.
+NOTIFY_LEASE_SECONDS = 120
+
 
-    smtp_host = os.environ.get("SMTP_HOST")
-    smtp_port = int(os.environ.get("SMTP_PORT", "587"))
-    smtp_user = os.environ.get("SMTP_USER")
-    smtp_pass = os.environ.get("SMTP_PASS")
-    smtp_from = os.environ.get("SMTP_FROM")
+def notifications_enabled():
+    return os.environ.get("NOTIFICATIONS_ENABLED", "false").lower() in ("1", "true", "yes")
 
-    if not smtp_host or not smtp_from:
+
+def queue_notification(conn, subject: str, body: str, to_addrs: list | None = None):
+    """
+    Queue an email notification in the caller's transaction (committed with it).
+    Nothing is sent inline; the background sender delivers it. Respects NOTIFICATIONS_ENABLED.
+    """
+    if not notifications_enabled():
         return False
+    conn.execute(
+        "INSERT INTO notification_outbox (subject, body, recipients) VALUES (?, ?, ?)",
+        (subject, body, ",".join(to_addrs) if to_addrs else None)
+    )
+    return True
+
+
+class NotificationSender:
+    """
+    Drains notification_outbox over one reused SMTP connection.
+
+    Due messages are claimed in batches by pushing next_attempt_at forward
+    (a lease), so several processes can run a sender without double-sending
+    and a crash mid-batch only delays delivery. Failures are retried with
+    exponential backoff; after NOTIFY_MAX_ATTEMPTS a message is marked 'dead'.
+    `python server.py` starts the module-level sender; other WSGI entry points
+    should call notification_sender.start() themselves.
+    """
+
+    def __init__(self, db_path=None, host=None, port=None, user=None, password=None,
+                 sender=None, default_to=None, starttls=None):
+        self.db_path = db_path
+        self.host = host or os.environ.get("SMTP_HOST")
+        self.port = port or int(os.environ.get("SMTP_PORT", "587"))
+        self.user = user or os.environ.get("SMTP_USER")
+        self.password = password or os.environ.get("SMTP_PASS")
+        self.sender = sender or os.environ.get("SMTP_FROM")
+        if default_to is None:
+            default_to = [a.strip() for a in os.environ.get("SMTP_TO", "").split(",") if a.strip()]
+        self.default_to = default_to
+        if starttls is None:
+            starttls = os.environ.get("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+        self.starttls = starttls
+        self._smtp = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+
+    def _connect(self):
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=10)
+            if self.starttls:
+                smtp.starttls()
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+            self._smtp = smtp
+        return self._smtp
+
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    def _claim(self, conn):
+        with conn:
+            return conn.execute(
+                f"""
+                UPDATE notification_outbox
+                SET next_attempt_at = datetime('now', '+{NOTIFY_LEASE_SECONDS} seconds'),
+                    attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= datetime('now')
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING *
+                """,
+                (NOTIFY_BATCH_SIZE,)
+            ).fetchall()
+
+    def _send(self, row):
+        recipients = row["recipients"].split(",") if row["recipients"] else self.default_to
+        if not recipients:
+            raise ValueError("no recipients configured")
+        msg = EmailMessage()
+        msg["Subject"] = row["subject"]
+        msg["From"] = self.sender
+        msg["To"] = ", ".join(recipients)
+        msg.set_content(row["body"])
+        try:
+            self._connect().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The reused connection may have gone stale; reconnect once before giving up.
+            self._disconnect()
+            self._connect().send_message(msg)
+
+    def drain(self, conn):
+        """Send all due messages. Returns the number sent."""
+        if not self.host or not self.sender:
+            return 0
+        sent = 0
+        try:
+            while True:
+                rows = self._claim(conn)
+                if not rows:
+                    break
+                for row in rows:
+                    try:
+                        self._send(row)
+                    except Exception as e:
+                        self._record_failure(conn, row, e)
+                        continue
+                    with conn:
+                        conn.execute(
+                            "UPDATE notification_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, "
+                            "last_error = NULL WHERE id = ?",
+                            (row["id"],)
+                        )
+                    self.sent += 1
+                    sent += 1
+        finally:
+            self._disconnect()
+        return sent
+
+    def _record_failure(self, conn, row, error):
+        self._disconnect()
+        self.failed += 1
+        if row["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+            self.dead += 1
+            with conn:
+                conn.execute(
+                    "UPDATE notification_outbox SET status = 'dead', last_error = ? WHERE id = ?",
+                    (str(error), row["id"])
+                )
+            log_event("notification_dead", level=logging.ERROR, notification_id=row["id"],
+                      attempts=row["attempts"], error=str(error))
+            return
+        delay = NOTIFY_RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+        with conn:
+            conn.execute(
+                f"UPDATE notification_outbox SET next_attempt_at = datetime('now', '+{int(delay)} seconds'), "
+                "last_error = ? WHERE id = ?",
+                (str(error), row["id"])
+            )
+
+    def wake(self):
+        """Ask the background thread to drain now instead of at the next poll."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="notification-sender", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        conn = connect_db(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.drain(conn)
+                except Exception as e:
+                    log_event("notification_sender_error", level=logging.ERROR,
+                              error=str(e), error_type=type(e).__name__)
+                self._wake.wait(NOTIFY_POLL_SECONDS)
+                self._wake.clear()
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {"sent": self.sent, "failed": self.failed, "dead": self.dead,
+                "running": self._thread is not None}
+
+
+notification_sender = NotificationSender()
+
+
+# ============================================================================
+# BARCODE CACHE
+# ============================================================================
+
+SCAN_CACHE_SIZE = int(os.environ.get("SCAN_CACHE_SIZE", "4096"))
+SCAN_CACHE_TTL = float(os.environ.get("SCAN_CACHE_TTL", "300"))
+
+# Fields never exposed through the public scan endpoint.
+PRIVATE_USER_FIELDS = ("email", "phone", "password_hash")
+# Item fields changed by loans (via triggers); read fresh on every scan, never from the cache.
+STOCK_FIELDS = ("quantity", "on_loan", "available")
+
+
+class BarcodeCache:
+    """
+    LRU + TTL cache: barcode → (kind, id, static fields) for /scan.
+
+    Only the scanned row itself is cached; loan state and item stock are still
+    read per scan. Write handlers must call invalidate()/invalidate_barcode()
+    after committing changes to an item or user row.
+    The TTL bounds staleness from writes made outside the API.
+
+    Every invalidation bumps `generation`. Readers take it before reading a row
+    and pass it to put(), which drops the row if an invalidation happened in
+    between (it may predate the write that invalidated it).
+    """
+
+    def __init__(self, max_size=SCAN_CACHE_SIZE, ttl=SCAN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # barcode -> (expires_at, kind, id, fields)
+        self._barcodes = {}  # (kind, id) -> barcode
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, barcode):
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, kind, obj_id, fields = entry
+            if expires_at < time.monotonic():
+                self._remove(barcode)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(barcode)
+            self.hits += 1
+            return kind, obj_id, dict(fields)
+
+    def put(self, barcode, kind, obj_id, fields, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return  # read before a concurrent invalidation: may be stale
+            self._remove(barcode)
+            self._remove(self._barcodes.get((kind, obj_id)))
+            self._entries[barcode] = (time.monotonic() + self.ttl, kind, obj_id, dict(fields))
+            self._barcodes[(kind, obj_id)] = barcode
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, kind, obj_id):
+        """Drop the entry for an item/user id (whatever barcode it was cached under)."""
+        with self._lock:
+            self.generation += 1
+            if self._remove(self._barcodes.get((kind, obj_id))):
+                self.invalidations += 1
+
+    def invalidate_barcode(self, barcode):
+        with self._lock:
+            self.generation += 1
+            if self._remove(barcode):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._barcodes.clear()
+
+    def _remove(self, barcode):
+        entry = self._entries.pop(barcode, None) if barcode is not None else None
+        if entry is None:
+            return False
+        self._barcodes.pop((entry[1], entry[2]), None)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+barcode_cache = BarcodeCache()
+
 
-    recipients = to_addrs or []
-    if not recipients:
-        smtp_to = os.environ.get("SMTP_TO")
-        if smtp_to:
-            recipients = [a.strip() for a in smtp_to.split(",") if a.strip()]
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def resolve_barcodes(conn, barcodes):
+    """
+    Resolve barcodes to {barcode: ("item" | "user", id, fields)}; unknown ones are left out.
+    Items win over users. User fields exclude PRIVATE_USER_FIELDS.
+    Cache misses are fetched with one IN query per table.
+    """
+    generation = barcode_cache.generation  # before any row is read
+    resolved = {}
+    missing = []
+    for barcode in dict.fromkeys(barcodes):
+        cached = barcode_cache.get(barcode)
+        if cached:
+            resolved[barcode] = cached
+        else:
+            missing.append(barcode)
+
+    if missing:
+        fetched = {}
+        items = conn.execute(
+            f"SELECT * FROM items WHERE barcode IN ({_placeholders(missing)})", missing
+        ).fetchall()
+        for item in items:
+            fetched[item["barcode"]] = ("item", item["id"], dict(item))
+
+        missing = [b for b in missing if b not in fetched]
+        if missing:
+            users = conn.execute(
+                f"SELECT * FROM users WHERE barcode IN ({_placeholders(missing)})", missing
+            ).fetchall()
+            for user in users:
+                fields = dict(user)
+                for key in PRIVATE_USER_FIELDS:
+                    fields.pop(key, None)
+                fetched[user["barcode"]] = ("user", user["id"], fields)
+
+        for barcode, entry in fetched.items():
+            barcode_cache.put(barcode, *entry, generation=generation)
+        resolved.update(fetched)
+
+    return resolved
+
+
+def lookup_barcode(conn, barcode):
+    """Resolve a single barcode to ("item" | "user", id, fields), or None if unknown."""
+    return resolve_barcodes(conn, [barcode]).get(barcode)
+
+
+def build_scan_results(conn, barcodes):
+    """
+    Build /scan response bodies for each barcode, in input order.
+    Active loans (with loaners) and users' loan lists are fetched set-based.
+    """
+    resolved = resolve_barcodes(conn, barcodes)
+    item_ids = sorted({r[1] for r in resolved.values() if r[0] == "item"})
+    user_ids = sorted({r[1] for r in resolved.values() if r[0] == "user"})
+
+    # Current stock and loan per item (the oldest active one), including loaner info
+    stock = {}
+    item_loans = {}
+    if item_ids:
+        rows = conn.execute(
+            f"SELECT id, {', '.join(STOCK_FIELDS)} FROM items WHERE id IN ({_placeholders(item_ids)})",
+            item_ids
+        ).fetchall()
+        stock = {row["id"]: {field: row[field] for field in STOCK_FIELDS} for row in rows}
+        rows = conn.execute(
+            f"""
+            SELECT loans.*, users.name AS loaner_name, users.barcode AS loaner_barcode
+            FROM loans
+            LEFT JOIN users ON loans.user_id = users.id
+            WHERE loans.item_id IN ({_placeholders(item_ids)}) AND loans.return_date IS NULL
+            ORDER BY loans.id
+            """,
+            item_ids
+        ).fetchall()
+        for row in rows:
+            item_loans.setdefault(row["item_id"], row)
+
+    # Users' active loans
+    user_loans = {uid: [] for uid in user_ids}
+    if user_ids:
+        rows = conn.execute(
+            f"""
+            SELECT loans.user_id, loans.id, loans.item_id, loans.loan_date, loans.due_date,
+                   items.name as item_name, items.barcode as item_barcode
+            FROM loans
+            LEFT JOIN items ON loans.item_id = items.id
+            WHERE loans.user_id IN ({_placeholders(user_ids)}) AND loans.return_date IS NULL
+            ORDER BY loans.loan_date DESC
+            """,
+            user_ids
+        ).fetchall()
+        for row in rows:
+            loan = dict(row)
+            user_loans[loan.pop("user_id")].append(loan)
+
+    results = []
+    for barcode in barcodes:
+        if barcode not in resolved:
+            results.append({"type": "unknown", "barcode": barcode})
+            continue
+
+        kind, obj_id, fields = resolved[barcode]
+        if kind == "user":
+            results.append({"type": "user", "user": fields, "active_loans": user_loans[obj_id]})
+            continue
+
+        fields = {**fields, **stock.get(obj_id, {})}
+        loan = item_loans.get(obj_id)
+        if not loan:
+            results.append({"type": "item", "item": fields, "loaned": False})
+            continue
+
+        loan_dict = dict(loan)
+        loaner_name = loan_dict.pop("loaner_name")
+        loaner_barcode = loan_dict.pop("loaner_barcode")
+        loaned_to = None
+        if loaner_name is not None:
+            loaned_to = {"id": loan["user_id"], "name": loaner_name, "barcode": loaner_barcode}
+        results.append({
+            "type": "item",
+            "item": fields,
+            "loaned": True,
+            "loan": loan_dict,
+            "loaned_to": loaned_to
+        })
+    return results
+
+
+# ============================================================================
+# USER NAME TYPEAHEAD
+# ============================================================================
+
+USER_INDEX_TTL = float(os.environ.get("USER_INDEX_TTL", "300"))
+
+# Norwegian letters and their alternative spellings: "Aasen", "Åsen" and
+# "Asen" should all find each other.
+NAME_SPELLINGS = (("å", "aa"), ("ø", "oe"), ("æ", "ae"))
+# Letters Unicode does not decompose into base letter + accent.
+NAME_FOLD = str.maketrans({"ø": "o", "æ": "ae", "đ": "d", "ð": "d", "þ": "th", "ł": "l"})
+
+
+def fold_name(text):
+    """Lower-case and strip accents: "Bjørn Ærø-Ås" → "bjorn aero-as"."""
+    if text.isascii():
+        return text.casefold()
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).translate(NAME_FOLD)
+
+
+@lru_cache(maxsize=8192)
+def name_variants(word):
+    """All folded spellings of one word of a name (å/aa, ø/oe, æ/ae)."""
+    forms = {word.casefold()}
+    for letter, spelled in NAME_SPELLINGS:
+        forms |= {f.replace(letter, spelled) for f in forms} | {f.replace(spelled, letter) for f in forms}
+    return frozenset(fold_name(f) for f in forms)
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _prefix_range(entries, prefix):
+    """Slice bounds of the (text, id) entries whose text starts with prefix."""
+    return (bisect.bisect_left(entries, (prefix,)),
+            bisect.bisect_left(entries, (prefix + "\U0010ffff",)))
+
+
+class UserNameIndex:
+    """
+    In-process typeahead index over user names for the login picker.
+
+    Names starting with the query come straight off a name-sorted list, so the
+    common case costs a bisect and a slice. Other word prefixes ("nordm" for
+    "Ola Nordmann") come from a sorted (word, id) list, and substrings (what the
+    old LIKE '%...%' search found) from a trigram map.
+
+    Write handlers must call refresh()/remove() after committing changes to a
+    user, or invalidate() after bulk changes; the index is then rebuilt on the
+    next search. The TTL bounds staleness from writes made outside the API
+    (other processes, scripts).
+    """
+
+    def __init__(self, ttl=USER_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._clear()
+
+    def _clear(self):
+        self._rows = {}  # id -> public fields
+        self._names = {}  # id -> folded full name
+        self._by_name = []  # sorted (folded full name, id)
+        self._words = []  # sorted (folded word, id), every spelling variant
+        self._user_words = {}  # id -> the words indexed for it
+        self._trigrams = {}  # trigram -> set of ids
+
+    def needs_load(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or loaded_at + self.ttl < time.monotonic()
+
+    def load(self, conn):
+        """(Re)build the whole index from the users table, unless it is (now) fresh."""
+        with self._lock:
+            if not self.needs_load():
+                return  # another search rebuilt it while this one waited for the lock
+            self._clear()
+            for row in conn.execute("SELECT id, name, role, barcode, class_year FROM users"):
+                self._add(row)
+            self._by_name.sort()
+            self._words.sort()
+            self._loaded_at = time.monotonic()
+
+    def refresh(self, conn, user_ids):
+        """Re-read the given users after a write (removes the ones that no longer exist)."""
+        with self._lock:
+            if self._loaded_at is None or not user_ids:
+                return  # the next load() reads everything anyway
+            rows = conn.execute(
+                f"SELECT id, name, role, barcode, class_year FROM users WHERE id IN ({_placeholders(user_ids)})",
+                list(user_ids)
+            ).fetchall()
+            for user_id in user_ids:
+                self._remove(user_id)
+            for row in rows:
+                self._add(row, keep_sorted=True)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def search(self, text, limit):
+        """
+        Up to limit users matching text, as public dicts, best first:
+          1. the name starts with the first word and every other word prefixes a word of the name,
+          2. every word prefixes some word of the name,
+          3. the name contains the text anywhere.
+        Within each group users sort by name.
+        """
+        terms = re.findall(r"\w+", fold_name(text))
+        if not terms:
+            return []
+        with self._lock:
+            def has_rest(user_id):
+                words = self._user_words[user_id]
+                return all(any(w.startswith(t) for w in words) for t in terms[1:])
+
+            lo, hi = _prefix_range(self._by_name, terms[0])
+            found = []
+            for i in range(lo, hi):
+                user_id = self._by_name[i][1]
+                if has_rest(user_id):
+                    found.append(user_id)
+                    if len(found) == limit:
+                        return [dict(self._rows[u]) for u in found]
+
+            seen = set(found)
+            matched = None
+            for term in terms:
+                lo, hi = _prefix_range(self._words, term)
+                ids = {user_id for _, user_id in self._words[lo:hi]}
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    break
+            found += heapq.nsmallest(limit - len(found), matched - seen, key=self._sort_key)
+
+            needle = " ".join(terms)
+            if len(found) < limit and len(needle) >= 3:
+                seen.update(found)
+                candidates = set.intersection(*(self._trigrams.get(t, set()) for t in _trigrams(needle)))
+                candidates = {u for u in candidates - seen if needle in self._names[u]}
+                found += heapq.nsmallest(limit - len(found), candidates, key=self._sort_key)
+
+            return [dict(self._rows[u]) for u in found]
+
+    def _sort_key(self, user_id):
+        return self._names[user_id], user_id
+
+    def _add(self, row, keep_sorted=False):
+        user_id = row["id"]
+        name = row["name"] or ""
+        folded = " ".join(re.findall(r"\w+", fold_name(name)))
+        words = frozenset().union(*(name_variants(w) for w in re.findall(r"\w+", name)))
+        self._rows[user_id] = dict(row)
+        self._names[user_id] = folded
+        self._user_words[user_id] = words
+        insert = bisect.insort if keep_sorted else list.append
+        insert(self._by_name, (folded, user_id))
+        for word in words:
+            insert(self._words, (word, user_id))
+        for trigram in _trigrams(folded):
+            self._trigrams.setdefault(trigram, set()).add(user_id)
+
+    def _remove(self, user_id):
+        if self._rows.pop(user_id, None) is None:
+            return
+        folded = self._names.pop(user_id)
+        entries = [(self._by_name, folded)] + [(self._words, w) for w in self._user_words.pop(user_id)]
+        for sorted_list, text in entries:
+            i = bisect.bisect_left(sorted_list, (text, user_id))
+            if i < len(sorted_list) and sorted_list[i] == (text, user_id):
+                del sorted_list[i]
+        for trigram in _trigrams(folded):
+            ids = self._trigrams.get(trigram)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del self._trigrams[trigram]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._loaded_at is not None,
+                "users": len(self._rows),
+                "words": len(self._words),
+                "trigrams": len(self._trigrams),
+                "ttl": self.ttl,
+            }
+
+
+user_index = UserNameIndex()
+
+
+# ============================================================================
+# CONDITIONAL GET (ETags)
+# ============================================================================
+
+def data_etag(conn, tables):
+    """ETag value that changes whenever any of tables is written (or the schema changes)."""
+    versions = dict(conn.execute(
+        f"SELECT name, version FROM data_versions WHERE name IN ('epoch', {_placeholders(tables)})",
+        tables
+    ).fetchall())
+    return f"{versions['epoch']:x}-{SCHEMA_VERSION}-" + ".".join(str(versions[t]) for t in tables)
+
+
+def conditional_get(*tables):
+    """
+    Decorator for list endpoints whose response is built only from tables.
+    Sends a strong ETag, and answers a matching If-None-Match with 304 without
+    running the handler (no list query, no serialization).
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Read the versions before the handler runs: a write landing in between
+            # only makes the ETag older than the body, so the next poll refetches.
+            etag = data_etag(get_db(), tables)
+            # compress_response() suffixes the ETag of compressed bodies.
+            matched = next((tag for tag in (etag, f"{etag}-gzip", f"{etag}-br")
+                            if request.if_none_match.contains(tag)), None)
+            if matched:
+                response = app.response_class(status=304)
+                response.set_etag(matched)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"  # always revalidate
+            return response
+        return wrapper
+    return decorator
+
+
+# ============================================================================
+# CHANGE EVENTS (Server-Sent Events)
+# ============================================================================
+#
+# Mutation handlers call record_event() inside their transaction (so an event
+# exists if and only if the change was committed) and event_hub.notify() after
+# the commit. GET /events streams the log to the admin pages; event ids are the
+# resume cursor, so a reconnecting client only receives what it missed.
+
+EVENTS_KEEP = int(os.environ.get("EVENTS_KEEP", "10000"))
+# An open stream occupies a thread of a threaded server; serve_gevent.py raises the default to 1000.
+EVENTS_MAX_STREAMS = int(os.environ.get("EVENTS_MAX_STREAMS", "50"))
+# Idle streams re-check the log this often (catches writes from other processes).
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", "5"))
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_BATCH_SIZE = 200
+EVENTS_PRUNE_EVERY = 1000
+
+
+def record_event(conn, event_type, **data):
+    """Queue one change event in the caller's transaction (does not commit)."""
+    record_events(conn, event_type, [data])
+
+
+def record_events(conn, event_type, items):
+    """Queue one event of event_type per dict in items (does not commit)."""
+    if not items:
+        return
+    conn.executemany(
+        "INSERT INTO events (type, data) VALUES (?, ?)",
+        [(event_type, json.dumps(data, separators=(",", ":"))) for data in items]
+    )
+    last_id = conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+    if last_id % EVENTS_PRUNE_EVERY < len(items):
+        conn.execute("DELETE FROM events WHERE id <= ?", (last_id - EVENTS_KEEP,))
+
+
+class EventHub:
+    """
+    Wakes idle /events streams after a commit and caps the number of open
+    streams. A waiting stream holds no DB connection, only its thread; run
+    serve_gevent.py where many streams stay open, so that is a greenlet.
+    """
+
+    def __init__(self, max_streams=EVENTS_MAX_STREAMS):
+        self.max_streams = max_streams
+        self.streams = 0
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def notify(self):
+        with self._cond:
+            self._seq += 1
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout):
+        """Block until notify() has been called since seq was `seen` (or timeout)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != seen, timeout)
+            return self._seq
+
+    def open_stream(self):
+        with self._cond:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._cond:
+            self.streams -= 1
+
+
+event_hub = EventHub()
+
+
+def _sse(event_id, data, event=None):
+    lines = [f"id: {event_id}"]
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/events", methods=["GET"])
+@admin_required
+def stream_events():
+    """
+    Server-Sent Events stream of changes (admin only). Each message is
+    {"id", "type", "at", "data"} with type e.g. loan.created, loan.returned,
+    loan.updated, flag.created, flag.updated, item.created/updated/deleted,
+    user.created/updated/deleted, items.changed/users.changed (bulk: refetch).
+
+    Resume with the Last-Event-ID header (sent by EventSource on reconnect) or
+    ?after=<id>; without either, only new events are sent. If the cursor is
+    older than the kept log, a "reset" event tells the client to refetch its
+    lists; the stream then continues from the newest event.
+    """
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("after")
+    conn = get_db()
+    oldest, newest = conn.execute("SELECT MIN(id), COALESCE(MAX(id), 0) FROM events").fetchone()
+    if cursor is None:
+        cursor = newest
+    else:
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            return jsonify({"error": "after / Last-Event-ID must be an event id"}), 400
+    reset = oldest is not None and cursor < oldest - 1
+    if reset:
+        cursor = newest
+
+    if not event_hub.open_stream():
+        return jsonify({"error": "Too many open event streams"}), 503
+
+    def generate(cursor):
+        yield "retry: 3000\n\n"
+        if reset:
+            yield _sse(cursor, "{}", event="reset")
+        idle_since = time.monotonic()
+        while True:
+            seq = event_hub.seq  # before reading, so a commit in between is not missed
+            # Short-lived connection per poll: idle streams must not pin the pool.
+            conn = db_pool.acquire()
+            try:
+                rows = conn.execute(
+                    "SELECT id, type, data, created_at FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                    (cursor, EVENTS_BATCH_SIZE)
+                ).fetchall()
+            finally:
+                db_pool.release(conn)
+
+            for row in rows:
+                cursor = row["id"]
+                yield _sse(cursor, f'{{"id":{cursor},"type":{json.dumps(row["type"])},'
+                                   f'"at":{json.dumps(row["created_at"])},"data":{row["data"]}}}')
+            if rows:
+                idle_since = time.monotonic()
+                if len(rows) == EVENTS_BATCH_SIZE:
+                    continue
+            elif time.monotonic() - idle_since >= EVENTS_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"  # lets proxies and dead clients be noticed
+                idle_since = time.monotonic()
+            event_hub.wait(seq, EVENTS_POLL_SECONDS)
+
+    response = Response(generate(cursor), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Called by the server when the client goes away, even before the first chunk.
+    response.call_on_close(event_hub.close_stream)
+    return response
+
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+#
+# A job is a row in `jobs` plus a runner function registered in JOB_RUNNERS.
+# Runners work in small chunks and save their cursor/progress in the same
+# transaction as each chunk, so a job interrupted by a crash or restart picks
+# up where it left off when resume_jobs() runs at startup.
+#
+# A runner first claims the job's lease in the database, so only one runner
+# works on a job across threads, workers and processes. save_job_progress()
+# renews the lease with every chunk; a crashed runner's job can be claimed
+# again once its lease has expired.
+
+# How long a claim holds without a saved chunk.
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+
+JOB_RUNNERS = {}
+_running_jobs = set()
+_running_jobs_lock = threading.Lock()
+
+
+class JobLeaseLost(Exception):
+    """The job was claimed by another runner (our lease expired)."""
+
+
+def job_dict(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"] or "{}")
+    job["progress"] = json.loads(job["progress"] or "{}")
+    return job
+
+
+def _job_owner():
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def claim_job(conn, job_id):
+    """
+    Take the lease of a queued job, or of a running one whose lease has expired,
+    for the calling thread. Commits. Returns False if another runner holds it.
+    """
+    claimed = conn.execute(
+        """
+        UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires_at = datetime('now', ?),
+                        updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (status = 'queued' OR (status = 'running' AND
+                          (lease_expires_at IS NULL OR lease_expires_at < datetime('now'))))
+        """,
+        (_job_owner(), f"+{JOB_LEASE_SECONDS} seconds", job_id)
+    ).rowcount
+    conn.commit()
+    return claimed == 1
+
+
+def save_job_progress(conn, job_id, cursor, progress):
+    """
+    Save cursor/progress in the caller's transaction and renew the lease.
+    Raises JobLeaseLost if another runner has claimed the job meanwhile.
+    """
+    saved = conn.execute(
+        "UPDATE jobs SET cursor = ?, progress = ?, lease_expires_at = datetime('now', ?), "
+        "updated_at = CURRENT_TIMESTAMP WHERE id = ? AND lease_owner = ?",
+        (cursor, json.dumps(progress), f"+{JOB_LEASE_SECONDS} seconds", job_id, _job_owner())
+    ).rowcount
+    if not saved:
+        raise JobLeaseLost(f"job {job_id} was claimed by another runner")
+
+
+def start_job(job_id, kind):
+    """Run a job on a background thread, if no other runner holds its lease."""
+    with _running_jobs_lock:
+        if job_id in _running_jobs:
+            return
+        _running_jobs.add(job_id)
+
+    def run():
+        conn = connect_db()
+        owner = _job_owner()
+        try:
+            if not claim_job(conn, job_id):
+                return  # running elsewhere (another worker or process)
+            JOB_RUNNERS[kind](conn, job_id)
+            conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, "
+                "finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND lease_owner = ?",
+                (job_id, owner)
+            )
+            conn.commit()
+        except JobLeaseLost:
+            conn.rollback()
+            log_event("job_lease_lost", level=logging.WARNING, job_id=job_id, kind=kind)
+        except Exception as e:
+            conn.rollback()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                "updated_at = CURRENT_TIMESTAMP WHERE id = ? AND lease_owner = ?",
+                (str(e), job_id, owner)
+            )
+            conn.commit()
+            log_event("job_failed", level=logging.ERROR, job_id=job_id, kind=kind,
+                      error=str(e), error_type=type(e).__name__)
+        finally:
+            conn.close()
+            with _running_jobs_lock:
+                _running_jobs.discard(job_id)
 
-    if not recipients:
-        return False
+    threading.Thread(target=run, name=f"job-{job_id}-{kind}", daemon=True).start()
 
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = smtp_from
-    msg["To"] = ", ".join(recipients)
-    msg.set_content(body)
 
+def resume_jobs():
+    """Restart jobs left queued or running by a previous process (once their lease has expired)."""
+    conn = connect_db()
     try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as s:
-            s.starttls()
-            if smtp_user and smtp_pass:
-                s.login(smtp_user, smtp_pass)
-            s.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Failed to send notification: {e}")
-        return False
+        rows = conn.execute("SELECT id, kind FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        if row["kind"] in JOB_RUNNERS:
+            print(f"✓ Resuming job {row['id']} ({row['kind']})")
+            start_job(row["id"], row["kind"])
 
 
 # ============================================================================
@@ -259,90 +2194,111 @@ def scan_barcode():
         return jsonify({"error": "barcode required"}), 400
 
     conn = get_db()
+    return jsonify(build_scan_results(conn, [barcode])[0]), 200
 
-    # Try item first
-    item = conn.execute("SELECT * FROM items WHERE barcode = ?", (barcode,)).fetchone()
-    if item:
-        item_dict = dict(item)
-        # Check if item is currently loaned
-        loan = conn.execute(
-            "SELECT * FROM loans WHERE item_id = ? AND return_date IS NULL",
-            (item["id"],)
-        ).fetchone()
-        if loan:
-            # Loaned: include loaner info
-            user = conn.execute("SELECT id, name, barcode FROM users WHERE id = ?", (loan["user_id"],)).fetchone()
-            conn.close()
-            return jsonify({
-                "type": "item",
-                "item": item_dict,
-                "loaned": True,
-                "loan": dict(loan),
-                "loaned_to": dict(user) if user else None
-            })
-        else:
-            conn.close()
-            return jsonify({"type": "item", "item": item_dict, "loaned": False})
 
-    # Try user
-    user = conn.execute("SELECT * FROM users WHERE barcode = ?", (barcode,)).fetchone()
-    if user:
-        user_dict = dict(user)
-        # Remove sensitive info for non-admins
-        user_dict.pop("email", None)
-        user_dict.pop("phone", None)
-        user_dict.pop("password_hash", None)
+SCAN_BATCH_MAX = 500
 
-        # Get user's active loans
-        loans = conn.execute(
-            """
-            SELECT loans.id, loans.item_id, loans.loan_date, loans.due_date,
-                   items.name as item_name, items.barcode as item_barcode
-            FROM loans
-            LEFT JOIN items ON loans.item_id = items.id
-            WHERE loans.user_id = ? AND loans.return_date IS NULL
-            ORDER BY loans.loan_date DESC
-            """,
-            (user["id"],)
-        ).fetchall()
 
-        conn.close()
-        return jsonify({
-            "type": "user",
-            "user": user_dict,
-            "active_loans": [dict(l) for l in loans]
-        })
+@app.route("/scan/batch", methods=["POST"])
+def scan_barcodes_batch():
+    """
+    Scan many barcodes in one request (e.g. stock-taking a whole cabinet).
+    Request: {"barcodes": ["...", ...]}
+    Response: {"results": [...]} in input order; each result is the /scan body plus
+              "barcode" and "status": "found" | "unknown" | "invalid".
+    """
+    data = request.json or {}
+    barcodes = data.get("barcodes")
+
+    if not isinstance(barcodes, list) or not barcodes:
+        return jsonify({"error": "barcodes (list) required"}), 400
+    if len(barcodes) > SCAN_BATCH_MAX:
+        return jsonify({"error": f"At most {SCAN_BATCH_MAX} barcodes per batch"}), 400
+
+    cleaned = [b.strip() if isinstance(b, str) else "" for b in barcodes]
+    valid = [b for b in cleaned if b]
+
+    conn = get_db()
+    scanned = iter(build_scan_results(conn, valid))
+
+    results = []
+    for barcode in cleaned:
+        if not barcode:
+            results.append({"barcode": barcode, "status": "invalid", "error": "barcode required"})
+            continue
+        result = next(scanned)
+        result["barcode"] = barcode
+        result["status"] = "unknown" if result["type"] == "unknown" else "found"
+        results.append(result)
+
+    return jsonify({"results": results})
 
-    conn.close()
-    return jsonify({"type": "unknown", "barcode": barcode}), 200
+
+ITEMS_PAGE_MAX = 1000
 
 
 @app.route("/items", methods=["GET"])
+@conditional_get("items", "loans", "users")
 def list_items():
-    """List all items with their current loan status (public view)."""
+    """
+    List items with their current loan status (public view).
+    Query: ?category=&location= filters, ?limit=N&after=<name>,<id> keyset pagination.
+    When a page is full, the (URL-encoded) cursor for the next page is sent in X-Next-After.
+    ?shape=rows returns columns + row arrays (see query_rows).
+    """
+    where = []
+    params = []
+
+    for col in ("category", "location"):
+        value = request.args.get(col, "").strip()
+        if value:
+            where.append(f"items.{col} = ?")
+            params.append(value)
+
+    after = request.args.get("after", "")
+    if after:
+        after_name, _, after_id = after.rpartition(",")
+        try:
+            after_id = int(after_id)
+        except ValueError:
+            return jsonify({"error": "after must be <name>,<id>"}), 400
+        where.append("(items.name, items.id) > (?, ?)")
+        params.extend([after_name, after_id])
+
+    limit = request.args.get("limit", "")
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        if not 1 <= limit <= ITEMS_PAGE_MAX:
+            return jsonify({"error": f"limit must be between 1 and {ITEMS_PAGE_MAX}"}), 400
+    else:
+        limit = -1  # SQLite: no limit
+
+    # One active loan per item (the oldest), joined in a single pass.
+    sql = f"""
+        SELECT items.*, users.name AS loaned_to, loans.due_date AS due_date
+        FROM items
+        LEFT JOIN loans ON loans.id = (
+            SELECT MIN(l.id) FROM loans l
+            WHERE l.item_id = items.id AND l.return_date IS NULL
+        )
+        LEFT JOIN users ON loans.user_id = users.id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY items.name, items.id
+        LIMIT ?
+    """
     conn = get_db()
-    items = conn.execute("SELECT * FROM items ORDER BY name").fetchall()
-
-    result = []
-    for item in items:
-        item_dict = dict(item)
-        # Check current loan
-        loan = conn.execute(
-            "SELECT loans.*, users.name as user_name FROM loans "
-            "LEFT JOIN users ON loans.user_id = users.id "
-            "WHERE loans.item_id = ? AND loans.return_date IS NULL",
-            (item["id"],)
-        ).fetchone()
-        if loan:
-            item_dict["loaned_to"] = loan["user_name"]
-            item_dict["due_date"] = loan["due_date"]
-        else:
-            item_dict["loaned_to"] = None
-            item_dict["due_date"] = None
-        result.append(item_dict)
+    items = query_rows(conn, sql, (*params, limit))
+    rows = items["rows"] if isinstance(items, dict) else items
 
-    conn.close()
-    return jsonify(result)
+    response = jsonify(items)
+    if limit > 0 and len(rows) == limit:
+        last = dict(zip(items["columns"], rows[-1])) if isinstance(items, dict) else rows[-1]
+        response.headers["X-Next-After"] = quote(f"{last['name']},{last['id']}")
+    return response
 
 
 @app.route("/items/<int:item_id>", methods=["GET"])
@@ -351,7 +2307,6 @@ def get_item(item_id):
     conn = get_db()
     item = conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
     if not item:
-        conn.close()
         return jsonify({"error": "Item not found"}), 404
 
     item_dict = dict(item)
@@ -380,35 +2335,129 @@ def get_item(item_id):
     ).fetchall()
     item_dict["history"] = [dict(l) for l in loans]
 
-    conn.close()
     return jsonify(item_dict)
 
 
 @app.route("/users", methods=["GET"])
+@conditional_get("users")
 def list_users():
     """List all users (public view: no sensitive info)."""
     conn = get_db()
-    users = conn.execute("SELECT id, name, role, barcode, class_year FROM users ORDER BY name").fetchall()
-    conn.close()
+    return jsonify(query_rows(conn, "SELECT id, name, role, barcode, class_year FROM users ORDER BY name"))
+
+
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_MAX_TERMS = 8
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match as a
+    prefix ("ola nor" → "ola"* "nor"*). Words are quoted, so FTS5 operators and
+    punctuation in user input are treated as plain text. Returns None when the
+    text has no searchable words.
+    """
+    terms = re.findall(r"\w+", text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_limit():
+    """Parse ?limit= for the search endpoints. Returns (limit, error response)."""
+    limit = request.args.get("limit", "")
+    if not limit:
+        return SEARCH_LIMIT_DEFAULT, None
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None, (jsonify({"error": "limit must be an integer"}), 400)
+    if not 1 <= limit <= SEARCH_LIMIT_MAX:
+        return None, (jsonify({"error": f"limit must be between 1 and {SEARCH_LIMIT_MAX}"}), 400)
+    return limit, None
+
+
+def search_users(conn, text, limit):
+    """Users whose name/class words start with the words in text, best match first."""
+    match = fts_query(text)
+    if match is None:
+        return []
+    # bm25 weights: a hit in the name counts far more than a hit in the class.
+    return conn.execute(
+        """
+        SELECT users.id, users.name, users.role, users.barcode, users.class_year
+        FROM users_fts
+        JOIN users ON users.id = users_fts.rowid
+        WHERE users_fts MATCH ?
+        ORDER BY bm25(users_fts, 10.0, 1.0), users.name
+        LIMIT ?
+        """,
+        (match, limit)
+    ).fetchall()
+
+
+@app.route("/search/users", methods=["GET"])
+def search_users_endpoint():
+    """
+    Ranked prefix search over user name and class (public view).
+    Query: ?q=<text>&limit=N (default 20, max 100).
+    """
+    limit, error = search_limit()
+    if error:
+        return error
+    users = search_users(get_db(), request.args.get("q", ""), limit)
     return jsonify([dict(u) for u in users])
 
 
+@app.route("/search/items", methods=["GET"])
+def search_items_endpoint():
+    """
+    Ranked prefix search over item name, description, category and location.
+    Rows have the same shape as GET /items. Query: ?q=<text>&limit=N (default 20, max 100).
+    """
+    limit, error = search_limit()
+    if error:
+        return error
+    match = fts_query(request.args.get("q", ""))
+    if match is None:
+        return jsonify([])
+
+    conn = get_db()
+    items = conn.execute(
+        """
+        SELECT items.*, users.name AS loaned_to, loans.due_date AS due_date
+        FROM items_fts
+        JOIN items ON items.id = items_fts.rowid
+        LEFT JOIN loans ON loans.id = (
+            SELECT MIN(l.id) FROM loans l
+            WHERE l.item_id = items.id AND l.return_date IS NULL
+        )
+        LEFT JOIN users ON loans.user_id = users.id
+        WHERE items_fts MATCH ?
+        ORDER BY bm25(items_fts, 10.0, 1.0, 3.0, 3.0), items.name
+        LIMIT ?
+        """,
+        (match, limit)
+    ).fetchall()
+    return jsonify([dict(i) for i in items])
+
+
 @app.route("/users/search", methods=["POST"])
 def search_users_by_name():
-    """Search users by name. Used for login selection."""
+    """
+    Search users by name. Used for login selection (called on every keystroke),
+    so it is served from the in-memory user_index without touching the DB.
+    """
     data = request.json or {}
     name = data.get("name", "").strip()
 
     if not name:
         return jsonify([]), 200
 
-    conn = get_db()
-    users = conn.execute(
-        "SELECT id, name, role, barcode, class_year FROM users WHERE name LIKE ? ORDER BY name",
-        (f"%{name}%",)
-    ).fetchall()
-    conn.close()
-    return jsonify([dict(u) for u in users])
+    if user_index.needs_load():
+        user_index.load(get_db())
+    return jsonify(user_index.search(name, SEARCH_LIMIT_MAX))
 
 
 @app.route("/auth/user/login", methods=["POST"])
@@ -429,13 +2478,11 @@ def user_login():
     if user_id:
         user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
         if not user:
-            conn.close()
             return jsonify({"error": "Bruker ikke funnet"}), 404
 
         # Check password
         if user["password_hash"]:
             if not password or not check_password_hash(user["password_hash"], password):
-                conn.close()
                 return jsonify({"error": "Feil passord"}), 401
     else:
         # Search for exact match first
@@ -444,10 +2491,8 @@ def user_login():
         # If not found, create new user (requires password and class_year)
         if not user:
             if not password:
-                conn.close()
                 return jsonify({"error": "Passord påkrevd for ny bruker"}), 400
             if not class_year:
-                conn.close()
                 return jsonify({"error": "Klasse påkrevd for ny bruker"}), 400
 
             try:
@@ -457,26 +2502,25 @@ def user_login():
                     "INSERT INTO users (name, role, password_hash, class_year, created_at, updated_at) VALUES (?, 'user', ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
                     (name, password_hash, class_year)
                 )
-                conn.commit()
                 user_id_new = c.lastrowid
+                record_event(conn, "user.created", user_id=user_id_new)
+                conn.commit()
+                event_hub.notify()
+                user_index.refresh(conn, [user_id_new])
                 user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id_new,)).fetchone()
             except Exception as e:
                 conn.rollback()
-                conn.close()
                 return jsonify({"error": "Kunne ikke opprette bruker", "detail": str(e)}), 500
         else:
             # User exists, verify password
             if user["password_hash"]:
                 if not password or not check_password_hash(user["password_hash"], password):
-                    conn.close()
                     return jsonify({"error": "Feil passord"}), 401
             else:
                 # User exists but has no password - set it now
                 if not password:
-                    conn.close()
                     return jsonify({"error": "Passord påkrevd"}), 400
                 if not class_year:
-                    conn.close()
                     return jsonify({"error": "Klasse påkrevd"}), 400
 
                 password_hash = generate_password_hash(password)
@@ -485,6 +2529,8 @@ def user_login():
                     (password_hash, class_year, user["id"])
                 )
                 conn.commit()
+                barcode_cache.invalidate("user", user["id"])
+                user_index.refresh(conn, [user["id"]])
                 user = conn.execute("SELECT * FROM users WHERE id = ?", (user["id"],)).fetchone()
 
     # Set user session
@@ -496,7 +2542,6 @@ def user_login():
     user_dict.pop("email", None)
     user_dict.pop("phone", None)
 
-    conn.close()
     return jsonify({"message": "ok", "user": user_dict}), 200
 
 
@@ -514,7 +2559,6 @@ def get_user(user_id):
     conn = get_db()
     user = conn.execute("SELECT id, name, role, barcode, class_year FROM users WHERE id = ?", (user_id,)).fetchone()
     if not user:
-        conn.close()
         return jsonify({"error": "User not found"}), 404
 
     # Loan history
@@ -530,7 +2574,6 @@ def get_user(user_id):
         (user_id,)
     ).fetchall()
 
-    conn.close()
     return jsonify({
         "user": dict(user),
         "loans": [dict(l) for l in loans]
@@ -541,6 +2584,24 @@ def get_user(user_id):
 # LOAN OPERATIONS (public: barcode-based, no auth)
 # ============================================================================
 
+def resolve_loan_user(conn, data):
+    """
+    Resolve the borrower for a checkout: user session, then admin-supplied
+    user_id, then user_barcode. Returns (user_id, None) or (None, error response).
+    """
+    user_barcode = (data.get("user_barcode") or "").strip()
+    if session.get("is_user"):
+        return session["user_id"], None
+    if session.get("is_admin") and data.get("user_id"):
+        return data.get("user_id"), None
+    if user_barcode:
+        user = conn.execute("SELECT id FROM users WHERE barcode = ?", (user_barcode,)).fetchone()
+        if not user:
+            return None, (jsonify({"error": "User barcode not found"}), 404)
+        return user["id"], None
+    return None, (jsonify({"error": "user_barcode or user session required"}), 400)
+
+
 @app.route("/loans", methods=["POST"])
 def create_loan():
     """
@@ -549,7 +2610,6 @@ def create_loan():
     Response: loan object
     """
     data = request.json or {}
-    user_barcode = data.get("user_barcode", "").strip()
     item_barcode = data.get("item_barcode", "").strip()
     item_id = data.get("item_id")
     due_date = data.get("due_date")
@@ -564,50 +2624,34 @@ def create_loan():
     conn = get_db()
 
     # Resolve user: try session first, then barcode
-    user_id = None
-    if session.get("is_user"):
-        user_id = session["user_id"]
-    elif session.get("is_admin") and data.get("user_id"):
-        user_id = data.get("user_id")
-    elif user_barcode:
-        user = conn.execute("SELECT id FROM users WHERE barcode = ?", (user_barcode,)).fetchone()
-        if not user:
-            conn.close()
-            return jsonify({"error": "User barcode not found"}), 404
-        user_id = user["id"]
-    else:
-        conn.close()
-        return jsonify({"error": "user_barcode or user session required"}), 400
+    user_id, error = resolve_loan_user(conn, data)
+    if error:
+        return error
 
     # Resolve item
     item = None
     if item_id:
-        item = conn.execute("SELECT id, quantity FROM items WHERE id = ?", (item_id,)).fetchone()
+        item = conn.execute("SELECT id, available FROM items WHERE id = ?", (item_id,)).fetchone()
     elif item_barcode:
-        item = conn.execute("SELECT id, quantity FROM items WHERE barcode = ?", (item_barcode,)).fetchone()
+        item = conn.execute("SELECT id, available FROM items WHERE barcode = ?", (item_barcode,)).fetchone()
 
     if not item:
-        conn.close()
         return jsonify({"error": "Item not found"}), 404
 
-    if item["quantity"] < 1:
-        conn.close()
+    if item["available"] < 1:
         return jsonify({"error": "Item not available"}), 400
 
-    # Create loan
+    # Create loan (the loans_stock_* triggers update items.on_loan)
     try:
         c = conn.cursor()
-        c.execute(
-            "UPDATE items SET quantity = quantity - 1 WHERE id = ?",
-            (item["id"],)
-        )
         c.execute(
             "INSERT INTO loans (item_id, user_id, loan_date, due_date, created_at) "
             "VALUES (?, ?, CURRENT_TIMESTAMP, ?, CURRENT_TIMESTAMP)",
             (item["id"], user_id, due_date)
         )
-        conn.commit()
         loan_id = c.lastrowid
+        record_event(conn, "loan.created", loan_id=loan_id, item_id=item["id"], user_id=user_id, due_date=due_date)
+        conn.commit()
 
         if is_manual:
             c.execute(
@@ -615,17 +2659,154 @@ def create_loan():
                 "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
                 (item["id"], user_id, "manual_loan", f"Loan {loan_id} was created manually.",)
             )
+            record_event(conn, "flag.created", flag_id=c.lastrowid, item_id=item["id"], flag_type="manual_loan")
             conn.commit()
+        event_hub.notify()
 
         loan = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
-        conn.close()
         return jsonify(dict(loan)), 201
+    except sqlite3.IntegrityError:
+        conn.rollback()  # lost a race for the last copy (loans_stock_check)
+        return jsonify({"error": "Item not available"}), 400
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not create loan", "detail": str(e)}), 500
 
 
+LOAN_BATCH_MAX = 200
+
+
+@app.route("/loans/batch", methods=["POST"])
+def create_loans_batch():
+    """
+    Check out several items to one user in a single transaction.
+    Request: {"user_barcode": "..." (or session), "due_date": "YYYY-MM-DD",
+              "items": [{"item_barcode": "..."} | {"item_id": 123}, ...],
+              "atomic": true, "is_manual": boolean}
+    With atomic=true (default) nothing is loaned unless every item is available (409).
+    With atomic=false available items are loaned and the rest reported (207).
+    Response: {"loans": [...], "results": [{"status": "created"|"not_found"|"unavailable"|"invalid", ...}]}
+    """
+    data = request.json or {}
+    due_date = data.get("due_date")
+    requested = data.get("items")
+    atomic = data.get("atomic", True)
+    is_manual = data.get("is_manual", False)
+
+    if not due_date:
+        return jsonify({"error": "due_date required"}), 400
+    if not isinstance(requested, list) or not requested:
+        return jsonify({"error": "items (list) required"}), 400
+    if len(requested) > LOAN_BATCH_MAX:
+        return jsonify({"error": f"At most {LOAN_BATCH_MAX} items per batch"}), 400
+
+    conn = get_db()
+
+    user_id, error = resolve_loan_user(conn, data)
+    if error:
+        return error
+
+    # Normalize the request into ("id" | "barcode", key) references
+    refs = []
+    for entry in requested:
+        entry = entry if isinstance(entry, dict) else {}
+        item_barcode = entry.get("item_barcode")
+        if entry.get("item_id") and str(entry["item_id"]).isdigit():
+            refs.append(("id", int(entry["item_id"])))
+        elif isinstance(item_barcode, str) and item_barcode.strip():
+            refs.append(("barcode", item_barcode.strip()))
+        else:
+            refs.append(None)
+
+    ids = [key for kind, key in filter(None, refs) if kind == "id"]
+    barcodes = [key for kind, key in filter(None, refs) if kind == "barcode"]
+
+    try:
+        # Take the write lock up front so availability can't change under us.
+        conn.execute("BEGIN IMMEDIATE")
+        items = conn.execute(
+            f"""
+            SELECT id, barcode, available FROM items
+            WHERE id IN ({_placeholders(ids)}) OR barcode IN ({_placeholders(barcodes)})
+            """,
+            ids + barcodes
+        ).fetchall()
+        by_id = {item["id"]: item for item in items}
+        by_barcode = {item["barcode"]: item for item in items}
+
+        remaining = {item["id"]: item["available"] for item in items}
+        results = []
+        to_loan = []
+        for ref in refs:
+            if ref is None:
+                results.append({"status": "invalid", "error": "item_barcode or item_id required"})
+                continue
+            kind, key = ref
+            item = by_id.get(key) if kind == "id" else by_barcode.get(key)
+            if not item:
+                results.append({"status": "not_found", "item_" + kind: key})
+                continue
+            if remaining[item["id"]] < 1:
+                results.append({"status": "unavailable", "item_id": item["id"]})
+                continue
+            remaining[item["id"]] -= 1
+            results.append({"status": "created", "item_id": item["id"]})
+            to_loan.append(item["id"])
+
+        failed = len(to_loan) < len(refs)
+        if not to_loan or (atomic and failed):
+            conn.rollback()
+            for result in results:
+                if result["status"] == "created":
+                    result["status"] = "available"
+            return jsonify({"error": "Some items could not be loaned", "loans": [], "results": results}), 409
+
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM loans").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO loans (item_id, user_id, loan_date, due_date, created_at) "
+            "VALUES (?, ?, CURRENT_TIMESTAMP, ?, CURRENT_TIMESTAMP)",
+            [(item_id, user_id, due_date) for item_id in to_loan]
+        )
+        # We hold the write lock, so our rows are exactly the ones after last_id.
+        loans = conn.execute("SELECT * FROM loans WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+        record_events(conn, "loan.created", [
+            {"loan_id": loan["id"], "item_id": loan["item_id"], "user_id": user_id, "due_date": due_date}
+            for loan in loans
+        ])
+
+        if is_manual:
+            flags = conn.execute(
+                "INSERT INTO flags (item_id, user_id, flag_type, message, created_at) "
+                "SELECT item_id, user_id, 'manual_loan', 'Loan ' || id || ' was created manually.', CURRENT_TIMESTAMP "
+                "FROM loans WHERE id > ? ORDER BY id "
+                "RETURNING id, item_id",
+                (last_id,)
+            ).fetchall()
+            record_events(conn, "flag.created", [
+                {"flag_id": flag["id"], "item_id": flag["item_id"], "flag_type": "manual_loan"} for flag in flags
+            ])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Could not create loans", "detail": str(e)}), 500
+
+    event_hub.notify()
+
+    created = iter(loans)
+    for result in results:
+        if result["status"] == "created":
+            result["loan_id"] = next(created)["id"]
+
+    return jsonify({"loans": [dict(l) for l in loans], "results": results}), 207 if failed else 201
+
+
+def return_flag_message(user_name, user_id, item_name, item_id, return_message):
+    """Text of the flag created when a user leaves a message on return."""
+    user_name = user_name or f"User {user_id}"
+    item_name = item_name or f"Item {item_id}"
+    return f"Bruker {user_name} returnerte gjenstand '{item_name}' med melding:\n\n{return_message}"
+
+
 @app.route("/loans/<int:loan_id>/return", methods=["POST"])
 def return_loan(loan_id):
     """
@@ -653,25 +2834,20 @@ def return_loan(loan_id):
     elif user_barcode:
         user = conn.execute("SELECT id FROM users WHERE barcode = ?", (user_barcode,)).fetchone()
         if not user:
-            conn.close()
             return jsonify({"error": "Brukerstrekkode ikke funnet"}), 404
         user_id = user["id"]
     else:
-        conn.close()
         return jsonify({"error": "user_barcode eller brukersesjon påkrevd. Vennligst logg inn på nytt."}), 400
 
     # Get loan and verify it belongs to this user
     loan = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
     if not loan:
-        conn.close()
         return jsonify({"error": "Lån ikke funnet"}), 404
 
     if loan["user_id"] != user_id and not session.get("is_admin"):
-        conn.close()
         return jsonify({"error": "Lånet tilhører ikke denne brukeren"}), 401
 
     if loan["return_date"] is not None:
-        conn.close()
         return jsonify({"error": "Lån allerede returnert"}), 400
 
     try:
@@ -680,36 +2856,175 @@ def return_loan(loan_id):
             "UPDATE loans SET return_date = CURRENT_TIMESTAMP WHERE id = ?",
             (loan_id,)
         )
-        c.execute(
-            "UPDATE items SET quantity = quantity + 1 WHERE id = ?",
-            (loan["item_id"],)
-        )
 
         # If user provided a return message, create a flag for admin
         if return_message:
             item = conn.execute("SELECT name FROM items WHERE id = ?", (loan["item_id"],)).fetchone()
-            item_name = item["name"] if item else f"Item {loan['item_id']}"
             user = conn.execute("SELECT name FROM users WHERE id = ?", (user_id,)).fetchone()
-            user_name = user["name"] if user else f"User {user_id}"
-
-            flag_message = f"Bruker {user_name} returnerte gjenstand '{item_name}' med melding:\n\n{return_message}"
+            flag_message = return_flag_message(
+                user["name"] if user else None, user_id,
+                item["name"] if item else None, loan["item_id"],
+                return_message
+            )
             c.execute(
                 "INSERT INTO flags (item_id, user_id, loan_id, flag_type, message, status, created_at) "
                 "VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
                 (loan["item_id"], user_id, loan_id, "return_message", flag_message, "under_vurdering")
             )
+            record_event(conn, "flag.created", flag_id=c.lastrowid, item_id=loan["item_id"], flag_type="return_message")
 
+        record_event(conn, "loan.returned", loan_id=loan_id, item_id=loan["item_id"], user_id=user_id)
         conn.commit()
+        event_hub.notify()
 
         updated = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
-        conn.close()
         return jsonify(dict(updated))
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Kunne ikke returnere lån", "detail": str(e)}), 500
 
 
+RETURN_BATCH_MAX = 200
+
+
+@app.route("/loans/return_batch", methods=["POST"])
+def return_loans_batch():
+    """
+    Return several loans in one transaction (e.g. a class returning a cart).
+    Request: {"user_barcode": "..." (or session), "returns": [{"loan_id": 1} | {"item_barcode": "..."},
+              optional "return_message" per entry]}
+    Admins may return anyone's loans without naming a user; others only their own.
+    An item barcode returns that item's oldest active loan (the user's own, if a user is given).
+    Response: {"returned": n, "results": [{"status": "returned"|"not_found"|"already_returned"|
+               "forbidden"|"invalid", "loan_id": ...}]}, 207 if any entry failed.
+    """
+    data = request.json or {}
+    requested = data.get("returns")
+    user_barcode = (data.get("user_barcode") or "").strip()
+    is_admin = bool(session.get("is_admin"))
+
+    if not isinstance(requested, list) or not requested:
+        return jsonify({"error": "returns (liste) påkrevd"}), 400
+    if len(requested) > RETURN_BATCH_MAX:
+        return jsonify({"error": f"Maks {RETURN_BATCH_MAX} returer per forespørsel"}), 400
+
+    conn = get_db()
+
+    # Resolve user: try session first, then barcode (optional for admins)
+    user_id = None
+    if session.get("is_user"):
+        user_id = session.get("user_id")
+    elif is_admin:
+        user_id = data.get("user_id")
+    if user_id is None and user_barcode:
+        user = conn.execute("SELECT id FROM users WHERE barcode = ?", (user_barcode,)).fetchone()
+        if not user:
+            return jsonify({"error": "Brukerstrekkode ikke funnet"}), 404
+        user_id = user["id"]
+    if user_id is None and not is_admin:
+        return jsonify({"error": "user_barcode eller brukersesjon påkrevd. Vennligst logg inn på nytt."}), 400
+
+    refs = []
+    for entry in requested:
+        entry = entry if isinstance(entry, dict) else {}
+        message = (entry.get("return_message") or "").strip()
+        item_barcode = entry.get("item_barcode")
+        if entry.get("loan_id") and str(entry["loan_id"]).isdigit():
+            refs.append(("loan_id", int(entry["loan_id"]), message))
+        elif isinstance(item_barcode, str) and item_barcode.strip():
+            refs.append(("item_barcode", item_barcode.strip(), message))
+        else:
+            refs.append(None)
+
+    loan_ids = [key for kind, key, _ in filter(None, refs) if kind == "loan_id"]
+    barcodes = [key for kind, key, _ in filter(None, refs) if kind == "item_barcode"]
+
+    loan_columns = """
+        SELECT loans.id, loans.item_id, loans.user_id, loans.return_date,
+               items.barcode AS item_barcode, items.name AS item_name, users.name AS user_name
+        FROM loans
+        LEFT JOIN items ON loans.item_id = items.id
+        LEFT JOIN users ON loans.user_id = users.id
+    """
+    try:
+        # Read and write under one write lock so no loan can be returned twice.
+        conn.execute("BEGIN IMMEDIATE")
+        by_id = {
+            loan["id"]: loan for loan in conn.execute(
+                f"{loan_columns} WHERE loans.id IN ({_placeholders(loan_ids)})", loan_ids
+            )
+        }
+        # Active loans per item barcode, oldest first; the user's own loans first if known.
+        by_barcode = {}
+        for loan in conn.execute(
+            f"""
+            {loan_columns}
+            WHERE items.barcode IN ({_placeholders(barcodes)}) AND loans.return_date IS NULL
+            ORDER BY loans.user_id IS NOT ?, loans.id
+            """,
+            barcodes + [user_id]
+        ):
+            by_barcode.setdefault(loan["item_barcode"], []).append(loan)
+
+        results = []
+        to_return = {}
+        for ref in refs:
+            if ref is None:
+                results.append({"status": "invalid", "error": "loan_id eller item_barcode påkrevd"})
+                continue
+            kind, key, message = ref
+            if kind == "loan_id":
+                loan = by_id.get(key)
+            else:
+                candidates = [l for l in by_barcode.get(key, []) if l["id"] not in to_return]
+                loan = candidates[0] if candidates else None
+
+            if not loan:
+                results.append({"status": "not_found", kind: key})
+            elif not is_admin and loan["user_id"] != user_id:
+                results.append({"status": "forbidden", "loan_id": loan["id"]})
+            elif loan["return_date"] is not None or loan["id"] in to_return:
+                results.append({"status": "already_returned", "loan_id": loan["id"]})
+            else:
+                results.append({"status": "returned", "loan_id": loan["id"]})
+                to_return[loan["id"]] = (loan, message)
+
+        if to_return:
+            ids = list(to_return)
+            conn.execute(
+                f"UPDATE loans SET return_date = CURRENT_TIMESTAMP WHERE id IN ({_placeholders(ids)})",
+                ids
+            )
+            record_events(conn, "loan.returned", [
+                {"loan_id": loan["id"], "item_id": loan["item_id"], "user_id": loan["user_id"]}
+                for loan, _ in to_return.values()
+            ])
+            # Return messages become flags for admin review
+            last_flag_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM flags").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO flags (item_id, user_id, loan_id, flag_type, message, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                [(loan["item_id"], loan["user_id"], loan["id"], "return_message",
+                  return_flag_message(loan["user_name"], loan["user_id"], loan["item_name"], loan["item_id"], message),
+                  "under_vurdering")
+                 for loan, message in to_return.values() if message]
+            )
+            record_events(conn, "flag.created", [
+                {"flag_id": flag["id"], "item_id": flag["item_id"], "flag_type": "return_message"}
+                for flag in conn.execute("SELECT id, item_id FROM flags WHERE id > ? ORDER BY id", (last_flag_id,))
+            ])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Kunne ikke returnere lån", "detail": str(e)}), 500
+
+    if to_return:
+        event_hub.notify()
+
+    failed = len(to_return) < len(refs)
+    return jsonify({"returned": len(to_return), "results": results}), 207 if failed else 200
+
+
 @app.route("/users/me/loans", methods=["GET"])
 def get_user_loans():
     """Get active loans for current logged-in user."""
@@ -732,7 +3047,6 @@ def get_user_loans():
         (user_id,)
     ).fetchall()
 
-    conn.close()
     return jsonify([dict(l) for l in loans])
 
 
@@ -754,33 +3068,29 @@ def extend_loan(loan_id):
     # Resolve user
     user = conn.execute("SELECT id FROM users WHERE barcode = ?", (user_barcode,)).fetchone()
     if not user:
-        conn.close()
         return jsonify({"error": "User barcode not found"}), 404
 
     # Get loan and verify it belongs to this user
     loan = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
     if not loan:
-        conn.close()
         return jsonify({"error": "Loan not found"}), 404
 
     if loan["user_id"] != user["id"]:
-        conn.close()
         return jsonify({"error": "Loan does not belong to this user"}), 401
 
     if loan["return_date"] is not None:
-        conn.close()
         return jsonify({"error": "Cannot extend returned loan"}), 400
 
     try:
         conn.execute("UPDATE loans SET due_date = ? WHERE id = ?", (new_due_date, loan_id))
+        record_event(conn, "loan.updated", loan_id=loan_id, item_id=loan["item_id"], due_date=new_due_date)
         conn.commit()
+        event_hub.notify()
 
         updated = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
-        conn.close()
         return jsonify(dict(updated))
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not extend loan", "detail": str(e)}), 500
 
 
@@ -810,32 +3120,36 @@ def create_flag():
             "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
             (item_id, flag_type, message)
         )
-        conn.commit()
         flag_id = c.lastrowid
 
-        # Send notification to admins
+        # Notify admins (queued in the same transaction as the flag)
         subj = f"New flag created: {flag_type}"
         body = f"A new flag has been created:\n\n"
         body += f"Flag ID: {flag_id}\n"
         body += f"Item ID: {item_id}\n"
         body += f"Type: {flag_type}\n"
         body += f"Message: {message}\n"
-        send_notification(subj, body)
+        queued = queue_notification(conn, subj, body)
+        record_event(conn, "flag.created", flag_id=flag_id, item_id=item_id, flag_type=flag_type)
+        conn.commit()
+        event_hub.notify()
+        if queued:
+            notification_sender.wake()
 
-        conn.close()
         return jsonify({"message": "Flag created"}), 201
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not create flag", "detail": str(e)}), 500
 
 
 @app.route("/admin/flags", methods=["GET"])
 @admin_required
+@conditional_get("flags", "items", "users")
 def list_flags():
     """List all flags (admin only). Unresolved flags first, then by date."""
     conn = get_db()
-    flags = conn.execute(
+    flags = query_rows(
+        conn,
         """
         SELECT flags.*,
                items.name as item_name, items.barcode as item_barcode,
@@ -843,17 +3157,10 @@ def list_flags():
         FROM flags
         LEFT JOIN items ON flags.item_id = items.id
         LEFT JOIN users ON flags.user_id = users.id
-        ORDER BY
-          CASE
-            WHEN flags.status = 'under_vurdering' OR flags.resolved = 0 THEN 0
-            WHEN flags.status = 'ferdig' OR flags.resolved = 1 THEN 1
-            ELSE 2
-          END,
-          flags.created_at DESC
+        ORDER BY flags.inbox_rank, flags.created_at DESC
         """
-    ).fetchall()
-    conn.close()
-    return jsonify([dict(f) for f in flags])
+    )
+    return jsonify(flags)
 
 
 @app.route("/admin/flags/<int:flag_id>/resolve", methods=["PUT"])
@@ -867,7 +3174,6 @@ def resolve_flag(flag_id):
     conn = get_db()
     flag = conn.execute("SELECT * FROM flags WHERE id = ?", (flag_id,)).fetchone()
     if not flag:
-        conn.close()
         return jsonify({"error": "Flagg ikke funnet"}), 404
 
     try:
@@ -896,14 +3202,14 @@ def resolve_flag(flag_id):
                     "UPDATE flags SET status = ?, resolved = ? WHERE id = ?",
                     (status, resolved, flag_id)
                 )
+        record_event(conn, "flag.updated", flag_id=flag_id, item_id=flag["item_id"], status=status)
         conn.commit()
+        event_hub.notify()
 
         updated = conn.execute("SELECT * FROM flags WHERE id = ?", (flag_id,)).fetchone()
-        conn.close()
         return jsonify(dict(updated))
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Kunne ikke oppdatere flagg", "detail": str(e)}), 500
 
 
@@ -923,24 +3229,19 @@ def auth_login():
 
     conn = get_db()
     user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-    if not user:
-        conn.close()
-        return jsonify({"error": "Invalid credentials"}), 401
-
-    if not check_password_hash(user["password_hash"] or "", password):
-        conn.close()
+    if not user or not check_password_hash(user["password_hash"] or "", password):
+        log_event("admin_login_failed", level=logging.WARNING, username=username, reason="invalid_credentials")
         return jsonify({"error": "Invalid credentials"}), 401
 
     if user["role"] not in ("admin", "staff"):
-        conn.close()
+        log_event("admin_login_failed", level=logging.WARNING, username=username, reason="not_admin")
         return jsonify({"error": "User does not have admin privileges"}), 401
 
     # Set session
     session["admin_id"] = user["id"]
     session["is_admin"] = True
-    print(f"DEBUG: After login - session: {session}")
+    log_event("admin_login", admin_id=user["id"])
 
-    conn.close()
     user_dict = dict(user)
     user_dict.pop("password_hash", None)
     return jsonify({"message": "ok", "user": user_dict}), 200
@@ -949,8 +3250,8 @@ def auth_login():
 @app.route("/auth/logout", methods=["POST"])
 def auth_logout():
     """Admin logout."""
+    log_event("admin_logout", admin_id=session.get("admin_id"))
     session.clear()
-    print(f"DEBUG: After logout - session: {session}")
     return jsonify({"message": "Logged out"}), 200
 
 
@@ -962,7 +3263,6 @@ def auth_me():
     # Check admin session
     if session.get("is_admin"):
         user = conn.execute("SELECT id, name, role, barcode FROM users WHERE id = ?", (session.get("admin_id"),)).fetchone()
-        conn.close()
         if not user:
             session.clear()
             return jsonify({"is_admin": False, "is_user": False, "user": None}), 200
@@ -975,7 +3275,6 @@ def auth_me():
         user_id = session.get("user_id")
         if user_id:
             user = conn.execute("SELECT id, name, role, barcode, class_year FROM users WHERE id = ?", (user_id,)).fetchone()
-            conn.close()
             if not user:
                 session.pop("user_id", None)
                 session.pop("is_user", None)
@@ -986,18 +3285,16 @@ def auth_me():
             user_dict.pop("phone", None)
             return jsonify({"is_admin": False, "is_user": True, "user": user_dict}), 200
 
-    conn.close()
     return jsonify({"is_admin": False, "is_user": False, "user": None}), 200
 
 
 @app.route("/admin/users", methods=["GET"])
 @admin_required
+@conditional_get("users")
 def admin_list_users():
     """List all users (admin view: with contact info)."""
     conn = get_db()
-    users = conn.execute("SELECT * FROM users ORDER BY name").fetchall()
-    conn.close()
-    return jsonify([dict(u) for u in users])
+    return jsonify(query_rows(conn, "SELECT * FROM users ORDER BY name"))
 
 
 @app.route("/admin/users/<int:user_id>", methods=["GET"])
@@ -1007,7 +3304,6 @@ def admin_get_user(user_id):
     conn = get_db()
     user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
     if not user:
-        conn.close()
         return jsonify({"error": "User not found"}), 404
 
     # Get loans
@@ -1023,7 +3319,6 @@ def admin_get_user(user_id):
         (user_id,)
     ).fetchall()
 
-    conn.close()
     return jsonify({
         "user": dict(user),
         "loans": [dict(l) for l in loans]
@@ -1056,19 +3351,21 @@ def admin_add_user():
             """,
             (name, barcode or None, class_year or None, role, username or None, pw_hash)
         )
-        conn.commit()
         user_id = c.lastrowid
+        record_event(conn, "user.created", user_id=user_id)
+        conn.commit()
+        event_hub.notify()
+        if barcode:
+            barcode_cache.invalidate_barcode(barcode)
+        user_index.refresh(conn, [user_id])
 
         user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-        conn.close()
         return jsonify(dict(user)), 201
     except sqlite3.IntegrityError as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Duplicate barcode or username"}), 400
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not add user", "detail": str(e)}), 500
 
 
@@ -1094,23 +3391,25 @@ def admin_update_user(user_id):
 
     conn = get_db()
     try:
-        conn.execute(sql, tuple(values))
+        if conn.execute(sql, tuple(values)).rowcount:
+            record_event(conn, "user.updated", user_id=user_id)
         conn.commit()
+        event_hub.notify()
+        barcode_cache.invalidate("user", user_id)
+        if fields["barcode"]:
+            barcode_cache.invalidate_barcode(fields["barcode"])
+        user_index.refresh(conn, [user_id])
 
         user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
         if not user:
-            conn.close()
             return jsonify({"error": "User not found"}), 404
 
-        conn.close()
         return jsonify(dict(user))
     except sqlite3.IntegrityError as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Duplicate barcode or username"}), 400
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not update user", "detail": str(e)}), 500
 
 
@@ -1131,82 +3430,130 @@ def admin_delete_user(user_id):
     ).fetchone()
 
     if active["count"] > 0:
-        conn.close()
         return jsonify({"error": "Cannot delete user with active loans. Return loans first."}), 400
 
     try:
         # Anonymize old loans (set user_id to NULL)
         conn.execute("UPDATE loans SET user_id = NULL WHERE user_id = ?", (user_id,))
         # Delete user
-        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        if conn.execute("DELETE FROM users WHERE id = ?", (user_id,)).rowcount:
+            record_event(conn, "user.deleted", user_id=user_id)
         conn.commit()
-        conn.close()
+        event_hub.notify()
+        barcode_cache.invalidate("user", user_id)
+        user_index.remove(user_id)
         return jsonify({"message": "User deleted (loans anonymized)"})
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not delete user", "detail": str(e)}), 500
 
 
+def _batch_user_id(value):
+    """User id from a batch request entry, or None if it is not one (bools are not ids)."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and re.fullmatch(r"\s*\d+\s*", value):
+        return int(value)  # SQLite used to coerce these when they were bound directly
+    return None
+
+
 @app.route("/admin/users/batch_delete", methods=["POST"])
 @admin_required
 def admin_batch_delete_users():
-    """Delete multiple users (admin only)."""
+    """
+    Delete multiple users (admin only). Loans are anonymized as in single delete.
+    Request: {"user_ids": [1, 2, ...]} (numeric strings such as "5" are accepted)
+    Response: {"message": ..., "results": [{"user_id": 1, "status": "deleted"|"not_found"|
+               "active_loans"|"self"|"invalid"}], "errors": [...]}, one result per distinct
+               id in request order. 207 if any id could not be deleted (active loans, self)
+               or is not an id at all (invalid: booleans, non-numeric strings, ...);
+               ids that do not exist are reported as not_found but, as before, are not errors.
+    """
     data = request.json or {}
     user_ids = data.get("user_ids", [])
 
-    if not user_ids:
+    if not user_ids or not isinstance(user_ids, list):
         return jsonify({"error": "user_ids required"}), 400
 
-    conn = get_db()
-    c = conn.cursor()
-
-    deleted_count = 0
-    errors = []
-
-    for user_id in user_ids:
-        # Prevent deletion of self
-        if user_id == session.get("admin_id"):
-            errors.append(f"Cannot delete yourself (user_id: {user_id})")
-            continue
-
-        # Check for active loans
-        active = c.execute(
-            "SELECT COUNT(*) as count FROM loans WHERE user_id = ? AND return_date IS NULL",
-            (user_id,)
-        ).fetchone()
-
-        if active["count"] > 0:
-            errors.append(f"Cannot delete user {user_id} with active loans.")
-            continue
+    admin_id = session.get("admin_id")
+    parsed_ids = [_batch_user_id(u) for u in user_ids]
+    valid_ids = [u for u in parsed_ids if u is not None]
+    status = {admin_id: "self"}
+    candidates = [(user_id,) for user_id in valid_ids if user_id != admin_id]
 
-        try:
-            # Anonymize old loans (set user_id to NULL)
-            c.execute("UPDATE loans SET user_id = NULL WHERE user_id = ?", (user_id,))
-            # Delete user
-            c.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            deleted_count += 1
-        except Exception as e:
-            errors.append(f"Could not delete user {user_id}: {str(e)}")
-            conn.rollback()
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_user_ids (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.batch_user_ids")
+        conn.executemany("INSERT OR IGNORE INTO temp.batch_user_ids (id) VALUES (?)", candidates)
 
-    conn.commit()
-    conn.close()
+        # Classify every candidate in one pass
+        rows = conn.execute(
+            """
+            SELECT b.id,
+                   users.id IS NOT NULL AS found,
+                   EXISTS (SELECT 1 FROM loans WHERE loans.user_id = b.id AND loans.return_date IS NULL) AS active
+            FROM temp.batch_user_ids b
+            LEFT JOIN users ON users.id = b.id
+            """
+        ).fetchall()
+        for row in rows:
+            status[row["id"]] = "not_found" if not row["found"] else "active_loans" if row["active"] else "deleted"
 
+        conn.executemany(
+            "DELETE FROM temp.batch_user_ids WHERE id = ?",
+            [(row["id"],) for row in rows if status[row["id"]] != "deleted"]
+        )
+        # Anonymize old loans (set user_id to NULL), then delete the users
+        conn.execute("UPDATE loans SET user_id = NULL WHERE user_id IN (SELECT id FROM temp.batch_user_ids)")
+        deleted = conn.execute(
+            "DELETE FROM users WHERE id IN (SELECT id FROM temp.batch_user_ids) RETURNING id"
+        ).fetchall()
+        deleted_count = len(deleted)
+        record_events(conn, "user.deleted", [{"user_id": row["id"]} for row in deleted])
+        conn.execute("DELETE FROM temp.batch_user_ids")
+        conn.commit()
+        event_hub.notify()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Could not delete users", "detail": str(e)}), 500
+
+    results = []
+    seen = set()
+    for raw, user_id in zip(user_ids, parsed_ids):
+        if user_id is None:
+            results.append({"user_id": raw, "status": "invalid"})
+        elif user_id not in seen:
+            seen.add(user_id)
+            results.append({"user_id": user_id, "status": status[user_id]})
+            if status[user_id] == "deleted":
+                barcode_cache.invalidate("user", user_id)
+                user_index.remove(user_id)
+
+    messages = {
+        "self": "Cannot delete yourself (user_id: {})",
+        "active_loans": "Cannot delete user {} with active loans.",
+        "invalid": "Invalid user id: {}",
+    }
+    errors = [messages[r["status"]].format(r["user_id"]) for r in results if r["status"] in messages]
     if errors:
-        return jsonify({"message": f"{deleted_count} users deleted, but some errors occurred.", "errors": errors}), 207
+        return jsonify({
+            "message": f"{deleted_count} users deleted, but some errors occurred.",
+            "results": results,
+            "errors": errors
+        }), 207
 
-    return jsonify({"message": f"{deleted_count} users deleted successfully."})
+    return jsonify({"message": f"{deleted_count} users deleted successfully.", "results": results})
 
 
 @app.route("/admin/items", methods=["GET"])
 @admin_required
+@conditional_get("items")
 def admin_list_items():
     """List all items (admin view)."""
     conn = get_db()
-    items = conn.execute("SELECT * FROM items ORDER BY name").fetchall()
-    conn.close()
-    return jsonify([dict(i) for i in items])
+    return jsonify(query_rows(conn, "SELECT * FROM items ORDER BY name"))
 
 
 @app.route("/admin/items/<int:item_id>", methods=["GET"])
@@ -1216,7 +3563,6 @@ def admin_get_item(item_id):
     conn = get_db()
     item = conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
     if not item:
-        conn.close()
         return jsonify({"error": "Item not found"}), 404
 
     # Get loans
@@ -1232,27 +3578,35 @@ def admin_get_item(item_id):
         (item_id,)
     ).fetchall()
 
-    conn.close()
     return jsonify({
         "item": dict(item),
         "loans": [dict(l) for l in loans]
     })
 
 
+def _is_quantity(value):
+    """True for a non-negative int (bools are not quantities)."""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
 @app.route("/admin/items", methods=["POST"])
 @admin_required
 def admin_add_item():
-    """Add a new item (admin only)."""
+    """Add a new item (admin only). quantity is the total stock (default 1)."""
     data = request.json or {}
     name = data.get("name", "").strip()
     barcode = data.get("barcode", "").strip()
     category = data.get("category", "").strip()
     location = data.get("location", "").strip()
     description = data.get("description", "").strip()
-    quantity = int(data.get("quantity", 1) or 1)
+    quantity = data.get("quantity")
+    if quantity is None:
+        quantity = 1
 
     if not name:
         return jsonify({"error": "name required"}), 400
+    if not _is_quantity(quantity):
+        return jsonify({"error": "quantity must be a non-negative integer"}), 400
 
     conn = get_db()
     try:
@@ -1264,28 +3618,34 @@ def admin_add_item():
             """,
             (name, barcode or None, category or None, location or None, description or None, quantity)
         )
-        conn.commit()
         item_id = c.lastrowid
+        record_event(conn, "item.created", item_id=item_id)
+        conn.commit()
+        event_hub.notify()
+        if barcode:
+            barcode_cache.invalidate_barcode(barcode)
 
         item = conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
-        conn.close()
         return jsonify(dict(item)), 201
     except sqlite3.IntegrityError as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Duplicate barcode"}), 400
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not add item", "detail": str(e)}), 500
 
 
 @app.route("/admin/items/<int:item_id>", methods=["PUT"])
 @admin_required
 def admin_update_item(item_id):
-    """Update item (admin only)."""
+    """
+    Update item (admin only). quantity is the total stock: a non-negative
+    integer, not below the copies currently on loan (400 otherwise).
+    """
     data = request.json or {}
     fields = {k: data.get(k) for k in ("name", "barcode", "category", "location", "description", "quantity", "status", "notes")}
+    if fields["quantity"] is not None and not _is_quantity(fields["quantity"]):
+        return jsonify({"error": "quantity must be a non-negative integer"}), 400
 
     set_parts = []
     values = []
@@ -1302,23 +3662,28 @@ def admin_update_item(item_id):
 
     conn = get_db()
     try:
-        conn.execute(sql, tuple(values))
+        if conn.execute(sql, tuple(values)).rowcount:
+            record_event(conn, "item.updated", item_id=item_id)
         conn.commit()
+        event_hub.notify()
+        barcode_cache.invalidate("item", item_id)
+        if fields["barcode"]:
+            barcode_cache.invalidate_barcode(fields["barcode"])
 
         item = conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
         if not item:
-            conn.close()
             return jsonify({"error": "Item not found"}), 404
 
-        conn.close()
         return jsonify(dict(item))
     except sqlite3.IntegrityError as e:
         conn.rollback()
-        conn.close()
+        if "quantity below on_loan" in str(e):
+            on_loan = conn.execute("SELECT on_loan FROM items WHERE id = ?", (item_id,)).fetchone()[0]
+            return jsonify({"error": f"quantity cannot be below the {on_loan} copies on loan",
+                            "on_loan": on_loan}), 400
         return jsonify({"error": "Duplicate barcode"}), 400
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not update item", "detail": str(e)}), 500
 
 
@@ -1335,38 +3700,419 @@ def admin_delete_item(item_id):
     ).fetchone()
 
     if active["count"] > 0:
-        conn.close()
         return jsonify({"error": "Cannot delete item with active loans."}), 400
 
     try:
-        conn.execute("DELETE FROM items WHERE id = ?", (item_id,))
+        if conn.execute("DELETE FROM items WHERE id = ?", (item_id,)).rowcount:
+            record_event(conn, "item.deleted", item_id=item_id)
         conn.commit()
-        conn.close()
+        event_hub.notify()
+        barcode_cache.invalidate("item", item_id)
         return jsonify({"message": "Item deleted"})
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not delete item", "detail": str(e)}), 500
 
 
+def reconcile_stock(conn, repair=False):
+    """
+    Compare items.on_loan with the actual number of active loans per item.
+    Returns the drifted items [{"item_id", "name", "on_loan", "active_loans"}];
+    with repair=True also resets on_loan to the real count (caller commits).
+    Drift only arises from writes that bypass the loans triggers (e.g. on_loan
+    edited by hand, or loans changed with triggers disabled).
+    """
+    drift = [dict(row) for row in conn.execute(
+        """
+        SELECT items.id AS item_id, items.name, items.on_loan, COUNT(loans.id) AS active_loans
+        FROM items
+        LEFT JOIN loans ON loans.item_id = items.id AND loans.return_date IS NULL
+        GROUP BY items.id
+        HAVING items.on_loan != COUNT(loans.id)
+        """
+    )]
+    if repair and drift:
+        conn.executemany(
+            "UPDATE items SET on_loan = ? WHERE id = ?",
+            [(d["active_loans"], d["item_id"]) for d in drift]
+        )
+    return drift
+
+
+@app.route("/admin/reconcile_stock", methods=["POST"])
+@admin_required
+def admin_reconcile_stock():
+    """
+    Detect and repair drift between items.on_loan and the active loans (admin only).
+    Request (optional): {"dry_run": true} → only report, change nothing.
+    Response: {"drift": [...], "repaired": n} (or {"dry_run": true, "drift": [...]}).
+    """
+    data = request.get_json(silent=True) or {}
+    conn = get_db()
+
+    if data.get("dry_run"):
+        return jsonify({"dry_run": True, "drift": reconcile_stock(conn)})
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")  # no loans may change between count and repair
+        drift = reconcile_stock(conn, repair=True)
+        if drift:
+            record_event(conn, "items.changed", repaired=len(drift))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Could not reconcile stock", "detail": str(e)}), 500
+
+    if drift:
+        event_hub.notify()
+    return jsonify({"drift": drift, "repaired": len(drift)})
+
+
+# ============================================================================
+# BULK IMPORT (CSV / NDJSON)
+# ============================================================================
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# Importable columns per table. Rows are upserted on barcode; columns that are
+# missing or empty in a row keep their current value on update.
+IMPORT_COLUMNS = {
+    "items": ("name", "barcode", "description", "category", "location", "quantity", "status", "notes"),
+    "users": ("name", "barcode", "class_year", "role", "email", "phone", "notes"),
+}
+# SQL defaults for new rows when a column is missing (mirrors the table defaults).
+IMPORT_DEFAULTS = {
+    "items": {"quantity": "1", "status": "'available'"},
+    "users": {"role": "'user'"},
+}
+IMPORT_USER_ROLES = ("user", "staff")
+
+
+def iter_import_records(stream, fmt):
+    """
+    Stream-parse an upload. Yields (line_no, record, error) with either a dict
+    record or an error message; nothing is buffered beyond the current line.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            if None in record:
+                yield reader.line_num, None, "too many fields"
+            else:
+                yield reader.line_num, record, None
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"invalid JSON: {e}"
+            continue
+        if isinstance(record, dict):
+            yield line_no, record, None
+        else:
+            yield line_no, None, "expected a JSON object"
+
+
+def _clean_import_record(table, record):
+    """Validate one record; returns a tuple in IMPORT_COLUMNS order or raises ValueError."""
+    values = {}
+    for col in IMPORT_COLUMNS[table]:
+        value = record.get(col)
+        if isinstance(value, str):
+            value = value.strip()
+        values[col] = None if value in ("", None) else value
+
+    if not values["name"]:
+        raise ValueError("name required")
+    if not values["barcode"]:
+        raise ValueError("barcode required")
+    values["name"] = str(values["name"])
+    values["barcode"] = str(values["barcode"])
+
+    if table == "items" and values["quantity"] is not None:
+        try:
+            values["quantity"] = int(values["quantity"])
+        except (TypeError, ValueError):
+            raise ValueError("quantity must be an integer")
+        if values["quantity"] < 0:
+            raise ValueError("quantity must not be negative")
+    if table == "users" and values["role"] is not None and values["role"] not in IMPORT_USER_ROLES:
+        raise ValueError(f"role must be one of {', '.join(IMPORT_USER_ROLES)}")
+
+    return tuple(values[col] for col in IMPORT_COLUMNS[table])
+
+
+def _upsert_sql(table):
+    # Numbered parameters let the UPDATE branch see whether a value was given,
+    # while new rows still get the column default for missing values.
+    cols = IMPORT_COLUMNS[table]
+    defaults = IMPORT_DEFAULTS[table]
+    values = ", ".join(
+        f"COALESCE(?{n}, {defaults[col]})" if col in defaults else f"?{n}"
+        for n, col in enumerate(cols, start=1)
+    )
+    updates = ", ".join(
+        f"{col} = COALESCE(?{n}, {col})" for n, col in enumerate(cols, start=1) if col != "barcode"
+    )
+    return (
+        f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({values}) "
+        f"ON CONFLICT(barcode) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP"
+    )
+
+
+def import_records(conn, table, records, chunk_size=None):
+    """
+    Upsert (line_no, record, error) tuples into items or users in chunks,
+    one executemany and one commit per chunk. Bad rows are reported, not fatal.
+    Returns {"processed", "upserted", "failed", "errors": [{"line", "error"}]}.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    sql = _upsert_sql(table)
+    report = {"processed": 0, "upserted": 0, "failed": 0, "errors": []}
+
+    def fail(line_no, error):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_no, "error": error})
+
+    def flush(chunk):
+        try:
+            conn.executemany(sql, [values for _, values in chunk])
+            conn.commit()
+            report["upserted"] += len(chunk)
+        except sqlite3.Error:
+            # Something in the chunk violates a constraint: redo it row by row
+            # so only the offending rows are rejected.
+            conn.rollback()
+            for line_no, values in chunk:
+                try:
+                    conn.execute(sql, values)
+                    report["upserted"] += 1
+                except sqlite3.Error as e:
+                    fail(line_no, str(e))
+            conn.commit()
+        for _, values in chunk:
+            barcode_cache.invalidate_barcode(values[1])
+
+    chunk = []
+    for line_no, record, error in records:
+        report["processed"] += 1
+        if error is None:
+            try:
+                chunk.append((line_no, _clean_import_record(table, record)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            fail(line_no, error)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    if report["upserted"]:
+        record_event(conn, f"{table}.changed", upserted=report["upserted"])
+        conn.commit()
+        event_hub.notify()
+    if table == "users":
+        user_index.invalidate()  # one rebuild is cheaper than refreshing row by row
+    return report
+
+
+@app.route("/admin/import/<string:table>", methods=["POST"])
+@admin_required
+def admin_bulk_import(table):
+    """
+    Bulk import/upsert items or users (admin only), matched on barcode.
+    Body: raw CSV (header row) or NDJSON, or a multipart upload in field "file".
+    Format: ?format=csv|ndjson, otherwise inferred from Content-Type / file name.
+    Response: {"processed", "upserted", "failed", "errors": [{"line", "error"}, ...]}
+    """
+    if table not in IMPORT_COLUMNS:
+        return jsonify({"error": "table must be items or users"}), 404
+
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    hint = (upload.filename if upload else request.content_type) or ""
+    fmt = request.args.get("format") or ("ndjson" if "json" in hint.lower() else "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    conn = get_db()
+    try:
+        report = import_records(conn, table, iter_import_records(stream, fmt))
+    except (UnicodeDecodeError, csv.Error) as e:
+        conn.rollback()
+        return jsonify({"error": "Could not parse upload", "detail": str(e)}), 400
+    return jsonify(report), 207 if report["failed"] else 200
+
+
+# ============================================================================
+# STREAMING EXPORT (CSV / NDJSON)
+# ============================================================================
+
+EXPORT_FETCH_SIZE = 500
+
+# Per table: base query, the column used by ?from=&to=, and the ?status= filters.
+EXPORTS = {
+    "loans": {
+        "sql": """
+            SELECT loans.*, items.name AS item_name, items.barcode AS item_barcode,
+                   users.name AS user_name, users.class_year
+            FROM loans
+            LEFT JOIN items ON loans.item_id = items.id
+            LEFT JOIN users ON loans.user_id = users.id
+        """,
+        "date_column": "loans.loan_date",
+        "order_by": "loans.id",
+        "statuses": {
+            "active": "loans.return_date IS NULL",
+            "returned": "loans.return_date IS NOT NULL",
+            "overdue": "loans.return_date IS NULL AND loans.due_date < :now",
+        },
+    },
+    "items": {
+        "sql": "SELECT * FROM items",
+        "date_column": "items.created_at",
+        "order_by": "items.id",
+        "statuses": {
+            "loaned": "EXISTS (SELECT 1 FROM loans WHERE loans.item_id = items.id AND loans.return_date IS NULL)",
+            "not_loaned": "NOT EXISTS (SELECT 1 FROM loans WHERE loans.item_id = items.id AND loans.return_date IS NULL)",
+        },
+    },
+    "users": {
+        "sql": "SELECT id, name, role, barcode, class_year, username, email, phone, notes, created_at, updated_at FROM users",
+        "date_column": "users.created_at",
+        "order_by": "users.id",
+        "statuses": {
+            "with_active_loans": "EXISTS (SELECT 1 FROM loans WHERE loans.user_id = users.id AND loans.return_date IS NULL)",
+        },
+    },
+    "flags": {
+        "sql": """
+            SELECT flags.id, flags.item_id, flags.user_id, flags.loan_id, flags.flag_type, flags.message,
+                   flags.status, flags.resolved, flags.resolution_notes, flags.created_at, flags.resolved_at,
+                   items.name AS item_name, users.name AS user_name
+            FROM flags
+            LEFT JOIN items ON flags.item_id = items.id
+            LEFT JOIN users ON flags.user_id = users.id
+        """,
+        "date_column": "flags.created_at",
+        "order_by": "flags.id",
+        "statuses": {
+            "open": "flags.resolved = 0",
+            "resolved": "flags.resolved = 1",
+        },
+    },
+}
+
+
+def _parse_date(value):
+    datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+def _stream_rows(cur, fmt):
+    """Yield CSV/NDJSON text in chunks of EXPORT_FETCH_SIZE rows straight off the cursor."""
+    columns = [d[0] for d in cur.description]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(columns)
+
+    while True:
+        rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                buffer.write("\n")
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@app.route("/admin/export/<string:table>", methods=["GET"])
+@admin_required
+def admin_export(table):
+    """
+    Stream a full export (admin only) without loading it into memory.
+    Query: ?format=csv|ndjson (default csv), ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive),
+           ?status=... (loans: active|returned|overdue, items: loaned|not_loaned,
+           users: with_active_loans, flags: open|resolved)
+    """
+    export = EXPORTS.get(table)
+    if not export:
+        return jsonify({"error": f"table must be one of {', '.join(EXPORTS)}"}), 404
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    where = []
+    params = {"now": datetime.now().isoformat()}
+    try:
+        if request.args.get("from"):
+            params["date_from"] = _parse_date(request.args["from"])
+            where.append(f"{export['date_column']} >= :date_from")
+        if request.args.get("to"):
+            params["date_to"] = _parse_date(request.args["to"])
+            where.append(f"{export['date_column']} < date(:date_to, '+1 day')")
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+
+    status = request.args.get("status")
+    if status:
+        if status not in export["statuses"]:
+            return jsonify({"error": f"status must be one of {', '.join(export['statuses'])}"}), 400
+        where.append(export["statuses"][status])
+
+    sql = export["sql"]
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {export['order_by']}"
+
+    @stream_with_context
+    def generate():
+        cur = get_db().execute(sql, params)
+        try:
+            yield from _stream_rows(cur, fmt)
+        finally:
+            cur.close()
+
+    filename = f"{table}-{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(generate(), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @app.route("/admin/classes", methods=["GET"])
 @admin_required
+@conditional_get("users")
 def admin_list_classes():
     """Get a list of all unique classes."""
     conn = get_db()
     classes = conn.execute("SELECT DISTINCT class_year FROM users WHERE class_year IS NOT NULL ORDER BY class_year").fetchall()
-    conn.close()
     return jsonify([c["class_year"] for c in classes])
 
 
 @app.route("/admin/classes/<string:class_year>/users", methods=["GET"])
 @admin_required
+@conditional_get("users")
 def admin_list_users_in_class(class_year):
     """Get all users in a specific class."""
     conn = get_db()
-    users = conn.execute("SELECT * FROM users WHERE class_year = ? ORDER BY name", (class_year,)).fetchall()
-    conn.close()
-    return jsonify([dict(u) for u in users])
+    return jsonify(query_rows(conn, "SELECT * FROM users WHERE class_year = ? ORDER BY name", (class_year,)))
 
 
 @app.route("/admin/classes/<string:class_year>", methods=["DELETE"])
@@ -1375,22 +4121,27 @@ def admin_delete_class(class_year):
     """Delete a class by setting the class_year of all users in that class to NULL."""
     conn = get_db()
     try:
-        conn.execute("UPDATE users SET class_year = NULL WHERE class_year = ?", (class_year,))
+        updated = conn.execute("UPDATE users SET class_year = NULL WHERE class_year = ?", (class_year,)).rowcount
+        if updated:
+            record_event(conn, "users.changed", class_year=class_year, updated=updated)
         conn.commit()
-        conn.close()
+        event_hub.notify()
+        barcode_cache.clear()
+        user_index.invalidate()
         return jsonify({"message": f"Class '{class_year}' deleted successfully."})
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Could not delete class", "detail": str(e)}), 500
 
 
 @app.route("/admin/loans", methods=["GET"])
 @admin_required
+@conditional_get("loans", "items", "users")
 def admin_list_loans():
     """List all active loans (admin only)."""
     conn = get_db()
-    loans = conn.execute(
+    loans = query_rows(
+        conn,
         """
         SELECT loans.*,
                items.name as item_name, items.barcode as item_barcode,
@@ -1401,9 +4152,8 @@ def admin_list_loans():
         WHERE loans.return_date IS NULL
         ORDER BY loans.due_date ASC
         """
-    ).fetchall()
-    conn.close()
-    return jsonify([dict(l) for l in loans])
+    )
+    return jsonify(loans)
 
 
 @app.route("/admin/loans/<int:loan_id>/delivery", methods=["PUT"])
@@ -1417,7 +4167,6 @@ def admin_update_delivery(loan_id):
     conn = get_db()
     loan = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
     if not loan:
-        conn.close()
         return jsonify({"error": "Lån ikke funnet"}), 404
 
     try:
@@ -1431,20 +4180,19 @@ def admin_update_delivery(loan_id):
             values.append(delivery_notes)
 
         if not updates:
-            conn.close()
             return jsonify({"error": "Ingen oppdateringer angitt"}), 400
 
         values.append(loan_id)
         sql = f"UPDATE loans SET {', '.join(updates)} WHERE id = ?"
         conn.execute(sql, tuple(values))
+        record_event(conn, "loan.updated", loan_id=loan_id, item_id=loan["item_id"])
         conn.commit()
+        event_hub.notify()
 
         updated = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
-        conn.close()
         return jsonify(dict(updated))
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Kunne ikke oppdatere levering", "detail": str(e)}), 500
 
 
@@ -1458,109 +4206,344 @@ def admin_update_report(loan_id):
     conn = get_db()
     loan = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
     if not loan:
-        conn.close()
         return jsonify({"error": "Lån ikke funnet"}), 404
 
     try:
         conn.execute("UPDATE loans SET report = ? WHERE id = ?", (report, loan_id))
+        record_event(conn, "loan.updated", loan_id=loan_id, item_id=loan["item_id"])
         conn.commit()
+        event_hub.notify()
 
         updated = conn.execute("SELECT * FROM loans WHERE id = ?", (loan_id,)).fetchone()
-        conn.close()
         return jsonify(dict(updated))
     except Exception as e:
         conn.rollback()
-        conn.close()
         return jsonify({"error": "Kunne ikke oppdatere rapport", "detail": str(e)}), 500
 
 
+GDPR_RETENTION_DAYS = 3 * 365
+GDPR_CHUNK_SIZE = int(os.environ.get("GDPR_CHUNK_SIZE", "200"))
+# Pause between chunks so scans and loans get the write lock in between.
+GDPR_CHUNK_PAUSE = float(os.environ.get("GDPR_CHUNK_PAUSE", "0.05"))
+
+
+def run_gdpr_cleanup(conn, job_id):
+    """
+    GDPR cleanup runner: delete users created before params["cutoff"] with no
+    active loans and anonymize their loan history, GDPR_CHUNK_SIZE users per commit.
+    """
+    job = job_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    cutoff = job["params"]["cutoff"]
+    cursor = job["cursor"]
+    progress = {"scanned_users": 0, "removed_users": 0, "anonymized_loans": 0, "skipped_active": 0}
+    progress.update(job["progress"])
+
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        chunk = [row[0] for row in conn.execute(
+            "SELECT id FROM users WHERE role = 'user' AND created_at < ? AND id > ? ORDER BY id LIMIT ?",
+            (cutoff, cursor, GDPR_CHUNK_SIZE)
+        )]
+        if not chunk:
+            conn.rollback()
+            return
+
+        deletable = [row[0] for row in conn.execute(
+            f"""
+            SELECT id FROM users
+            WHERE id IN ({_placeholders(chunk)})
+              AND NOT EXISTS (SELECT 1 FROM loans WHERE loans.user_id = users.id AND loans.return_date IS NULL)
+            """,
+            chunk
+        )]
+        if deletable:
+            anonymized = conn.execute(
+                f"UPDATE loans SET user_id = NULL WHERE user_id IN ({_placeholders(deletable)})", deletable
+            ).rowcount
+            removed = conn.execute(
+                f"DELETE FROM users WHERE id IN ({_placeholders(deletable)})", deletable
+            ).rowcount
+            record_events(conn, "user.deleted", [{"user_id": user_id} for user_id in deletable])
+            progress["anonymized_loans"] += anonymized
+            progress["removed_users"] += removed
+
+        cursor = chunk[-1]
+        progress["scanned_users"] += len(chunk)
+        progress["skipped_active"] += len(chunk) - len(deletable)
+        save_job_progress(conn, job_id, cursor, progress)
+        conn.commit()
+
+        if deletable:
+            event_hub.notify()
+        for user_id in deletable:
+            barcode_cache.invalidate("user", user_id)
+            user_index.remove(user_id)
+        time.sleep(GDPR_CHUNK_PAUSE)
+
+
+JOB_RUNNERS["gdpr_cleanup"] = run_gdpr_cleanup
+
+
 @app.route("/admin/gdpr_cleanup", methods=["POST"])
 @admin_required
 def admin_gdpr_cleanup():
     """
     GDPR cleanup: delete users created 3+ years ago with no active loans.
     Anonymize their loan history (set user_id to NULL).
+    Runs as a background job; responds 202 with the job (or the one already running).
+    Poll GET /admin/jobs/<id> for progress.
     """
     conn = get_db()
-    c = conn.cursor()
+    existing = conn.execute(
+        "SELECT * FROM jobs WHERE kind = 'gdpr_cleanup' AND status IN ('queued', 'running')"
+    ).fetchone()
+    if existing:
+        start_job(existing["id"], "gdpr_cleanup")
+        return jsonify({"message": "GDPR cleanup already in progress", "job": job_dict(existing)}), 202
 
     try:
-        # Find users older than 3 years with no active loans
-        cutoff = (datetime.now() - timedelta(days=3*365)).isoformat()
-        rows = c.execute(
-            "SELECT id FROM users WHERE created_at < ? AND role = 'user'",
-            (cutoff,)
-        ).fetchall()
+        cutoff = (datetime.now() - timedelta(days=GDPR_RETENTION_DAYS)).isoformat()
+        cur = conn.execute(
+            "INSERT INTO jobs (kind, params, created_by) VALUES ('gdpr_cleanup', ?, ?)",
+            (json.dumps({"cutoff": cutoff}), session.get("admin_id"))
+        )
+        conn.commit()
+        job_id = cur.lastrowid
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Cleanup failed", "detail": str(e)}), 500
 
-        removed = 0
-        anonymized_loans = 0
+    start_job(job_id, "gdpr_cleanup")
+    job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return jsonify({"message": "GDPR cleanup started", "job": job_dict(job)}), 202
 
-        for row in rows:
-            uid = row[0]
-            active = c.execute(
-                "SELECT COUNT(*) as count FROM loans WHERE user_id = ? AND return_date IS NULL",
-                (uid,)
-            ).fetchone()
 
-            if active["count"] > 0:
-                continue
+@app.route("/admin/jobs/<int:job_id>", methods=["GET"])
+@admin_required
+def admin_get_job(job_id):
+    """Status and progress of a background job (admin only)."""
+    conn = get_db()
+    job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_dict(job))
 
-            # Anonymize loans
-            c.execute("UPDATE loans SET user_id = NULL WHERE user_id = ?", (uid,))
-            anonymized_loans += c.rowcount
 
-            # Delete user
-            c.execute("DELETE FROM users WHERE id = ?", (uid,))
-            removed += c.rowcount
+OVERDUE_REPORT_MAX_LINES = 200
 
-        conn.commit()
-        conn.close()
 
-        return jsonify({
-            "message": "GDPR cleanup completed",
-            "removed_users": removed,
-            "anonymized_loans": anonymized_loans
-        }), 200
+@app.route("/admin/check_overdue", methods=["POST"])
+@admin_required
+def admin_check_overdue():
+    """
+    Flag overdue loans that are not flagged yet and queue one notification.
+    Idempotent: loans that already have an overdue flag are skipped.
+    Request (optional): {"dry_run": true} → only count, change nothing.
+    """
+    data = request.get_json(silent=True) or {}
+    now = datetime.now().isoformat()
+    # flags.loan_id is TEXT; compare as text so idx_flags_loan can be used.
+    unflagged = """
+        FROM loans
+        WHERE loans.due_date < ? AND loans.return_date IS NULL
+          AND NOT EXISTS (
+            SELECT 1 FROM flags
+            WHERE flags.loan_id = CAST(loans.id AS TEXT) AND flags.flag_type = 'overdue'
+          )
+    """
+    conn = get_db()
+
+    if data.get("dry_run"):
+        count = conn.execute(f"SELECT COUNT(*) {unflagged}", (now,)).fetchone()[0]
+        return jsonify({"dry_run": True, "to_flag": count})
+
+    try:
+        flagged = conn.execute(
+            f"""
+            INSERT INTO flags (item_id, user_id, loan_id, flag_type, message, created_at)
+            SELECT loans.item_id, loans.user_id, loans.id, 'overdue',
+                   'Loan ' || loans.id || ' is overdue.', CURRENT_TIMESTAMP
+            {unflagged}
+            RETURNING id, loan_id, item_id, user_id
+            """,
+            (now,)
+        ).fetchall()
+
+        if not flagged:
+            conn.commit()
+            return jsonify({"message": "No new overdue loans", "flagged": 0}), 200
+
+        # queue notification with the flags
+        subject = "Overdue Loans Report"
+        body = f"{len(flagged)} loans became overdue:\n\n"
+        for flag in flagged[:OVERDUE_REPORT_MAX_LINES]:
+            body += f"Loan ID: {flag['loan_id']}, Item ID: {flag['item_id']}, User ID: {flag['user_id']}\n"
+        if len(flagged) > OVERDUE_REPORT_MAX_LINES:
+            body += f"... and {len(flagged) - OVERDUE_REPORT_MAX_LINES} more (see the flag inbox)\n"
+        queued = queue_notification(conn, subject, body)
+        record_events(conn, "flag.created", [
+            {"flag_id": flag["id"], "item_id": flag["item_id"], "flag_type": "overdue"} for flag in flagged
+        ])
+        conn.commit()
     except Exception as e:
         conn.rollback()
-        conn.close()
-        return jsonify({"error": "Cleanup failed", "detail": str(e)}), 500
+        return jsonify({"error": "Could not flag overdue loans", "detail": str(e)}), 500
 
+    event_hub.notify()
 
-@app.route("/admin/check_overdue", methods=["POST"])
+    if queued:
+        notification_sender.wake()
+    return jsonify({
+        "message": f"{len(flagged)} overdue loans found and flagged.",
+        "flagged": len(flagged),
+    })
+
+
+@app.route("/admin/pool_stats", methods=["GET"])
 @admin_required
-def admin_check_overdue():
-    """Check for overdue loans and send a notification."""
+def admin_pool_stats():
+    """DB connection pool statistics (admin only)."""
+    return jsonify(db_pool.stats())
+
+
+@app.route("/admin/outbox", methods=["GET"])
+@admin_required
+def admin_outbox():
+    """Notification outbox status: counts per status and dead-lettered messages (admin only)."""
     conn = get_db()
-    overdue_loans = conn.execute(
-        "SELECT * FROM loans WHERE due_date < ? AND return_date IS NULL",
-        (datetime.now().isoformat(),)
+    counts = conn.execute(
+        "SELECT status, COUNT(*) AS count FROM notification_outbox GROUP BY status"
     ).fetchall()
-    conn.close()
+    dead = conn.execute(
+        "SELECT id, subject, attempts, last_error, created_at FROM notification_outbox "
+        "WHERE status = 'dead' ORDER BY id DESC LIMIT 50"
+    ).fetchall()
+    return jsonify({
+        "counts": {row["status"]: row["count"] for row in counts},
+        "dead": [dict(d) for d in dead],
+        "sender": notification_sender.stats(),
+    })
 
-    if not overdue_loans:
-        return jsonify({"message": "No overdue loans"}), 200
 
-    for loan in overdue_loans:
-        # Flagging overdue loans
-        conn = get_db()
-        conn.execute(
-            "INSERT INTO flags (item_id, user_id, flag_type, message, created_at) "
-            "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
-            (loan["item_id"], loan["user_id"], "overdue", f"Loan {loan['id']} is overdue.",)
-        )
-        conn.commit()
-        conn.close()
+@app.route("/admin/outbox/<int:message_id>/retry", methods=["POST"])
+@admin_required
+def admin_outbox_retry(message_id):
+    """Re-queue a dead-lettered notification (admin only)."""
+    conn = get_db()
+    cur = conn.execute(
+        "UPDATE notification_outbox SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP "
+        "WHERE id = ? AND status = 'dead'",
+        (message_id,)
+    )
+    conn.commit()
+    if cur.rowcount == 0:
+        return jsonify({"error": "Dead-lettered notification not found"}), 404
+    notification_sender.wake()
+    return jsonify({"message": "Notification re-queued"})
+
 
-    # send notification
-    subject = "Overdue Loans Report"
-    body = "The following loans are overdue:\n\n"
-    for loan in overdue_loans:
-        body += f"Loan ID: {loan['id']}, Item ID: {loan['item_id']}, User ID: {loan['user_id']}, Due Date: {loan['due_date']}\n"
+@app.route("/admin/cache_stats", methods=["GET"])
+@admin_required
+def admin_cache_stats():
+    """Barcode cache and user name index statistics (admin only)."""
+    return jsonify({**barcode_cache.stats(), "user_index": user_index.stats()})
+
+
+# ============================================================================
+# DASHBOARD STATISTICS
+# ============================================================================
+#
+# The `stats` table holds running totals that triggers update on every loan,
+# item, user and flag write (see _migration_10_dashboard_stats), so reading the
+# dashboard is a scan of a few small rows. Rows are (kind, key, value):
+#   count/<name>   active_loans, open_flags, items, users
+#   due/<date>     active loans per due date (overdue = sum over past dates)
+#   category/<c>   items out per item category
+#   class/<c>      active loans per borrower class
+# NULL categories/classes/due dates are stored under the key ''.
+
+def recompute_stats(conn):
+    """Rebuild the stats table from the base tables (caller commits)."""
+    conn.execute("DELETE FROM stats")
+    conn.execute(
+        """
+        INSERT INTO stats (kind, key, value)
+        SELECT 'count', 'active_loans', COUNT(*) FROM loans WHERE return_date IS NULL
+        UNION ALL SELECT 'count', 'open_flags', COUNT(*) FROM flags WHERE inbox_rank = 0
+        UNION ALL SELECT 'count', 'items', COUNT(*) FROM items
+        UNION ALL SELECT 'count', 'users', COUNT(*) FROM users
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO stats (kind, key, value)
+        SELECT 'due', COALESCE(due_date, ''), COUNT(*) FROM loans
+        WHERE return_date IS NULL GROUP BY 2
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO stats (kind, key, value)
+        SELECT 'category', COALESCE(items.category, ''), COUNT(*) FROM loans
+        JOIN items ON items.id = loans.item_id
+        WHERE loans.return_date IS NULL GROUP BY 2
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO stats (kind, key, value)
+        SELECT 'class', COALESCE(users.class_year, ''), COUNT(*) FROM loans
+        LEFT JOIN users ON users.id = loans.user_id
+        WHERE loans.return_date IS NULL GROUP BY 2
+        """
+    )
+
+
+def read_stats(conn):
+    """Dashboard numbers from the stats table."""
+    counts = {"active_loans": 0, "open_flags": 0, "items": 0, "users": 0}
+    groups = {"category": [], "class": []}
+    overdue = 0
+    now = datetime.now().isoformat()  # same cut-off as /admin/check_overdue
+    for row in conn.execute("SELECT kind, key, value FROM stats WHERE value != 0 ORDER BY kind, key"):
+        if row["kind"] == "count":
+            counts[row["key"]] = row["value"]
+        elif row["kind"] == "due":
+            if row["key"] and row["key"] < now:
+                overdue += row["value"]
+        else:
+            groups[row["kind"]].append((row["key"] or None, row["value"]))
+    return {
+        **counts,
+        "overdue_loans": overdue,
+        "items_out_by_category": [{"category": k, "items_out": v} for k, v in groups["category"]],
+        "active_loans_by_class": [{"class_year": k, "active_loans": v} for k, v in groups["class"]],
+    }
+
+
+@app.route("/admin/stats", methods=["GET"])
+@admin_required
+def admin_stats():
+    """
+    Dashboard statistics in one response (admin only): active_loans, overdue_loans,
+    open_flags, items, users, items_out_by_category, active_loans_by_class.
+    """
+    return jsonify(read_stats(get_db()))
 
-    send_notification(subject, body)
 
-    return jsonify({"message": f"{len(overdue_loans)} overdue loans found and flagged. Notification sent."})
+@app.route("/admin/stats/recompute", methods=["POST"])
+@admin_required
+def admin_recompute_stats():
+    """Rebuild the dashboard statistics from scratch (admin only); returns the new numbers."""
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        recompute_stats(conn)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": "Could not recompute statistics", "detail": str(e)}), 500
+    return jsonify(read_stats(conn))
 
 
 # ============================================================================
@@ -1582,6 +4565,14 @@ def server_error(e):
 # ============================================================================
 
 if __name__ == "__main__":
+    setup_logging()
     init_db()
+    # With the debug reloader, only the serving child process runs background work.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        notification_sender.start()
+        resume_jobs()
+        conn = connect_db()
+        user_index.load(conn)
+        conn.close()
     print("🚀 Starting Lager System API on http://127.0.0.1:5000")
     app.run(debug=True, host="127.0.0.1", port=5000)
@@ -1,11 +1,65 @@
+import argparse
+import csv
+import gzip
+import http.client
+import importlib.util
+import io
+import json
 import os
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 import sys
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
 
 # Add the parent directory to the path so we can import the server
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Run against a throwaway database, never the real lager.db
+os.environ.setdefault("LAGER_DB", os.path.join(tempfile.mkdtemp(), "test_lager.db"))
+
+from backend import generate_data, load_test, server
 from backend.server import app
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.serving import make_server
+
+
+def setUpModule():
+    server.init_db()
+
+
+def admin_client():
+    client = app.test_client()
+    client.post('/auth/login', json={'username': 'admin', 'password': '1234'})
+    return client
+
+
+def insert_item(name, barcode, quantity=1, category=None, location=None):
+    conn = server.connect_db()
+    cur = conn.execute(
+        "INSERT INTO items (name, barcode, quantity, category, location) VALUES (?, ?, ?, ?, ?)",
+        (name, barcode, quantity, category, location)
+    )
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
+
+def insert_user(name, barcode=None, class_year=None):
+    conn = server.connect_db()
+    cur = conn.execute(
+        "INSERT INTO users (name, barcode, class_year) VALUES (?, ?, ?)",
+        (name, barcode, class_year)
+    )
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
 
 class BasicTests(unittest.TestCase):
 
@@ -29,5 +83,1310 @@ class BasicTests(unittest.TestCase):
         response = self.app.get('/admin/users')
         self.assertEqual(response.status_code, 401)
 
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def test_connection_is_reused_across_requests(self):
+        client = app.test_client()
+        client.get('/items')
+        before = server.db_pool.stats()
+        client.get('/items')
+        client.get('/users')
+        after = server.db_pool.stats()
+        self.assertEqual(after["open"], before["open"])
+        self.assertEqual(after["hits"], before["hits"] + 2)
+        self.assertEqual(after["in_use"], 0)
+
+    def test_connections_are_configured_once(self):
+        conn = server.db_pool.acquire()
+        try:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        finally:
+            server.db_pool.release(conn)
+
+    def test_exhausted_pool_times_out(self):
+        pool = server.ConnectionPool(server.DB_NAME, max_size=1, timeout=0.01)
+        conn = pool.acquire()
+        with self.assertRaises(server.sqlite3.OperationalError):
+            pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(pool.stats()["timeouts"], 1)
+        self.assertEqual(pool.stats()["waits"], 1)
+
+    def test_pool_stats_endpoint(self):
+        self.assertEqual(app.test_client().get('/admin/pool_stats').status_code, 401)
+        stats = admin_client().get('/admin/pool_stats').get_json()
+        self.assertEqual(set(stats), {"open", "idle", "in_use", "max_size", "hits", "misses", "waits", "timeouts"})
+        self.assertGreaterEqual(stats["open"], 1)
+
+
+class ListItemsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ids = [insert_item(f"Pagetest {n}", f"PGT-{n}", category="Pagetest", location="Rom 1")
+                   for n in range(5)]
+        user_id = insert_user("Pagetest Borrower", "PGT-USER")
+        client = app.test_client()
+        client.post('/loans', json={'user_barcode': 'PGT-USER', 'item_barcode': 'PGT-2',
+                                    'due_date': '2099-01-01'})
+        cls.user_id = user_id
+
+    def test_loan_status_is_joined(self):
+        items = app.test_client().get('/items?category=Pagetest').get_json()
+        self.assertEqual([i["name"] for i in items], [f"Pagetest {n}" for n in range(5)])
+        loaned = {i["name"]: i["loaned_to"] for i in items}
+        self.assertEqual(loaned["Pagetest 2"], "Pagetest Borrower")
+        self.assertIsNone(loaned["Pagetest 0"])
+
+    def test_keyset_pagination(self):
+        client = app.test_client()
+        first = client.get('/items?category=Pagetest&limit=3')
+        self.assertEqual(len(first.get_json()), 3)
+        cursor = first.headers["X-Next-After"]
+        second = client.get(f'/items?category=Pagetest&limit=3&after={cursor}')
+        self.assertEqual([i["name"] for i in second.get_json()], ["Pagetest 3", "Pagetest 4"])
+        self.assertNotIn("X-Next-After", second.headers)
+
+    def test_bad_pagination_params(self):
+        client = app.test_client()
+        self.assertEqual(client.get('/items?limit=abc').status_code, 400)
+        self.assertEqual(client.get('/items?after=nocursor').status_code, 400)
+
+
+class ScanCacheTests(unittest.TestCase):
+
+    def test_repeat_scan_is_cached_and_loans_invalidate(self):
+        item_id = insert_item("Cachetest laptop", "CACHE-ITEM", quantity=2)
+        insert_user("Cachetest Student", "CACHE-USER")
+        client = app.test_client()
+
+        first = client.post('/scan', json={'barcode': 'CACHE-ITEM'}).get_json()
+        hits = server.barcode_cache.stats()["hits"]
+        second = client.post('/scan', json={'barcode': 'CACHE-ITEM'}).get_json()
+        self.assertEqual(server.barcode_cache.stats()["hits"], hits + 1)
+        self.assertEqual(first, second)
+        self.assertFalse(second["loaned"])
+
+        client.post('/loans', json={'user_barcode': 'CACHE-USER', 'item_id': item_id,
+                                    'due_date': '2099-01-01'})
+        after_loan = client.post('/scan', json={'barcode': 'CACHE-ITEM'}).get_json()
+        self.assertTrue(after_loan["loaned"])
+        self.assertEqual((after_loan["item"]["quantity"], after_loan["item"]["available"]), (2, 1))
+        self.assertEqual(after_loan["loaned_to"]["name"], "Cachetest Student")
+
+        user = client.post('/scan', json={'barcode': 'CACHE-USER'}).get_json()
+        self.assertEqual(user["type"], "user")
+        self.assertNotIn("password_hash", user["user"])
+        self.assertEqual(len(user["active_loans"]), 1)
+
+    def test_admin_barcode_change_invalidates(self):
+        item_id = insert_item("Cachetest projector", "CACHE-OLD")
+        client = admin_client()
+        self.assertEqual(client.post('/scan', json={'barcode': 'CACHE-OLD'}).get_json()["type"], "item")
+        client.put(f'/admin/items/{item_id}', json={'barcode': 'CACHE-NEW'})
+        self.assertEqual(client.post('/scan', json={'barcode': 'CACHE-OLD'}).get_json()["type"], "unknown")
+        self.assertEqual(client.post('/scan', json={'barcode': 'CACHE-NEW'}).get_json()["item"]["id"], item_id)
+
+    def test_read_racing_an_invalidation_is_not_cached(self):
+        item_id = insert_item("Cachetest scanner", "CACHE-RACE")
+        conn = server.connect_db()
+        self.addCleanup(conn.close)
+        real_execute = conn.execute
+
+        def execute_then_rename(sql, *args):
+            rows = real_execute(sql, *args)  # reads the row under its old barcode...
+            other = server.connect_db()  # ...then an admin renames it before put()
+            other.execute("UPDATE items SET barcode = 'CACHE-RACE-NEW' WHERE id = ?", (item_id,))
+            other.commit()
+            other.close()
+            server.barcode_cache.invalidate("item", item_id)
+            return rows
+
+        conn.execute = execute_then_rename
+        self.assertEqual(server.lookup_barcode(conn, "CACHE-RACE")[1], item_id)
+        self.assertIsNone(server.barcode_cache.get("CACHE-RACE"))
+        conn.execute = real_execute
+        self.assertIsNone(server.lookup_barcode(conn, "CACHE-RACE"))
+
+    def test_lru_eviction_and_ttl(self):
+        cache = server.BarcodeCache(max_size=2, ttl=60)
+        cache.put("a", "item", 1, {})
+        cache.put("b", "item", 2, {})
+        cache.get("a")
+        cache.put("c", "item", 3, {})
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        expired = server.BarcodeCache(ttl=-1)
+        expired.put("a", "item", 1, {})
+        self.assertIsNone(expired.get("a"))
+        self.assertEqual(expired.stats()["expirations"], 1)
+
+
+class ScanBatchTests(unittest.TestCase):
+
+    def test_batch_matches_single_scans_in_input_order(self):
+        item_id = insert_item("Batchscan camera", "BSCAN-ITEM", quantity=3)
+        insert_user("Batchscan Student", "BSCAN-USER")
+        client = app.test_client()
+        client.post('/loans', json={'user_barcode': 'BSCAN-USER', 'item_id': item_id,
+                                    'due_date': '2099-01-01'})
+
+        barcodes = ['BSCAN-USER', 'nope', 'BSCAN-ITEM', '  ', 'BSCAN-ITEM']
+        response = client.post('/scan/batch', json={'barcodes': barcodes})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()["results"]
+        self.assertEqual([r["status"] for r in results],
+                         ["found", "unknown", "found", "invalid", "found"])
+        for result in (results[0], results[2]):
+            single = client.post('/scan', json={'barcode': result["barcode"]}).get_json()
+            self.assertEqual({k: v for k, v in result.items() if k not in ("barcode", "status")}, single)
+
+    def test_batch_requires_list(self):
+        client = app.test_client()
+        self.assertEqual(client.post('/scan/batch', json={'barcodes': 'x'}).status_code, 400)
+        self.assertEqual(client.post('/scan/batch', json={}).status_code, 400)
+
+
+class LoanBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.laptop = insert_item(f"Batchloan laptop {self.id()}", f"BLOAN-L-{self.id()}", quantity=2)
+        self.charger = insert_item(f"Batchloan charger {self.id()}", f"BLOAN-C-{self.id()}", quantity=1)
+        insert_user(f"Batchloan Teacher {self.id()}", f"BLOAN-U-{self.id()}")
+
+    def checkout(self, items, **extra):
+        body = {'user_barcode': f"BLOAN-U-{self.id()}", 'due_date': '2099-01-01', 'items': items}
+        body.update(extra)
+        return self.client.post('/loans/batch', json=body)
+
+    def available(self, item_id):
+        return self.client.get(f'/items/{item_id}').get_json()["available"]
+
+    def test_atomic_checkout_creates_all_loans(self):
+        response = self.checkout([{'item_id': self.laptop}, {'item_id': self.laptop},
+                                  {'item_barcode': f"BLOAN-C-{self.id()}"}])
+        self.assertEqual(response.status_code, 201)
+        body = response.get_json()
+        self.assertEqual(len(body["loans"]), 3)
+        self.assertEqual([r["loan_id"] for r in body["results"]], [l["id"] for l in body["loans"]])
+        self.assertEqual(self.available(self.laptop), 0)
+        self.assertEqual(self.available(self.charger), 0)
+
+    def test_atomic_checkout_is_all_or_nothing(self):
+        response = self.checkout([{'item_id': self.charger}, {'item_id': self.charger}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([r["status"] for r in response.get_json()["results"]],
+                         ["available", "unavailable"])
+        self.assertEqual(self.available(self.charger), 1)
+
+    def test_partial_checkout(self):
+        response = self.checkout([{'item_id': self.charger}, {'item_id': self.charger},
+                                  {'item_barcode': 'BLOAN-MISSING'}], atomic=False)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r["status"] for r in response.get_json()["results"]],
+                         ["created", "unavailable", "not_found"])
+        self.assertEqual(self.available(self.charger), 0)
+
+
+class ReturnBatchTests(unittest.TestCase):
+
+    def test_bulk_return_by_loan_id_and_barcode(self):
+        client = app.test_client()
+        item_id = insert_item("Returnbatch tablet", "RBATCH-ITEM", quantity=3)
+        insert_user("Returnbatch Student", "RBATCH-USER")
+        insert_user("Returnbatch Other", "RBATCH-OTHER")
+        loans = client.post('/loans/batch', json={
+            'user_barcode': 'RBATCH-USER', 'due_date': '2099-01-01',
+            'items': [{'item_id': item_id}, {'item_id': item_id}],
+        }).get_json()["loans"]
+        other = client.post('/loans', json={'user_barcode': 'RBATCH-OTHER', 'item_id': item_id,
+                                            'due_date': '2099-01-01'}).get_json()
+
+        response = client.post('/loans/return_batch', json={
+            'user_barcode': 'RBATCH-USER',
+            'returns': [
+                {'loan_id': loans[0]["id"], 'return_message': 'Sprukket skjerm'},
+                {'item_barcode': 'RBATCH-ITEM'},
+                {'item_barcode': 'RBATCH-ITEM'},
+                {'loan_id': other["id"]},
+                {'loan_id': loans[0]["id"]},
+            ],
+        })
+        self.assertEqual(response.status_code, 207)
+        body = response.get_json()
+        self.assertEqual(body["returned"], 2)
+        self.assertEqual([r["status"] for r in body["results"]],
+                         ["returned", "returned", "forbidden", "forbidden", "already_returned"])
+        self.assertEqual(body["results"][1]["loan_id"], loans[1]["id"])
+        self.assertEqual(client.get(f'/items/{item_id}').get_json()["available"], 2)
+
+        flags = admin_client().get('/admin/flags').get_json()
+        flag = next(f for f in flags if f["loan_id"] == str(loans[0]["id"]))
+        self.assertIn("Sprukket skjerm", flag["message"])
+        self.assertIn("Returnbatch Student", flag["message"])
+
+    def test_requires_user_unless_admin(self):
+        response = app.test_client().post('/loans/return_batch', json={'returns': [{'loan_id': 1}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class OverdueTests(unittest.TestCase):
+
+    def test_check_overdue_is_idempotent_with_dry_run(self):
+        client = admin_client()
+        client.post('/admin/check_overdue')  # flag whatever earlier tests left overdue
+        item_id = insert_item("Overdue speaker", "OVERDUE-ITEM", quantity=2)
+        insert_user("Overdue Student", "OVERDUE-USER")
+        for due in ('2000-01-01', '2099-01-01'):
+            client.post('/loans', json={'user_barcode': 'OVERDUE-USER', 'item_id': item_id, 'due_date': due})
+
+        dry = client.post('/admin/check_overdue', json={'dry_run': True}).get_json()
+        self.assertEqual(dry, {"dry_run": True, "to_flag": 1})
+
+        first = client.post('/admin/check_overdue').get_json()
+        self.assertEqual(first["flagged"], 1)
+        second = client.post('/admin/check_overdue').get_json()
+        self.assertEqual(second["flagged"], 0)
+
+        flags = [f for f in client.get('/admin/flags').get_json()
+                 if f["flag_type"] == "overdue" and f["item_id"] == item_id]
+        self.assertEqual(len(flags), 1)
+
+
+class GdprCleanupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = server.connect_db()
+        self.conn.execute("UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE role = 'user'")
+        self.old_users = []
+        for n in range(5):
+            cur = self.conn.execute(
+                "INSERT INTO users (name, barcode, role, created_at) VALUES (?, ?, 'user', '2001-01-01')",
+                (f"Gdpr {self.id()} {n}", f"GDPR-{self.id()}-{n}")
+            )
+            self.old_users.append(cur.lastrowid)
+        item = self.conn.execute("INSERT INTO items (name, quantity) VALUES ('Gdpr item', 5)").lastrowid
+        # Old returned loan for user 0, active loan for user 1
+        self.conn.execute("INSERT INTO loans (item_id, user_id, return_date) VALUES (?, ?, '2002-01-01')",
+                          (item, self.old_users[0]))
+        self.conn.execute("INSERT INTO loans (item_id, user_id) VALUES (?, ?)", (item, self.old_users[1]))
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.execute("UPDATE loans SET return_date = CURRENT_TIMESTAMP WHERE user_id = ?",
+                          (self.old_users[1],))
+        self.conn.execute("UPDATE jobs SET status = 'done' WHERE status != 'done'")
+        self.conn.commit()
+        self.conn.close()
+
+    def remaining(self):
+        return [row[0] for row in self.conn.execute(
+            f"SELECT id FROM users WHERE id IN ({','.join('?' * len(self.old_users))})", self.old_users)]
+
+    def test_cleanup_resumes_from_saved_cursor(self):
+        # A job that "crashed" after processing the first two users
+        job_id = self.conn.execute(
+            "INSERT INTO jobs (kind, status, params, cursor, progress) VALUES ('gdpr_cleanup', 'running', ?, ?, ?)",
+            (json.dumps({"cutoff": "2010-01-01"}), self.old_users[1], json.dumps({"removed_users": 1}))
+        ).lastrowid
+        self.conn.commit()
+
+        chunk_size = server.GDPR_CHUNK_SIZE
+        server.GDPR_CHUNK_SIZE = 2
+        try:
+            self.assertTrue(server.claim_job(self.conn, job_id))  # no lease: the runner died
+            server.run_gdpr_cleanup(self.conn, job_id)
+        finally:
+            server.GDPR_CHUNK_SIZE = chunk_size
+
+        self.assertEqual(self.remaining(), self.old_users[:2])
+        job = server.job_dict(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        self.assertEqual(job["cursor"], self.old_users[-1])
+        self.assertEqual(job["progress"]["removed_users"], 4)
+
+    def test_endpoint_runs_cleanup_in_background(self):
+        client = admin_client()
+        response = client.post('/admin/gdpr_cleanup')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()["job"]["id"]
+
+        deadline = time.monotonic() + 10
+        while (job := client.get(f'/admin/jobs/{job_id}').get_json())["status"] != "done":
+            self.assertNotEqual(job["status"], "failed", job.get("error"))
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+        self.assertEqual(self.remaining(), [self.old_users[1]])
+        self.assertEqual(job["progress"]["removed_users"], 4)
+        self.assertEqual(job["progress"]["skipped_active"], 1)
+        anonymized = self.conn.execute("SELECT COUNT(*) FROM loans WHERE user_id = ?",
+                                       (self.old_users[0],)).fetchone()[0]
+        self.assertEqual(anonymized, 0)
+
+    def test_one_runner_per_job_across_processes(self):
+        job_id = self.conn.execute(
+            "INSERT INTO jobs (kind, params) VALUES ('gdpr_cleanup', ?)", (json.dumps({"cutoff": "2010-01-01"}),)
+        ).lastrowid
+        self.conn.commit()
+        self.assertTrue(server.claim_job(self.conn, job_id))
+
+        claimed = []
+
+        def claim_elsewhere():  # another worker: own thread, own connection
+            conn = server.connect_db()
+            claimed.append(server.claim_job(conn, job_id))
+            conn.close()
+
+        other = threading.Thread(target=claim_elsewhere)
+        other.start()
+        other.join()
+        self.assertEqual(claimed, [False])  # not while the lease holds
+
+        # Once the lease has expired it can; the first runner then stops without saving its chunk.
+        self.conn.execute("UPDATE jobs SET lease_expires_at = datetime('now', '-1 seconds') WHERE id = ?", (job_id,))
+        self.conn.commit()
+        other = threading.Thread(target=claim_elsewhere)
+        other.start()
+        other.join()
+        self.assertEqual(claimed, [False, True])
+        with self.assertRaises(server.JobLeaseLost):
+            server.run_gdpr_cleanup(self.conn, job_id)
+        self.conn.rollback()
+        self.assertEqual(len(self.remaining()), 5)
+
+    def test_failed_job_is_logged(self):
+        job_id = self.conn.execute("INSERT INTO jobs (kind, params) VALUES ('gdpr_cleanup', '{}')").lastrowid
+        self.conn.commit()
+        with self.assertLogs(server.logger, level="ERROR") as logs:
+            server.start_job(job_id, "gdpr_cleanup")
+            deadline = time.monotonic() + 10
+            while self.conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] != "failed":
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.05)
+            while not logs.records:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        self.assertEqual(logs.records[0].getMessage(), "job_failed")
+        self.assertEqual(logs.records[0].fields["error_type"], "KeyError")
+
+
+class BatchDeleteUsersTests(unittest.TestCase):
+
+    def test_per_id_outcomes(self):
+        client = admin_client()
+        admin_id = client.get('/auth/me').get_json()["user"]["id"]
+        keep = insert_user("Batchdelete Borrower", "BDEL-KEEP")
+        gone = insert_user("Batchdelete Graduate", "BDEL-GONE")
+        item_id = insert_item("Batchdelete item", "BDEL-ITEM", quantity=2)
+        for barcode in ("BDEL-KEEP", "BDEL-GONE"):
+            client.post('/loans', json={'user_barcode': barcode, 'item_id': item_id, 'due_date': '2099-01-01'})
+        returned = client.post('/scan', json={'barcode': 'BDEL-GONE'}).get_json()["active_loans"][0]["id"]
+        client.post(f'/loans/{returned}/return', json={'user_barcode': 'BDEL-GONE'})
+
+        response = client.post('/admin/users/batch_delete',
+                               json={'user_ids': [keep, gone, 999999, admin_id, "x"]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r["status"] for r in response.get_json()["results"]],
+                         ["active_loans", "deleted", "not_found", "self", "invalid"])
+        self.assertEqual(client.get(f'/users/{gone}').status_code, 404)
+        self.assertEqual(client.get(f'/users/{keep}').status_code, 200)
+        history = client.get(f'/items/{item_id}').get_json()["history"]
+        self.assertIn(None, [loan["user_id"] for loan in history])
+
+    def test_mixed_payload_keeps_input_order(self):
+        client = admin_client()
+        first = insert_user("Batchdelete Mixed One", "BDEL-MIX-1")
+        second = insert_user("Batchdelete Mixed Two", "BDEL-MIX-2")
+        response = client.post('/admin/users/batch_delete', json={'user_ids': [first, True, "x", first]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.get_json()["results"], [
+            {"user_id": first, "status": "deleted"},
+            {"user_id": True, "status": "invalid"},
+            {"user_id": "x", "status": "invalid"},
+        ])
+
+        # Numeric strings and ids that no longer exist are handled as before: 200.
+        response = client.post('/admin/users/batch_delete', json={'user_ids': [str(second), first]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["results"], [
+            {"user_id": second, "status": "deleted"},
+            {"user_id": first, "status": "not_found"},
+        ])
+
+
+class BulkImportTests(unittest.TestCase):
+
+    def test_csv_import_reports_bad_rows_and_upserts(self):
+        client = admin_client()
+        insert_item("Import old name", "IMP-1", quantity=1, location="Skap A1")
+        csv_body = (
+            "name,barcode,category,quantity\n"
+            "Import laptop,IMP-1,Datamaskiner,4\n"
+            "Import mouse,IMP-2,Periferi,not-a-number\n"
+            ",IMP-3,Periferi,1\n"
+            "Import cable,IMP-4,Kabler,\n"
+        )
+        response = client.post('/admin/import/items', data=csv_body, content_type='text/csv')
+        self.assertEqual(response.status_code, 207)
+        report = response.get_json()
+        self.assertEqual((report["processed"], report["upserted"], report["failed"]), (4, 2, 2))
+        self.assertEqual([e["line"] for e in report["errors"]], [3, 4])
+
+        item = client.post('/scan', json={'barcode': 'IMP-1'}).get_json()["item"]
+        self.assertEqual((item["name"], item["quantity"], item["location"]), ("Import laptop", 4, "Skap A1"))
+        self.assertEqual(client.post('/scan', json={'barcode': 'IMP-4'}).get_json()["item"]["quantity"], 1)
+
+    def test_ndjson_user_import(self):
+        client = admin_client()
+        body = (
+            '{"name": "Import Student", "barcode": "IMP-U1", "class_year": "1A"}\n'
+            '{"name": "Import Admin", "barcode": "IMP-U2", "role": "admin"}\n'
+            'not json\n'
+        )
+        response = client.post('/admin/import/users?format=ndjson', data=body)
+        report = response.get_json()
+        self.assertEqual((report["upserted"], report["failed"]), (1, 2))
+        user = client.post('/scan', json={'barcode': 'IMP-U1'}).get_json()["user"]
+        self.assertEqual(user["class_year"], "1A")
+
+    def test_unknown_table(self):
+        self.assertEqual(admin_client().post('/admin/import/loans', data="").status_code, 404)
+
+
+class ExportTests(unittest.TestCase):
+
+    def test_loan_export_streams_csv_with_status_filter(self):
+        client = admin_client()
+        item_id = insert_item("Export drill", "EXP-ITEM", quantity=2)
+        insert_user("Export Student", "EXP-USER")
+        loans = client.post('/loans/batch', json={'user_barcode': 'EXP-USER', 'due_date': '2000-01-01',
+                                                  'items': [{'item_id': item_id}, {'item_id': item_id}]})
+        returned_id = loans.get_json()["loans"][0]["id"]
+        client.post('/loans/return_batch', json={'user_barcode': 'EXP-USER', 'returns': [{'loan_id': returned_id}]})
+
+        response = client.get('/admin/export/loans?status=overdue')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        mine = [r for r in rows if r["item_barcode"] == "EXP-ITEM"]
+        self.assertEqual(len(mine), 1)
+        self.assertEqual(mine[0]["user_name"], "Export Student")
+        self.assertTrue(all(r["return_date"] == "" for r in rows))
+
+    def test_ndjson_export_with_date_range(self):
+        client = admin_client()
+        insert_item("Export saw", "EXP-NDJSON")
+        body = client.get('/admin/export/items?format=ndjson&from=2000-01-01&to=2098-12-31').get_data(as_text=True)
+        items = [json.loads(line) for line in body.splitlines()]
+        self.assertIn("EXP-NDJSON", [i["barcode"] for i in items])
+        later = client.get('/admin/export/items?format=ndjson&from=2099-01-01')
+        self.assertEqual(later.get_data(as_text=True), "")
+
+    def test_bad_parameters(self):
+        client = admin_client()
+        self.assertEqual(client.get('/admin/export/secrets').status_code, 404)
+        self.assertEqual(client.get('/admin/export/loans?status=lost').status_code, 400)
+        self.assertEqual(client.get('/admin/export/loans?from=yesterday').status_code, 400)
+
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib.send_message(); stores each DATA payload."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 stand-in ESMTP")
+        self.server.connections += 1
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command in ("EHLO", "HELO"):
+                self.reply("250 stand-in")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                lines = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    lines.append(data.decode())
+                if self.server.fail_next:
+                    self.server.fail_next -= 1
+                    self.reply("451 try again later")
+                else:
+                    self.server.messages.append("".join(lines))
+                    self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInSMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.fail_next = 0
+
+
+class NotificationOutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.smtp = StandInSMTPServer()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.sender = server.NotificationSender(
+            host="127.0.0.1", port=self.smtp.server_address[1], sender="lager@example.com",
+            default_to=["admin@example.com"], starttls=False
+        )
+        self.conn = server.connect_db()
+        self.conn.execute("DELETE FROM notification_outbox")
+        self.conn.commit()
+        os.environ["NOTIFICATIONS_ENABLED"] = "true"
+
+    def tearDown(self):
+        os.environ.pop("NOTIFICATIONS_ENABLED", None)
+        self.conn.close()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+
+    def test_flag_notification_is_queued_and_drained_over_one_connection(self):
+        item_id = insert_item("Outbox printer", "OUTBOX-1")
+        client = app.test_client()
+        client.post('/flags', json={'item_id': item_id, 'flag_type': 'defect', 'message': 'Papirstopp'})
+        client.post('/flags', json={'item_id': item_id, 'flag_type': 'defect', 'message': 'Tom for toner'})
+        pending = self.conn.execute(
+            "SELECT COUNT(*) FROM notification_outbox WHERE status = 'pending'").fetchone()[0]
+        self.assertEqual(pending, 2)
+
+        self.assertEqual(self.sender.drain(self.conn), 2)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertIn("Papirstopp", self.smtp.messages[0])
+        self.assertEqual(self.sender.drain(self.conn), 0)
+
+    def test_failed_send_is_retried_then_dead_lettered(self):
+        server.queue_notification(self.conn, "Subject", "Body")
+        self.conn.commit()
+        self.smtp.fail_next = 1
+        self.assertEqual(self.sender.drain(self.conn), 0)
+        row = self.conn.execute("SELECT * FROM notification_outbox").fetchone()
+        self.assertEqual((row["status"], row["attempts"]), ("pending", 1))
+        self.assertIn("451", row["last_error"])
+
+        # Make it due again and exhaust the attempts
+        self.smtp.fail_next = 1
+        self.conn.execute("UPDATE notification_outbox SET next_attempt_at = datetime('now', '-1 seconds'), "
+                          "attempts = ?", (server.NOTIFY_MAX_ATTEMPTS - 1,))
+        self.conn.commit()
+        with self.assertLogs(server.logger, level="ERROR") as logs:
+            self.sender.drain(self.conn)
+        row = self.conn.execute("SELECT * FROM notification_outbox").fetchone()
+        self.assertEqual(row["status"], "dead")
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), "notification_dead")
+        self.assertEqual(record.fields["notification_id"], row["id"])
+
+    def test_disabled_notifications_are_not_queued(self):
+        os.environ["NOTIFICATIONS_ENABLED"] = "false"
+        self.assertFalse(server.queue_notification(self.conn, "Subject", "Body"))
+
+
+class SearchTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tripod = insert_item("Fts Stativ Manfrotto", "FTS-1", category="Fts Foto", location="Fotorom")
+        cls.camera = insert_item("Fts Kamera Canon", "FTS-2", category="Fts Foto", location="Stativskap")
+        cls.user_id = insert_user("Åse Ftsdottir", "FTS-USER", class_year="3STA")
+
+    def test_item_prefix_search_is_ranked(self):
+        client = app.test_client()
+        items = client.get('/search/items?q=fts stat').get_json()
+        # A name hit outranks a location hit.
+        self.assertEqual([i["id"] for i in items], [self.tripod, self.camera])
+        self.assertIn("loaned_to", items[0])
+        self.assertEqual(client.get('/search/items?q=fts stat&limit=1').get_json()[0]["id"], self.tripod)
+
+    def test_index_follows_updates_and_deletes(self):
+        item_id = insert_item("Fts Mikrofon", "FTS-3")
+        client = app.test_client()
+        self.assertEqual([i["id"] for i in client.get('/search/items?q=ftsmik').get_json()], [])
+        self.assertEqual([i["id"] for i in client.get('/search/items?q=fts mikro').get_json()], [item_id])
+
+        conn = server.connect_db()
+        conn.execute("UPDATE items SET name = 'Fts Høyttaler' WHERE id = ?", (item_id,))
+        conn.commit()
+        self.assertEqual(client.get('/search/items?q=fts mikro').get_json(), [])
+        self.assertEqual([i["id"] for i in client.get('/search/items?q=fts høytt').get_json()], [item_id])
+
+        conn.execute("DELETE FROM items WHERE id = ?", (item_id,))
+        conn.commit()
+        conn.close()
+        self.assertEqual(client.get('/search/items?q=fts høytt').get_json(), [])
+
+    def test_user_search_ignores_diacritics_and_operators(self):
+        client = app.test_client()
+        users = client.get('/search/users?q=ase ftsd').get_json()
+        self.assertEqual([u["id"] for u in users], [self.user_id])
+        self.assertNotIn("email", users[0])
+        self.assertEqual([u["id"] for u in client.get('/search/users?q="ftsd*^ (').get_json()],
+                         [self.user_id])
+        login = client.post('/users/search', json={'name': 'ftsdot'}).get_json()
+        self.assertEqual([u["id"] for u in login], [self.user_id])
+
+    def test_empty_query_and_bad_limit(self):
+        client = app.test_client()
+        self.assertEqual(client.get('/search/items?q=  ').get_json(), [])
+        self.assertEqual(client.get('/search/users?q=a&limit=0').status_code, 400)
+        self.assertEqual(client.get('/search/items?q=a&limit=x').status_code, 400)
+
+
+class UserNameIndexTests(unittest.TestCase):
+
+    def test_fold_and_variants(self):
+        self.assertEqual(server.fold_name("Bjørn Ærø-Ås"), "bjorn aero-as")
+        self.assertIn("aasen", server.name_variants("Åsen"))
+        self.assertIn("asen", server.name_variants("Aasen"))
+
+    def test_search_prefix_substring_and_ranking(self):
+        index = server.UserNameIndex()
+        conn = server.connect_db(":memory:")
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, role TEXT, barcode TEXT, class_year TEXT)")
+        conn.executemany("INSERT INTO users (id, name) VALUES (?, ?)", [
+            (1, "Kari Nordmann"), (2, "Ola Nordmann"), (3, "Nora Aasen"), (4, "Bjørn Johansen"),
+        ])
+        index.load(conn)
+        ids = lambda text, limit=10: [u["id"] for u in index.search(text, limit)]
+
+        self.assertEqual(ids("nor"), [3, 1, 2])  # starts-with first, then by name
+        self.assertEqual(ids("ola nor"), [2])
+        self.assertEqual(ids("Åsen"), [3])
+        self.assertEqual(ids("bjorn"), [4])
+        self.assertEqual(ids("hansen"), [4])  # substring, like the old LIKE search
+        self.assertEqual(ids("nor", limit=1), [3])
+        self.assertEqual(ids("  "), [])
+
+        conn.execute("UPDATE users SET name = 'Kari Hansen' WHERE id = 1")
+        index.refresh(conn, [1])
+        self.assertEqual(ids("nordmann"), [2])
+        self.assertEqual(ids("hansen"), [1, 4])
+        index.remove(2)
+        self.assertEqual(ids("ola"), [])
+        conn.close()
+
+    def test_endpoint_follows_admin_writes(self):
+        client = admin_client()
+        client.post('/users/search', json={'name': 'x'})  # make sure the index is loaded
+        user = client.post('/admin/users', json={'name': 'Typeahead Øyvind'}).get_json()
+        found = client.post('/users/search', json={'name': 'typeahead oyv'}).get_json()
+        self.assertEqual([u["id"] for u in found], [user["id"]])
+        self.assertNotIn("email", found[0])
+
+        client.put(f'/admin/users/{user["id"]}', json={'name': 'Typeahead Per'})
+        self.assertEqual(client.post('/users/search', json={'name': 'typeahead oyv'}).get_json(), [])
+        client.delete(f'/admin/users/{user["id"]}')
+        self.assertEqual(client.post('/users/search', json={'name': 'typeahead per'}).get_json(), [])
+
+    def test_concurrent_loads_rebuild_once(self):
+        index = server.UserNameIndex(ttl=60)
+        conn = server.connect_db(":memory:")
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, role TEXT, barcode TEXT, class_year TEXT)")
+        conn.execute("INSERT INTO users (id, name) VALUES (1, 'Kari Nordmann')")
+        scans = []
+
+        class CountingConnection:
+            def execute(self, sql, *args):
+                scans.append(sql)
+                time.sleep(0.05)  # keep the other threads waiting on the lock
+                return conn.execute(sql, *args)
+
+        threads = [threading.Thread(target=index.load, args=(CountingConnection(),)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(scans), 1)
+        self.assertEqual([u["id"] for u in index.search("kari", 10)], [1])
+
+
+class ConditionalGetTests(unittest.TestCase):
+
+    def test_items_304_until_a_relevant_table_changes(self):
+        client = app.test_client()
+        first = client.get('/items')
+        etag = first.headers["ETag"]
+        self.assertEqual(first.headers["Cache-Control"], "no-cache")
+
+        again = client.get('/items', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b"")
+        self.assertEqual(again.headers["ETag"], etag)
+
+        users_etag = client.get('/users').headers["ETag"]
+        insert_item("Etag Item", "ETAG-1")
+        changed = client.get('/items', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        # An item write does not invalidate /users.
+        self.assertEqual(client.get('/users', headers={'If-None-Match': users_etag}).status_code, 304)
+
+    def test_loans_and_flags_bump_admin_lists(self):
+        client = admin_client()
+        item_id = insert_item("Etag Loan Item", "ETAG-2")
+        insert_user("Etag Borrower", "ETAG-USER")
+        loans_etag = client.get('/admin/loans').headers["ETag"]
+        flags_etag = client.get('/admin/flags').headers["ETag"]
+
+        client.post('/loans', json={'user_barcode': 'ETAG-USER', 'item_barcode': 'ETAG-2',
+                                    'due_date': '2099-01-01'})
+        self.assertEqual(client.get('/admin/loans', headers={'If-None-Match': loans_etag}).status_code, 200)
+        client.post('/flags', json={'item_id': item_id, 'flag_type': 'defect', 'message': 'Etag test'})
+        self.assertEqual(client.get('/admin/flags', headers={'If-None-Match': flags_etag}).status_code, 200)
+
+    def test_unauthenticated_gets_401_not_304(self):
+        etag = admin_client().get('/admin/users').headers["ETag"]
+        response = app.test_client().get('/admin/users', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 401)
+
+
+class ResponseEncodingTests(unittest.TestCase):
+
+    def test_non_json_types_encode_like_flask_under_both_encoders(self):
+        value = {"day": date(2025, 3, 14), "at": datetime(2025, 3, 14, 9, 30), "price": Decimal("1.5"),
+                 "ref": uuid.UUID(int=1)}
+        with app.app_context():
+            expected = json.loads(DefaultJSONProvider(app).dumps(value))
+        encoders = ["stdlib"] + (["orjson"] if server.orjson is not None else [])
+        for encoder in encoders:
+            with self.subTest(encoder=encoder):
+                saved, server.JSON_ENCODER = server.JSON_ENCODER, encoder
+                try:
+                    with app.app_context():
+                        self.assertEqual(json.loads(server.jsonify(value).get_data()), expected)
+                finally:
+                    server.JSON_ENCODER = saved
+        self.assertEqual(expected["price"], "1.5")
+
+    def test_rows_shape_matches_object_shape(self):
+        insert_item("Shape Item", "SHAPE-1")
+        client = admin_client()
+        objects = client.get('/admin/items').get_json()
+        shaped = client.get('/admin/items?shape=rows').get_json()
+        self.assertEqual([dict(zip(shaped["columns"], row)) for row in shaped["rows"]], objects)
+
+    def test_rows_shape_keeps_next_page_cursor(self):
+        insert_item("Shape Page A", "SHAPE-2")
+        insert_item("Shape Page B", "SHAPE-3")
+        client = app.test_client()
+        objects = client.get('/items?limit=1')
+        shaped = client.get('/items?limit=1&shape=rows')
+        self.assertEqual(shaped.headers["X-Next-After"], objects.headers["X-Next-After"])
+
+    def test_large_responses_are_gzipped_when_accepted(self):
+        for i in range(40):
+            insert_item(f"Gzip Item {i}", f"GZIP-{i}")
+        client = app.test_client()
+        plain = client.get('/items')
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        compressed = client.get('/items', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertLess(len(compressed.data), len(plain.data))
+        # The compressed representation has its own ETag, which still revalidates.
+        etag = compressed.headers["ETag"]
+        self.assertEqual(etag, plain.headers["ETag"][:-1] + '-gzip"')
+        again = client.get('/items', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.headers["ETag"], etag)
+
+    def test_small_and_error_responses_are_not_compressed(self):
+        client = app.test_client()
+        response = client.get('/items/999999', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = client.get('/auth/me', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_metrics_expose_route_latency_status_and_db_time(self):
+        client = app.test_client()
+        client.get('/items')
+        client.get('/items/999999')
+        client.get('/no/such/path')
+        body = client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('lager_http_request_duration_seconds_bucket{method="GET",route="/items",le="+Inf"}', body)
+        self.assertIn('lager_http_responses_total{method="GET",route="/items/<int:item_id>",status="404"}', body)
+        self.assertIn('lager_http_responses_total{method="GET",route="unmatched",status="404"}', body)
+        self.assertIn("lager_http_requests_in_flight 1", body)  # the scrape itself
+        queries = [line for line in body.splitlines()
+                   if line.startswith('lager_db_queries_total{method="GET",route="/items"}')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(int(queries[0].rsplit(" ", 1)[1]), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        m = server.Metrics(buckets=(0.1, 1.0))
+        m.observe("GET", "/x", 200, 0.05)
+        m.observe("GET", "/x", 200, 0.5)
+        m.observe("GET", "/x", 500, 5.0)
+        body = m.render()
+        self.assertIn('lager_http_request_duration_seconds_bucket{method="GET",route="/x",le="0.1"} 1', body)
+        self.assertIn('lager_http_request_duration_seconds_bucket{method="GET",route="/x",le="1.0"} 2', body)
+        self.assertIn('lager_http_request_duration_seconds_bucket{method="GET",route="/x",le="+Inf"} 3', body)
+        self.assertIn('lager_http_request_duration_seconds_count{method="GET",route="/x"} 3', body)
+        self.assertIn('lager_http_responses_total{method="GET",route="/x",status="500"} 1', body)
+
+    def test_metrics_token(self):
+        server.METRICS_TOKEN = "scrape-secret"
+        try:
+            client = app.test_client()
+            self.assertEqual(client.get('/metrics').status_code, 401)
+            response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            server.METRICS_TOKEN = ""
+
+    def test_auth_logging_is_structured_and_leaks_no_session(self):
+        stream = io.StringIO()
+        listener = server.setup_logging(stream)
+        sample_rate, server.LOG_SAMPLE_RATE = server.LOG_SAMPLE_RATE, 0  # no sampled request lines
+        try:
+            admin_client().post('/auth/logout')
+            app.test_client().post('/auth/login', json={'username': 'admin', 'password': 'wrong'})
+        finally:
+            listener.stop()
+            server.logger.handlers.clear()
+            server.LOG_SAMPLE_RATE = sample_rate
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        events = [r["event"] for r in records]
+        self.assertEqual(events, ["admin_login", "admin_logout", "admin_login_failed"])
+        self.assertEqual(records[2]["reason"], "invalid_credentials")
+        self.assertNotIn("session", stream.getvalue())
+        self.assertNotIn("wrong", stream.getvalue())
+
+
+class SQLProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        server.SQL_PROFILE = True
+
+    def tearDown(self):
+        server.SQL_PROFILE = False
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            server.normalize_sql("SELECT *\n  FROM items WHERE id = 42 AND name = 'it''s' AND t1.x IN (?, ?,?)"),
+            "SELECT * FROM items WHERE id = ? AND name = ? AND t1.x IN (?, ...)"
+        )
+
+    def test_records_statements_rows_and_repeated_shapes(self):
+        for i in range(3):
+            insert_item(f"Profile Item {i}", f"PROF-{i}")
+        with app.test_request_context():
+            conn = server.get_db()
+            total = len(conn.execute("SELECT id FROM items").fetchall())
+            for item_id in range(1, 7):  # the classic N+1
+                conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
+            iterated = sum(1 for _ in conn.cursor().execute("SELECT id FROM items"))
+            profile = conn.profile
+            statements = profile.statements
+            self.assertEqual(statements[0][2], total)
+            self.assertEqual(statements[-1][2], iterated)
+            self.assertEqual(profile.repeated(), [("SELECT * FROM items WHERE id = ?", 6)])
+            self.assertEqual(len(profile.slow(threshold_ms=0)), len(statements))
+            self.assertIn('desc="8 queries, 1 repeated"', profile.server_timing())
+
+    def test_server_timing_header_and_slow_query_log(self):
+        client = app.test_client()
+        self.assertIn("db;dur=", client.get('/items').headers["Server-Timing"])
+
+        stream = io.StringIO()
+        listener = server.setup_logging(stream)
+        slow_ms, server.SQL_SLOW_MS = server.SQL_SLOW_MS, 0
+        try:
+            client.get('/users')
+        finally:
+            server.SQL_SLOW_MS = slow_ms
+            listener.stop()
+            server.logger.handlers.clear()
+        slow = [json.loads(line) for line in stream.getvalue().splitlines()
+                if json.loads(line)["event"] == "slow_query"]
+        self.assertTrue(slow)
+        self.assertEqual(slow[0]["route"], "/users")
+
+    def test_off_by_default(self):
+        server.SQL_PROFILE = False
+        response = app.test_client().get('/items')
+        self.assertNotIn("Server-Timing", response.headers)
+
+
+class EventStreamTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.item_id = insert_item("Event Item", "EVT-1", quantity=5)
+        insert_user("Event Borrower", "EVT-USER")
+
+    def latest_event_id(self):
+        conn = server.connect_db()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        finally:
+            conn.close()
+
+    def read_messages(self, response, count):
+        """Parse SSE messages off a streaming response until `count` have arrived."""
+        messages = []
+        for chunk in response.response:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines() if ": " in line)
+            if "data" in fields:
+                messages.append(fields)
+                if len(messages) == count:
+                    break
+        response.close()
+        return messages
+
+    def test_resume_from_cursor(self):
+        client = admin_client()
+        cursor = self.latest_event_id()
+        client.post('/loans', json={'user_barcode': 'EVT-USER', 'item_barcode': 'EVT-1', 'due_date': '2099-01-01'})
+        client.post('/flags', json={'item_id': self.item_id, 'flag_type': 'defect', 'message': 'Event test'})
+
+        response = client.get(f'/events?after={cursor}', buffered=False)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        loan, flag = (json.loads(m["data"]) for m in self.read_messages(response, 2))
+        self.assertEqual((loan["type"], loan["data"]["item_id"]), ("loan.created", self.item_id))
+        self.assertEqual((flag["type"], flag["data"]["flag_type"]), ("flag.created", "defect"))
+
+        # EventSource reconnects with Last-Event-ID: only the flag is replayed.
+        response = client.get('/events', headers={'Last-Event-ID': str(loan["id"])}, buffered=False)
+        self.assertEqual(json.loads(self.read_messages(response, 1)[0]["data"])["id"], flag["id"])
+        self.assertEqual(server.event_hub.streams, 0)
+
+    def test_new_event_wakes_idle_stream(self):
+        client = admin_client()
+        response = client.get('/events', buffered=False)
+        timer = threading.Timer(0.2, lambda: admin_client().put(f'/admin/items/{self.item_id}',
+                                                                json={'location': 'Hylle 9'}))
+        started = time.monotonic()
+        timer.start()
+        message = json.loads(self.read_messages(response, 1)[0]["data"])
+        timer.join()
+        self.assertEqual((message["type"], message["data"]), ("item.updated", {"item_id": self.item_id}))
+        self.assertLess(time.monotonic() - started, server.EVENTS_POLL_SECONDS)
+
+    def test_pruned_cursor_gets_reset(self):
+        client = admin_client()
+        client.post('/flags', json={'item_id': self.item_id, 'message': 'Prune test'})
+        conn = server.connect_db()
+        conn.execute("DELETE FROM events WHERE id < (SELECT MAX(id) FROM events)")
+        conn.commit()
+        conn.close()
+        response = client.get('/events?after=0', buffered=False)
+        self.assertEqual(self.read_messages(response, 1)[0]["event"], "reset")
+
+    def test_stream_limit_and_auth(self):
+        self.assertEqual(app.test_client().get('/events').status_code, 401)
+        max_streams, server.event_hub.max_streams = server.event_hub.max_streams, 0
+        try:
+            self.assertEqual(admin_client().get('/events').status_code, 503)
+        finally:
+            server.event_hub.max_streams = max_streams
+
+
+
+@unittest.skipUnless(importlib.util.find_spec("gevent"), "gevent is not installed")
+class GeventEventStreamTests(unittest.TestCase):
+    """Idle /events streams under serve_gevent.py, in a separate process with its own database."""
+
+    STREAMS = 100  # twice the threaded default of EVENTS_MAX_STREAMS
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        env = dict(os.environ, LAGER_DB=os.path.join(tmp, "gevent.db"), DEFAULT_ADMIN_PASSWORD="1234",
+                   NOTIFICATIONS_ENABLED="false")
+        env.pop("EVENTS_MAX_STREAMS", None)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve_gevent.py")
+        self.proc = subprocess.Popen([sys.executable, script, "--port", "0"], env=env, text=True,
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.addCleanup(self.proc.wait)
+        self.addCleanup(self.proc.terminate)
+        for line in self.proc.stdout:
+            if "http://" in line:
+                self.port = int(line.rsplit(":", 1)[1])
+                break
+        else:
+            self.fail("serve_gevent.py did not start")
+
+        conn = self.connect()
+        conn.request("POST", "/auth/login", body=json.dumps({"username": "admin", "password": "1234"}),
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.status, 200)
+        self.cookie = response.getheader("Set-Cookie").split(";", 1)[0]
+        conn.close()
+
+    def connect(self):
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+
+    def request(self, method, path, body=None):
+        conn = self.connect()
+        try:
+            conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                         headers={"Content-Type": "application/json", "Cookie": self.cookie})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_idle_streams_do_not_hold_threads(self):
+        streams = []
+        for _ in range(self.STREAMS):
+            conn = self.connect()
+            self.addCleanup(conn.close)
+            conn.request("GET", "/events", headers={"Cookie": self.cookie})
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.readline(), b"retry: 3000\n")
+            streams.append(response)
+
+        # All streams are parked, yet the server answers at once and runs on a handful of OS threads.
+        started = time.monotonic()
+        self.assertEqual(self.request("GET", "/items")[0], 200)
+        self.assertLess(time.monotonic() - started, 1)
+        if os.path.exists(f"/proc/{self.proc.pid}/status"):
+            with open(f"/proc/{self.proc.pid}/status") as f:
+                threads = int(next(line for line in f if line.startswith("Threads:")).split()[1])
+            self.assertLess(threads, 10)
+
+        status, item = self.request("POST", "/admin/items", {"name": "Gevent item", "barcode": "GEVENT-1"})
+        self.assertEqual(status, 201)
+        for response in streams:
+            line = response.readline()
+            while not line.startswith(b"data: "):
+                line = response.readline()
+            message = json.loads(line[len(b"data: "):])
+            self.assertEqual((message["type"], message["data"]["item_id"]), ("item.created", item["id"]))
+
+
+class StockTests(unittest.TestCase):
+
+    def item(self, item_id):
+        return app.test_client().get(f'/items/{item_id}').get_json()
+
+    def test_admin_total_change_keeps_availability_in_sync(self):
+        item_id = insert_item("Stock camera", "STOCK-1", quantity=3)
+        insert_user("Stock Borrower", "STOCK-USER")
+        client = admin_client()
+        client.post('/loans', json={'user_barcode': 'STOCK-USER', 'item_id': item_id, 'due_date': '2099-01-01'})
+        self.assertEqual({k: self.item(item_id)[k] for k in ("quantity", "on_loan", "available")},
+                         {"quantity": 3, "on_loan": 1, "available": 2})
+
+        # Setting the total used to overwrite the available count; now it just moves it.
+        client.put(f'/admin/items/{item_id}', json={'quantity': 1})
+        self.assertEqual(self.item(item_id)["available"], 0)
+        response = client.post('/loans', json={'user_barcode': 'STOCK-USER', 'item_id': item_id,
+                                               'due_date': '2099-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_total_cannot_go_below_copies_on_loan(self):
+        item_id = insert_item("Stock headset", "STOCK-4", quantity=2)
+        insert_user("Stock Headset Borrower", "STOCK-USER-4")
+        client = admin_client()
+        for _ in range(2):
+            client.post('/loans', json={'user_barcode': 'STOCK-USER-4', 'item_id': item_id, 'due_date': '2099-01-01'})
+
+        response = client.put(f'/admin/items/{item_id}', json={'quantity': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["on_loan"], 2)
+        for bad in ("abc", -1, 1.5, True):
+            self.assertEqual(client.put(f'/admin/items/{item_id}', json={'quantity': bad}).status_code, 400)
+        self.assertEqual(client.post('/admin/items', json={'name': 'Stock bad', 'quantity': "abc"}).status_code, 400)
+        self.assertEqual({k: self.item(item_id)[k] for k in ("quantity", "on_loan", "available")},
+                         {"quantity": 2, "on_loan": 2, "available": 0})
+        self.assertEqual(client.put(f'/admin/items/{item_id}', json={'quantity': 2}).status_code, 200)
+
+    def test_trigger_refuses_overbooking(self):
+        item_id = insert_item("Stock charger", "STOCK-2", quantity=1)
+        conn = server.connect_db()
+        try:
+            conn.execute("INSERT INTO loans (item_id) VALUES (?)", (item_id,))
+            with self.assertRaises(server.sqlite3.IntegrityError):
+                conn.execute("INSERT INTO loans (item_id) VALUES (?)", (item_id,))
+            conn.execute("UPDATE loans SET return_date = CURRENT_TIMESTAMP WHERE item_id = ?", (item_id,))
+            self.assertEqual(conn.execute("SELECT available FROM items WHERE id = ?", (item_id,)).fetchone()[0], 1)
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def test_reconcile_detects_and_repairs_drift(self):
+        item_id = insert_item("Stock tripod", "STOCK-3", quantity=2)
+        conn = server.connect_db()
+        conn.execute("UPDATE items SET on_loan = 2 WHERE id = ?", (item_id,))
+        conn.commit()
+        conn.close()
+
+        client = admin_client()
+        drift = client.post('/admin/reconcile_stock', json={'dry_run': True}).get_json()["drift"]
+        self.assertIn({"item_id": item_id, "name": "Stock tripod", "on_loan": 2, "active_loans": 0}, drift)
+        self.assertEqual(self.item(item_id)["available"], 0)
+
+        response = client.post('/admin/reconcile_stock').get_json()
+        self.assertGreaterEqual(response["repaired"], 1)
+        self.assertEqual(self.item(item_id)["available"], 2)
+        self.assertEqual(client.post('/admin/reconcile_stock', json={'dry_run': True}).get_json()["drift"], [])
+
+
+class DashboardStatsTests(unittest.TestCase):
+
+    def by(self, stats, field, key):
+        rows = stats[field]
+        name = "category" if field == "items_out_by_category" else "class_year"
+        return next((r for r in rows if r[name] == key), {}).get(
+            "items_out" if name == "category" else "active_loans", 0)
+
+    def test_incremental_stats_match_recompute(self):
+        client = admin_client()
+        before = client.get('/admin/stats').get_json()
+
+        item_id = insert_item("Stats drone", "STATS-1", quantity=3, category="Statsdrone")
+        user_id = insert_user("Stats Student", "STATS-USER", class_year="Stats1A")
+        for due in ("2000-01-01", "2099-01-01"):
+            client.post('/loans', json={'user_barcode': 'STATS-USER', 'item_id': item_id, 'due_date': due})
+        loan = client.post('/loans', json={'user_barcode': 'STATS-USER', 'item_id': item_id,
+                                           'due_date': '2099-01-01'}).get_json()
+        client.post(f'/loans/{loan["id"]}/return', json={'user_barcode': 'STATS-USER'})
+        client.post('/flags', json={'item_id': item_id, 'message': 'Stats flag'})
+
+        stats = client.get('/admin/stats').get_json()
+        self.assertEqual(stats["active_loans"] - before["active_loans"], 2)
+        self.assertEqual(stats["overdue_loans"] - before["overdue_loans"], 1)
+        self.assertEqual(stats["open_flags"] - before["open_flags"], 1)
+        self.assertEqual(stats["items"] - before["items"], 1)
+        self.assertEqual(self.by(stats, "items_out_by_category", "Statsdrone"), 2)
+        self.assertEqual(self.by(stats, "active_loans_by_class", "Stats1A"), 2)
+
+        # Moving the item/user moves their loans between groups.
+        client.put(f'/admin/items/{item_id}', json={'category': 'Statsdrone2'})
+        client.put(f'/admin/users/{user_id}', json={'class_year': 'Stats1B'})
+        flag_id = max(f["id"] for f in client.get('/admin/flags').get_json())
+        client.put(f'/admin/flags/{flag_id}/resolve', json={'status': 'ferdig'})
+        stats = client.get('/admin/stats').get_json()
+        self.assertEqual(self.by(stats, "items_out_by_category", "Statsdrone"), 0)
+        self.assertEqual(self.by(stats, "items_out_by_category", "Statsdrone2"), 2)
+        self.assertEqual(self.by(stats, "active_loans_by_class", "Stats1B"), 2)
+        self.assertEqual(stats["open_flags"], before["open_flags"])
+
+        self.assertEqual(client.post('/admin/stats/recompute').get_json(), stats)
+
+
+class GeneratedDataTests(unittest.TestCase):
+
+    def generate(self, seed):
+        conn = server.connect_db(os.path.join(tempfile.mkdtemp(), "generated.db"))
+        server.run_migrations(conn)
+        counts = generate_data.generate(conn, users=60, items=80, loans=1500, seed=seed, today=date(2025, 3, 14))
+        self.addCleanup(conn.close)
+        return conn, counts
+
+    def test_deterministic_and_consistent(self):
+        conn, counts = self.generate(seed=3)
+        again, _ = self.generate(seed=3)
+        other, _ = self.generate(seed=4)
+        dump = lambda c: [tuple(r) for r in c.execute("SELECT * FROM loans ORDER BY id")]
+        self.assertEqual(dump(conn), dump(again))
+        self.assertNotEqual(dump(conn), dump(other))
+
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM loans").fetchone()[0], counts["loans"])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM flags").fetchone()[0], counts["flags"])
+        active = conn.execute("SELECT COUNT(*) FROM loans WHERE return_date IS NULL").fetchone()[0]
+        self.assertEqual(active, counts["active_loans"])
+        self.assertGreater(active, 0)
+        # Stock, stats and the search index are maintained as for real writes.
+        self.assertEqual(server.reconcile_stock(conn), [])
+        self.assertGreaterEqual(conn.execute("SELECT MIN(available) FROM items").fetchone()[0], 0)
+        stats = server.read_stats(conn)
+        server.recompute_stats(conn)
+        self.assertEqual(stats, server.read_stats(conn))
+        self.assertTrue(server.search_users(conn, "Hansen", 5))
+
+
+class LoadTestTests(unittest.TestCase):
+
+    def test_stations_against_live_server(self):
+        for i in range(5):
+            insert_item(f"Load Item {i}", f"LOAD-{i}")
+        insert_user("Load Station User", "LOAD-USER")
+        httpd = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.shutdown)
+        conn = server.connect_db()
+        self.addCleanup(conn.close)
+        active = lambda: conn.execute("SELECT COUNT(*) FROM loans WHERE return_date IS NULL").fetchone()[0]
+        before = active()
+
+        test = load_test.LoadTest(f"http://127.0.0.1:{httpd.server_port}", stations=4, duration=1, think=0,
+                                  mix=load_test.parse_mix("scan=2,loan=1,return=1"))
+        report = test.run()
+        self.assertGreater(report["requests"], 0)
+        self.assertEqual(set(report["operations"]), {"scan", "loan", "return"})
+        self.assertFalse({"locked", "5xx", "connection_error"} & set(report["error_rates"]))
+        self.assertEqual(active(), before)  # open loans are returned at the end
+
+    def test_outcome_classification_and_mix(self):
+        test = load_test.LoadTest("http://127.0.0.1:1", 1, 1, 0, {"scan": 1})
+        test.record("loan", 0.01, 500, b'{"detail": "database is locked"}')
+        test.record("loan", 0.01, 500, b'{"error": "boom"}')
+        test.record("loan", 0.01, 400, b'{"error": "Item not available"}')
+        test.record("loan", 0.01, None, b"")
+        test.record("loan", 0.01, 201, b"{}")
+        report = test.report(elapsed=1.0)
+        self.assertEqual(report["error_rates"], {"4xx": 0.2, "5xx": 0.2, "connection_error": 0.2, "locked": 0.2})
+        with self.assertRaises(argparse.ArgumentTypeError):
+            load_test.parse_mix("scan=1,teleport=2")
+
+
+class MigrationTests(unittest.TestCase):
+
+    def test_schema_is_current_and_rerun_is_noop(self):
+        conn = server.connect_db()
+        try:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], server.SCHEMA_VERSION)
+            self.assertEqual(server.run_migrations(conn), 0)
+        finally:
+            conn.close()
+
+    def test_upgrades_legacy_database(self):
+        path = os.path.join(tempfile.mkdtemp(), "legacy.db")
+        conn = server.connect_db(path)
+        conn.execute("CREATE TABLE loans (id INTEGER PRIMARY KEY AUTOINCREMENT, item_id INTEGER NOT NULL, "
+                     "user_id INTEGER, loan_date TEXT, due_date TEXT, return_date TEXT)")
+        conn.execute("INSERT INTO loans (item_id, user_id) VALUES (1, 1)")
+        conn.commit()
+        try:
+            self.assertEqual(server.run_migrations(conn), server.SCHEMA_VERSION)
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(loans)")}
+            self.assertIn("delivery_status", columns)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM loans").fetchone()[0], 1)
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM loans "
+                                "WHERE item_id = 1 AND return_date IS NULL").fetchall()
+            self.assertIn("idx_loans_active_item", plan[0]["detail"])
+        finally:
+            conn.close()
+
+
 if __name__ == "__main__":
     unittest.main()
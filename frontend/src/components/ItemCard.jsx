@@ -2,7 +2,7 @@ import React from 'react';
 import { motion } from 'framer-motion';
 
 export default function ItemCard({ item, onClick }) {
-  const isAvailable = !item.loaned_to && item.quantity > 0;
+  const isAvailable = !item.loaned_to && item.available > 0;
 
   return (
     <motion.div
@@ -45,7 +45,7 @@ export default function ItemCard({ item, onClick }) {
           <div className="flex items-center gap-2">
             <span className="text-slate-300 text-sm">📦</span>
             <span className="text-sm font-semibold text-slate-200">
-              {item.quantity} {item.quantity === 1 ? 'stk' : 'stk'}
+              {item.available} / {item.quantity} stk
             </span>
           </div>
           {item.loaned_to && (
@@ -31,7 +31,7 @@ export default function DashboardUser() {
       });
 
       setGjenstander(prev =>
-        prev.map(p => p.id === gjenstand_id ? { ...p, quantity: p.quantity - 1 } : p)
+        prev.map(p => p.id === gjenstand_id ? { ...p, available: p.available - 1 } : p)
       );
     } catch (err) {
       console.error("Feil ved lån:", err);
@@ -53,7 +53,7 @@ export default function DashboardUser() {
       });
 
       setGjenstander(prev =>
-        prev.map(p => p.id === gjenstand_id ? { ...p, quantity: p.quantity + 1 } : p)
+        prev.map(p => p.id === gjenstand_id ? { ...p, available: p.available + 1 } : p)
       );
     } catch (err) {
       console.error("Feil ved tilbakelevering:", err);
@@ -86,9 +86,9 @@ export default function DashboardUser() {
               <tr key={p.id} className="border-b">
                 <td className="p-2">{p.name}</td>
                 <td className="p-2">{p.location}</td>
-                <td className="p-2">{p.quantity}</td>
+                <td className="p-2">{p.available}</td>
                 <td className="p-2 flex gap-2 justify-center">
-                  {p.quantity > 0 && (
+                  {p.available > 0 && (
                     <button
                       onClick={() => lånGjenstand(p.id)}
                       className="bg-blue-500 text-white px-3 py-1 rounded hover:bg-blue-400"
@@ -143,11 +143,11 @@ export default function ItemDetail() {
               <div className="text-xs text-slate-500 mb-1.5">Antall tilgjengelig</div>
               <div className="flex items-center gap-2">
                 <div className={`text-3xl font-bold ${
-                  item.quantity > 0 ? 'text-emerald-400' : 'text-red-400'
+                  item.available > 0 ? 'text-emerald-400' : 'text-red-400'
                 }`}>
-                  {item.quantity}
+                  {item.available}
                 </div>
-                <span className="text-slate-300">stk</span>
+                <span className="text-slate-300">av {item.quantity} stk</span>
               </div>
             </div>
             {item.due_date && (
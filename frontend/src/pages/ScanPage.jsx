@@ -258,7 +258,7 @@ export default function ScanPage() {
             <div className="flex justify-between items-start">
               <div>
                 <div className="text-lg font-medium">{scannedItem.name}</div>
-                <div className="text-xs text-gray-500">Kategori: {scannedItem.category || "-"} | Antall: {scannedItem.quantity}</div>
+                <div className="text-xs text-gray-500">Kategori: {scannedItem.category || "-"} | Ledig: {scannedItem.available} av {scannedItem.quantity}</div>
               </div>
               <div className="text-right">
                 <Link to={`/items/${scannedItem.id}`} className="text-indigo-600 hover:underline text-sm">Åpne</Link>